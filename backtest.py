@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+history.csv を日付順に区切った walk-forward 交差検証（バックテスト）で、霧・城モデルと
+総合出現（霧かつ城）の予測精度を測る。
+
+  python backtest.py                  # 10 fold
+  python backtest.py --folds 5 --workers 4 --output data/backtest.json
+
+  - fold k は「先頭から k+1 ブロック分」で学習し、その次の1ブロックで評価する（学習は常に評価期間より過去）
+  - 学習・評価は train_model の fit_classifier / castle_training_rows / fit_event_calibrator で
+    train_model.main と同じ手順を踏む（model/skycastle_params.json の設定があればそれを使う）
+  - fold はプロセスプールで並列に実行する。各プロセスの LightGBM のスレッド数は
+    CPU 数を fold の並列数で割った値にする
+  - 特徴量行列と fold の区切りは data/backtest_cache/ に列形式ファイルとして保存し、
+    history.csv が変わるまで使い回す（各プロセスは mmap で読む）
+
+指標は Brier スコア・対数損失・的中率（実際に起きた日のうち確率 0.5 以上と予測できた割合）。
+城モデルは霧が発生した日だけで学習するので、評価も霧が発生した日だけで行う（tune_model と同じ）。
+総合出現（event）は全日で評価する。
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import columnar
+import features
+import train_model
+from history_snapshot import history_signature
+
+CACHE_DIR = Path("data/backtest_cache")
+DEFAULT_FOLDS = 10
+TARGETS = ["fog", "castle", "event"]
+EPSILON = 1e-15
+
+
+@dataclass
+class FoldResult:
+    fold: int
+    train_rows: int
+    test_rows: int
+    test_start: str
+    test_end: str
+    metrics: Dict[str, Dict[str, float]] = field(default_factory=dict)
+    error: Optional[str] = None
+
+
+def fold_bounds(rows: int, folds: int) -> List[Tuple[int, int]]:
+    """各 fold の評価期間 (始まり, 終わり) の行位置。学習にはその始まりより前の行をすべて使う。"""
+    block = rows // (folds + 1)
+    if block < 1:
+        raise ValueError(f"{folds} fold に分けるには行数（{rows}）が足りません。")
+    bounds = []
+    for fold in range(folds):
+        test_start = (fold + 1) * block
+        test_end = rows if fold == folds - 1 else test_start + block
+        bounds.append((test_start, test_end))
+    return bounds
+
+
+def cache_path_for(history_csv: Path, folds: int) -> Path:
+    key = json.dumps([history_signature(history_csv), folds, train_model.FEATURE_COLUMNS, features.FEATURE_VERSION])
+    return CACHE_DIR / f"folds_{hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]}.cols"
+
+
+def prepare_folds(folds: int, history_csv: Path = train_model.HISTORY_CSV) -> Path:
+    """特徴量行列と fold の区切りを保存したファイルを返す（同じ history・fold 数なら作り直さない）。"""
+    path = cache_path_for(history_csv, folds)
+    if path.exists():
+        return path
+
+    df = train_model.load_history()
+    arrays = {
+        "date": df["date"].to_numpy(dtype="datetime64[D]"),
+        "features": df[train_model.FEATURE_COLUMNS].to_numpy(dtype=np.float64),
+        "fog_observed": df["fog_observed"].to_numpy(dtype=np.int8),
+        "castle_visible": df["castle_visible"].to_numpy(dtype=np.int8),
+    }
+    metadata = {"feature_columns": train_model.FEATURE_COLUMNS, "folds": fold_bounds(len(df), folds)}
+    for stale in CACHE_DIR.glob("folds_*.cols"):
+        stale.unlink()
+    columnar.write_arrays(path, arrays, metadata)
+    return path
+
+
+def brier_score(probs: np.ndarray, labels: np.ndarray) -> float:
+    return float(np.mean((probs - labels) ** 2))
+
+
+def log_loss(probs: np.ndarray, labels: np.ndarray) -> float:
+    probs = np.clip(probs, EPSILON, 1 - EPSILON)
+    return float(-np.mean(labels * np.log(probs) + (1 - labels) * np.log(1 - probs)))
+
+
+def hit_rate(probs: np.ndarray, labels: np.ndarray) -> float:
+    positives = labels == 1
+    if not positives.any():
+        return float("nan")
+    return float(np.mean(probs[positives] >= 0.5))
+
+
+def score_predictions(probs: Dict[str, np.ndarray], labels: Dict[str, np.ndarray]) -> Dict[str, Dict[str, float]]:
+    """目的変数ごとの指標。ラベルが NaN の行（評価の対象外）は除く。対象の行が無ければ指標は NaN。"""
+    metrics = {}
+    for target in TARGETS:
+        rows = ~np.isnan(labels[target])
+        if not rows.any():
+            metrics[target] = {"brier": float("nan"), "log_loss": float("nan"), "hit_rate": float("nan")}
+            continue
+        scored_probs, scored_labels = probs[target][rows], labels[target][rows]
+        metrics[target] = {
+            "brier": brier_score(scored_probs, scored_labels),
+            "log_loss": log_loss(scored_probs, scored_labels),
+            "hit_rate": hit_rate(scored_probs, scored_labels),
+        }
+    return metrics
+
+
+def target_labels(fog: np.ndarray, castle: np.ndarray) -> Dict[str, np.ndarray]:
+    """目的変数ごとのラベル。castle は霧が発生した日だけを評価するので、それ以外の日は NaN にする。"""
+    fog = fog.astype(float)
+    castle = castle.astype(float)
+    return {"fog": fog, "castle": np.where(fog == 1, castle, np.nan), "event": fog * castle}
+
+
+def run_fold(path: Path, fold: int, n_jobs: Optional[int] = None) -> Tuple[FoldResult, Dict[str, np.ndarray]]:
+    """1つの fold を学習・評価し、(結果, 評価期間の予測確率) を返す（プロセスプールから呼ばれる）。"""
+    metadata, arrays = columnar.read_arrays(path)
+    test_start, test_end = metadata["folds"][fold]
+    frame = pd.DataFrame(arrays["features"], columns=metadata["feature_columns"])
+    frame["fog_observed"] = arrays["fog_observed"].astype(int)
+    frame["castle_visible"] = arrays["castle_visible"].astype(int)
+    train, test = frame.iloc[:test_start], frame.iloc[test_start:test_end]
+    dates = arrays["date"][test_start:test_end].astype(str)
+    result = FoldResult(fold, len(train), len(test), dates[0], dates[-1])
+
+    columns = train_model.FEATURE_COLUMNS
+    params = {"verbose": -1, **({} if n_jobs is None else {"n_jobs": n_jobs})}
+    fog_params = {**train_model.load_tuned_params("fog"), **params}
+    castle_params = {**train_model.load_tuned_params("castle"), **params}
+    try:
+        fog_model = train_model.fit_classifier(train[columns], train["fog_observed"], "fog", **fog_params)
+        castle_rows, _ = train_model.castle_training_rows(train)
+        castle_model = train_model.fit_classifier(
+            castle_rows[columns], castle_rows["castle_visible"], "castle", **castle_params
+        )
+    except ValueError as exc:
+        result.error = str(exc)
+        return result, {}
+    calibrator = train_model.fit_event_calibrator(train, fog_model, castle_model)
+
+    fog_probs = fog_model.predict_proba(test[columns])[:, 1]
+    castle_probs = castle_model.predict_proba(test[columns])[:, 1]
+    if calibrator is not None:
+        event_probs = calibrator.predict_proba(
+            train_model.build_calibrator_features(pd.Series(fog_probs), pd.Series(castle_probs))
+        )[:, 1]
+    else:
+        event_probs = fog_probs * castle_probs
+    probs = {"fog": fog_probs, "castle": castle_probs, "event": event_probs}
+    labels = target_labels(test["fog_observed"].to_numpy(), test["castle_visible"].to_numpy())
+    result.metrics = score_predictions(probs, labels)
+    return result, {"row": np.arange(test_start, test_end), **probs}
+
+
+def run_backtest(folds: int, workers: int) -> Tuple[List[FoldResult], Dict[str, Dict[str, float]]]:
+    """全 fold を実行し、(fold ごとの結果, 全評価期間をまとめた指標) を返す。"""
+    path = prepare_folds(folds)
+    workers = max(1, min(workers, folds))
+    n_jobs = max(1, (os.cpu_count() or 1) // workers)
+    if workers == 1:
+        outcomes = [run_fold(path, fold, n_jobs) for fold in range(folds)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            outcomes = list(executor.map(run_fold, [path] * folds, range(folds), [n_jobs] * folds))
+
+    results = [result for result, _ in outcomes]
+    predicted = [probs for _, probs in outcomes if probs]
+    if not predicted:
+        return results, {}
+    _, arrays = columnar.read_arrays(path, names=["fog_observed", "castle_visible"])
+    rows = np.concatenate([probs["row"] for probs in predicted])
+    probs = {target: np.concatenate([p[target] for p in predicted]) for target in TARGETS}
+    labels = target_labels(arrays["fog_observed"][rows], arrays["castle_visible"][rows])
+    return results, score_predictions(probs, labels)
+
+
+def format_metrics(metrics: Dict[str, Dict[str, float]]) -> str:
+    return "  ".join(
+        f"{target} brier={values['brier']:.3f} logloss={values['log_loss']:.3f} hit={values['hit_rate']:.2f}"
+        for target, values in metrics.items()
+    )
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="history.csv で walk-forward のバックテストを行います。")
+    parser.add_argument("--folds", type=int, default=DEFAULT_FOLDS, help="fold 数。")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="並列に実行する fold 数（既定は CPU 数）。",
+    )
+    parser.add_argument("--output", type=Path, help="結果を JSON で保存するパス。")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    if args.folds < 1:
+        raise SystemExit("--folds は 1 以上を指定してください。")
+    results, overall = run_backtest(args.folds, args.workers)
+
+    for result in results:
+        label = f"fold {result.fold:>2}  train={result.train_rows:>5} test={result.test_rows:>4} "
+        label += f"{result.test_start}〜{result.test_end}"
+        print(f"{label}  {result.error or format_metrics(result.metrics)}")
+    if overall:
+        print(f"overall  {format_metrics(overall)}")
+
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        payload = {"folds": [result.__dict__ for result in results], "overall": overall}
+        with args.output.open("w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+        print(f"Saved backtest results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
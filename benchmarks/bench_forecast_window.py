@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+predict_forecast_window.run_prediction の所要時間を、予報の日数（地点数 × 16 日を想定）ごとに測る。
+
+  python benchmarks/bench_forecast_window.py --days 16 160 1600 16000 --samples 100 1000
+
+--samples を指定すると、16 日分の予報に対する predict_bands（1日あたりその数の標本）の時間も測る。
+
+予報は forecast_window.json の値をもとに日付をずらして並べ、半分程度の日付が history.csv と
+重なる（history の値で上書きされる）ようにする。モデルと履歴の読み込みは計測に含めない。
+model/ と data/ のあるディレクトリで実行する。
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import predict_forecast_window as pfw  # noqa: E402
+from history_store import load_history_view  # noqa: E402
+
+
+def make_entries(days: int, history) -> list:
+    templates = pfw.load_forecast_entries(pfw.FORECAST_JSON)
+    last = history.frame["date"].max().date() if not history.empty else dt.date.today()
+    start = last - dt.timedelta(days=days // 2)
+    return [
+        pfw.ForecastEntry(**{**vars(templates[i % len(templates)]), "date": (start + dt.timedelta(days=i)).isoformat()})
+        for i in range(days)
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="予報期間の一括推論の速度を測ります。")
+    parser.add_argument("--days", type=int, nargs="+", default=[16, 160, 1600, 16000])
+    parser.add_argument("--samples", type=int, nargs="*", default=[100, 1000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    models = pfw.load_models()
+    history = load_history_view(pfw.HISTORY_CSV)
+
+    print(f"{'days':>7}  {'median':>10}  {'per day':>10}")
+    for days in args.days:
+        entries = make_entries(days, history)
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            pfw.run_prediction(entries, models, history)
+            timings.append(time.perf_counter() - started)
+        median = statistics.median(timings)
+        print(f"{days:>7}  {median * 1000:>8.1f}ms  {median / days * 1e6:>8.1f}us")
+
+    entries = make_entries(16, history)
+    if args.samples:
+        print(f"{'samples':>7}  {'median':>10}  {'per row':>10}  (predict_bands, 16 days)")
+    for samples in args.samples:
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            pfw.predict_bands(entries, models, history, samples, seed=0)
+            timings.append(time.perf_counter() - started)
+        median = statistics.median(timings)
+        print(f"{samples:>7}  {median * 1000:>8.1f}ms  {median / (samples * 16) * 1e6:>8.1f}us")
+
+
+if __name__ == "__main__":
+    main()
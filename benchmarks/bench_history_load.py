@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+history の読み込み時間を CSV と列形式スナップショット（data/history.cols）で比較する。
+
+  python benchmarks/bench_history_load.py --rows 540 50000
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from history_store import HISTORY_CSV, read_history_frame  # noqa: E402
+
+PROJECTION = ["date", "temp", "humidity", "wind", "cloud", "rain"]
+
+
+def build_history(rows: int) -> pd.DataFrame:
+    base = pd.read_csv(HISTORY_CSV)
+    repeats = int(np.ceil(rows / len(base)))
+    df = pd.concat([base] * repeats, ignore_index=True).iloc[:rows].copy()
+    df["date"] = pd.date_range("1950-01-01", periods=rows, freq="D").strftime("%Y-%m-%d")
+    return df
+
+
+def read_csv_typed(path: Path) -> pd.DataFrame:
+    df = pd.read_csv(path).convert_dtypes()
+    df["date"] = pd.to_datetime(df["date"])
+    return df
+
+
+def measure(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="history 読み込みのベンチマーク")
+    parser.add_argument("--rows", type=int, nargs="+", default=[540, 10_000, 50_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'rows':>8}  {'csv':>10}  {'columnar':>10}  {'projected':>10}  {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.rows:
+            csv_path = Path(tmp) / f"history_{rows}.csv"
+            build_history(rows).to_csv(csv_path, index=False)
+            read_history_frame(csv_path=csv_path)  # スナップショットを作成
+
+            csv_time = measure(lambda: read_csv_typed(csv_path), args.repeat)
+            columnar_time = measure(lambda: read_history_frame(csv_path=csv_path), args.repeat)
+            projected_time = measure(lambda: read_history_frame(PROJECTION, csv_path), args.repeat)
+            print(
+                f"{rows:>8}  {csv_time * 1000:>8.2f}ms  {columnar_time * 1000:>8.2f}ms  "
+                f"{projected_time * 1000:>8.2f}ms  {csv_time / projected_time:>7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
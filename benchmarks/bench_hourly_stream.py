@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+hourly の応答を「json.load で全体を読んでから集計」する場合と、hourly_stream で早朝の時刻だけを
+残しながら読む場合とで、ピークメモリ（tracemalloc）と所要時間を比較する。
+
+  python benchmarks/bench_hourly_stream.py --years 1 5 10 20
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import hourly_stream  # noqa: E402
+from bench_morning_aggregate import build_hourly  # noqa: E402
+from fetch_forecast_window import MORNING_HOURS, aggregate_hourly  # noqa: E402
+from http_cache import STREAM_CHUNK_BYTES  # noqa: E402
+
+
+def load_full(path: Path) -> list:
+    with path.open("r", encoding="utf-8") as f:
+        return aggregate_hourly(json.load(f)["hourly"])
+
+
+def load_stream(path: Path) -> list:
+    with path.open("r", encoding="utf-8") as f:
+        payload = hourly_stream.parse_payload(iter(lambda: f.read(STREAM_CHUNK_BYTES), ""), MORNING_HOURS)
+    return aggregate_hourly(payload["hourly"])
+
+
+def measure(func, path: Path) -> tuple[float, int, list]:
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = func(path)
+    seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak, result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="hourly 応答の読み込み方法ごとのピークメモリを比較します。")
+    parser.add_argument("--years", type=int, nargs="+", default=[1, 5, 10, 20])
+    args = parser.parse_args()
+
+    print(f"{'years':>5}  {'MB':>6}  {'json peak':>10}  {'stream peak':>11}  {'json':>8}  {'stream':>8}  mismatch")
+    with tempfile.TemporaryDirectory() as tmp:
+        for years in args.years:
+            path = Path(tmp) / f"hourly_{years}.json"
+            path.write_text(json.dumps({"latitude": 35.98, "hourly": build_hourly(years)}), encoding="utf-8")
+            full_seconds, full_peak, expected = measure(load_full, path)
+            stream_seconds, stream_peak, actual = measure(load_stream, path)
+            mismatch = sum(a != b for a, b in zip(expected, actual)) + abs(len(expected) - len(actual))
+            print(
+                f"{years:>5}  {path.stat().st_size / 1e6:>6.1f}  {full_peak / 1e6:>8.1f}MB  {stream_peak / 1e6:>9.1f}MB"
+                f"  {full_seconds * 1000:>6.0f}ms  {stream_seconds * 1000:>6.0f}ms  {mismatch}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+モデルの読み込み時間を、pkl 3つ（joblib.load。lightgbm / scikit-learn の import を含む）と
+モデルバンドル（model_bundle.read_bundle）で比べる。
+
+  python benchmarks/bench_model_load.py --repeat 7
+
+新しいインタプリタで読み込むまでの時間（コールドスタート）と、同じプロセス内で読み直す時間を表示する。
+ファイルの大きさも併記する。
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import model_bundle  # noqa: E402
+import predict_model  # noqa: E402
+
+ROOT = Path(__file__).resolve().parent.parent
+PICKLE_PATHS = [predict_model.FOG_MODEL_PATH, predict_model.CASTLE_MODEL_PATH, predict_model.EVENT_CALIBRATOR_PATH]
+
+COMMANDS = {
+    "python (bare)": "pass",
+    "joblib (3 pkl)": "import joblib\n" + "\n".join(f"joblib.load({str(path)!r})" for path in PICKLE_PATHS),
+    "bundle": "import model_bundle\nmodel_bundle.read_bundle()",
+    "bundle (no verify)": "import model_bundle\nmodel_bundle.read_bundle(verify=False)",
+}
+
+
+def run_once(code: str, cwd: Path) -> float:
+    started = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-W", "ignore", "-c", f"import sys\nsys.path.insert(0, {str(ROOT)!r})\n{code}"],
+        cwd=cwd,
+        check=True,
+    )
+    return time.perf_counter() - started
+
+
+def in_process(func, repeat: int) -> list[float]:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="pkl とモデルバンドルの読み込み時間の比較")
+    parser.add_argument("--repeat", type=int, default=7)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        # 実データを汚さないよう、model/ のコピー上で実行する
+        shutil.copytree(ROOT / "model", workdir / "model")
+        bundle_path = workdir / model_bundle.BUNDLE_PATH
+        if not bundle_path.exists():
+            subprocess.run(
+                [sys.executable, "-W", "ignore", "-c", "import predict_model\npredict_model.export_inference_artifacts()"],
+                cwd=workdir,
+                check=True,
+                env={**os.environ, "PYTHONPATH": str(ROOT)},
+            )
+
+        pickle_bytes = sum((workdir / path).stat().st_size for path in PICKLE_PATHS)
+        print(f"size: pkl {pickle_bytes / 1024:.0f}KiB, bundle {bundle_path.stat().st_size / 1024:.0f}KiB")
+
+        print(f"{'cold start':<20}  {'median':>9}  {'min':>9}")
+        for label, code in COMMANDS.items():
+            samples = [run_once(code, workdir) for _ in range(args.repeat)]
+            print(f"{label:<20}  {statistics.median(samples) * 1000:>7.0f}ms  {min(samples) * 1000:>7.0f}ms")
+
+        import joblib
+
+        loaders = {
+            "joblib (3 pkl)": lambda: [joblib.load(workdir / path) for path in PICKLE_PATHS],
+            "bundle": lambda: model_bundle.read_bundle(bundle_path),
+            "bundle (no verify)": lambda: model_bundle.read_bundle(bundle_path, verify=False),
+        }
+        print(f"{'in process':<20}  {'median':>9}  {'min':>9}")
+        for label, load in loaders.items():
+            samples = in_process(load, args.repeat)
+            print(f"{label:<20}  {statistics.median(samples) * 1000:>7.1f}ms  {min(samples) * 1000:>7.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
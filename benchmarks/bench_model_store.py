@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+model_store でモデルバンドルと履歴のスナップショットを共有したときの、ワーカー数ごとのメモリと差し替えの速さを測る。
+
+  python benchmarks/bench_model_store.py --workers 1 2 4 8
+
+各ワーカーは新しいインタプリタで predict_model を import したあと、バンドルと前日特徴量の元データを読み込んで
+ROWS 行を推論する。全員が読み込み終えた状態で /proc/self/smaps_rollup からプロセス全体の
+USS（Private_Clean + Private_Dirty。そのプロセスだけが使うメモリ）と Pss（共有分を頭数で割った値）を報告する。
+「読み込み分の USS」は import 直後からの USS の増分で、ワーカーを増やすと1人あたりこの分だけメモリが増える。
+バンドルの mmap の Pss の合計がワーカー数によらずほぼ一定なら、中身はプロセス間で共有されている。
+続けて、変わっていないときの ModelStore.bundle() の所要時間と、別プロセスがバンドルを
+書き出し直してから次の bundle() が新しい版を返すまでの時間を表示する。Linux 専用。
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+ROWS = 20_000
+
+WORKER = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+import numpy as np
+import predict_model
+
+
+def rollup():
+    with open("/proc/self/smaps_rollup") as f:
+        fields = dict(line.split()[:2] for line in f if line.split()[0].endswith(":"))
+    return {{
+        "uss": int(fields["Private_Clean:"]) + int(fields["Private_Dirty:"]),
+        "pss": int(fields["Pss:"]),
+    }}
+
+
+imported = rollup()
+predict_model.load_bundle()
+predict_model.load_lag_source()
+predict_model.predict_probabilities_fast_batch(np.zeros(({rows}, len(predict_model.FEATURE_COLUMNS))))
+time.sleep({hold})
+usage = rollup()
+usage["loaded_uss"] = usage["uss"] - imported["uss"]
+usage["bundle_pss"], in_bundle = 0, False
+with open("/proc/self/smaps") as f:
+    for line in f:
+        fields = line.split()
+        if "-" in fields[0] and not fields[0].endswith(":"):
+            in_bundle = line.rstrip().endswith("skycastle_bundle.cols")
+        elif in_bundle and fields[0] == "Pss:":
+            usage["bundle_pss"] += int(fields[1])
+print(json.dumps(usage))
+"""
+
+SNAPSHOT = """
+import sys
+sys.path.insert(0, {root!r})
+import history_store
+history_store.read_history_frame()
+"""
+
+REPUBLISH = """
+import sys
+sys.path.insert(0, {root!r})
+import model_bundle
+bundle = model_bundle.read_bundle()
+bundle.created_at = {created_at!r}
+model_bundle.write_bundle(bundle)
+"""
+
+
+def measure_workers(workers: int, workdir: Path, hold: float) -> list[dict]:
+    code = WORKER.format(root=str(ROOT), hold=hold, rows=ROWS)
+    procs = [
+        subprocess.Popen([sys.executable, "-W", "ignore", "-c", code], cwd=workdir, stdout=subprocess.PIPE, text=True)
+        for _ in range(workers)
+    ]
+    return [json.loads(proc.communicate()[0]) for proc in procs]
+
+
+def measure_swap(workdir: Path, repeat: int) -> tuple[list[float], list[float]]:
+    os.chdir(workdir)
+    sys.path.insert(0, str(ROOT))
+    import model_store
+
+    store = model_store.ModelStore()
+    store.bundle()
+    lookups = []
+    for _ in range(1000):
+        started = time.perf_counter()
+        store.bundle()
+        lookups.append(time.perf_counter() - started)
+
+    swaps = []
+    for i in range(repeat):
+        created_at = f"republished-{i}"
+        code = REPUBLISH.format(root=str(ROOT), created_at=created_at)
+        subprocess.run([sys.executable, "-W", "ignore", "-c", code], cwd=workdir, check=True)
+        started = time.perf_counter()
+        assert store.bundle().created_at == created_at
+        swaps.append(time.perf_counter() - started)
+    return lookups, swaps
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="model_store の共有メモリと差し替えの計測")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--hold", type=float, default=1.0, help="各ワーカーが smaps を読む前に待つ秒数")
+    parser.add_argument("--repeat", type=int, default=7)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        # 実データを汚さないよう、data/ と model/ のコピー上で実行する
+        shutil.copytree(ROOT / "data", workdir / "data")
+        shutil.copytree(ROOT / "model", workdir / "model")
+        # 古ければバンドルを作り直し、履歴のスナップショットを history.csv に合わせておく
+        subprocess.run([sys.executable, "-W", "ignore", "-c", SNAPSHOT.format(root=str(ROOT))], cwd=workdir, check=True)
+        measure_workers(1, workdir, 0.0)
+
+        print(f"{'workers':>7}  {'USS/worker':>10}  {'loaded USS/worker':>17}  {'Pss total':>9}  {'bundle Pss total':>16}")
+        for workers in args.workers:
+            usage = measure_workers(workers, workdir, args.hold)
+            uss = statistics.mean(u["uss"] for u in usage)
+            loaded = statistics.mean(u["loaded_uss"] for u in usage)
+            pss = sum(u["pss"] for u in usage)
+            bundle_pss = sum(u["bundle_pss"] for u in usage)
+            print(f"{workers:>7}  {uss:>8.0f}KB  {loaded:>15.0f}KB  {pss:>7.0f}KB  {bundle_pss:>14.0f}KB")
+
+        lookups, swaps = measure_swap(workdir, args.repeat)
+        print(f"bundle() unchanged: median {statistics.median(lookups) * 1e6:.1f}us")
+        print(f"bundle() after republish: median {statistics.median(swaps) * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
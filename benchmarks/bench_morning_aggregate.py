@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+hourly データ → 日ごとの早朝平均（MorningAverage）の集計時間を、
+以前の1時刻ずつ datetime.fromisoformat する実装と NumPy 版（aggregate_hourly）で比較する。
+
+  python benchmarks/bench_morning_aggregate.py --years 1 5 10 20
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import random
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fetch_forecast_window import HOURLY_VARIABLES, MORNING_HOURS, MorningAverage, aggregate_hourly  # noqa: E402
+
+WEATHERCODES = [0, 1, 2, 3, 45, 48, 51, 61, 80]
+
+
+def build_hourly(years: int, seed: int = 0) -> dict:
+    rnd = random.Random(seed)
+    start = dt.datetime(2000, 1, 1)
+    hours = int(years * 365.25 * 24)
+    hourly = {"time": [(start + dt.timedelta(hours=i)).strftime("%Y-%m-%dT%H:%M") for i in range(hours)]}
+    for variable in HOURLY_VARIABLES.values():
+        hourly[variable] = [round(rnd.uniform(0, 100), 1) for _ in range(hours)]
+    hourly["weathercode"] = [rnd.choice(WEATHERCODES) for _ in range(hours)]
+    return hourly
+
+
+def loop_aggregate(hourly: dict) -> List[MorningAverage]:
+    """以前の実装（select_indices_for_hours + compute_morning_average）。"""
+    grouped: dict[str, List[int]] = {}
+    for idx, ts in enumerate(hourly["time"]):
+        timestamp = dt.datetime.fromisoformat(ts)
+        if timestamp.hour in MORNING_HOURS:
+            grouped.setdefault(timestamp.date().isoformat(), []).append(idx)
+
+    results = []
+    for date in sorted(grouped):
+        indices = grouped[date]
+        codes = [hourly["weathercode"][i] for i in indices]
+        # 以前は max(set(codes), key=codes.count) で、同数のときは set の順序次第だった。
+        # ここでは比較のため、同数なら小さいコードを採る（aggregate_hourly と同じ規則）
+        results.append(
+            MorningAverage(
+                date=date,
+                weathercode=int(min(set(codes), key=lambda code: (-codes.count(code), code))),
+                **{
+                    field: sum(hourly[variable][i] for i in indices) / len(indices)
+                    for field, variable in HOURLY_VARIABLES.items()
+                },
+            )
+        )
+    return results
+
+
+def measure(func, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return min(samples)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="早朝平均の集計時間を比較します。")
+    parser.add_argument("--years", type=int, nargs="+", default=[1, 5, 10, 20])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'years':>5}  {'hours':>7}  {'loop':>9}  {'numpy':>9}  {'speedup':>7}  mismatch")
+    for years in args.years:
+        hourly = build_hourly(years)
+        expected = loop_aggregate(hourly)
+        actual = aggregate_hourly(hourly)
+        mismatch = sum(a != b for a, b in zip(expected, actual)) + abs(len(expected) - len(actual))
+        loop_seconds = measure(lambda: loop_aggregate(hourly), args.repeat)
+        numpy_seconds = measure(lambda: aggregate_hourly(hourly), args.repeat)
+        print(
+            f"{years:>5}  {len(hourly['time']):>7}  {loop_seconds * 1000:>7.1f}ms  {numpy_seconds * 1000:>7.1f}ms"
+            f"  {loop_seconds / numpy_seconds:>6.1f}x  {mismatch}"
+        )
+
+
+if __name__ == "__main__":
+    main()
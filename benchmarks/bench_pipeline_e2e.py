@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+ローカルの Open-Meteo 代替サーバー（openmeteo_stub.py）に向けてパイプライン全体を実行し、
+エンドツーエンドの所要時間を測る。ネットワーク不要で、遅延・エラーは引数で固定できる。
+
+  python benchmarks/bench_pipeline_e2e.py --repeat 5 --latency-ms 120 --error-rate 0.05
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from openmeteo_stub import StubConfig, start_server  # noqa: E402
+
+
+def scenarios() -> dict:
+    yesterday = (dt.date.today() - dt.timedelta(days=1)).isoformat()
+    return {
+        "daily (observed + tomorrow + 14d)": ["pipeline.py", "--observed-date", yesterday, "--window-days", "14"],
+        "forecast only (14d)": ["pipeline.py", "--no-history", "--window-days", "14"],
+        "backfill 5 years": ["main.py", "--start", "2019-01-01", "--end", "2023-12-31"],
+    }
+
+
+def run_once(args: list[str], workdir: Path, env: dict) -> float:
+    started = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-W", "ignore", *args],
+        cwd=workdir,
+        env=env,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - started
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="代替サーバーを使ったパイプラインのエンドツーエンド計測")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=100.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server, stub = start_server(
+        StubConfig(
+            mode="synthetic",
+            latency_ms=args.latency_ms,
+            jitter_ms=args.jitter_ms,
+            error_rate=args.error_rate,
+            retry_after=0.1,
+            seed=args.seed,
+        )
+    )
+    env = {
+        **os.environ,
+        "SKYCASTLE_OPENMETEO_URL": f"http://127.0.0.1:{server.server_address[1]}",
+        "SKYCASTLE_HTTP_CACHE": "0",
+    }
+
+    print(f"{'scenario':<36}  {'median':>9}  {'min':>9}  requests")
+    try:
+        for label, command in scenarios().items():
+            samples = []
+            before = stub.requests
+            for _ in range(args.repeat):
+                with tempfile.TemporaryDirectory() as tmp:
+                    workdir = Path(tmp)
+                    # 実データを汚さないよう、コピー上で実行する
+                    for name in ("data", "model"):
+                        shutil.copytree(ROOT / name, workdir / name)
+                    for script in ROOT.glob("*.py"):
+                        shutil.copy(script, workdir / script.name)
+                    samples.append(run_once(command, workdir, env))
+            per_run = (stub.requests - before) / args.repeat
+            print(
+                f"{label:<36}  {statistics.median(samples) * 1000:>7.0f}ms  {min(samples) * 1000:>7.0f}ms  {per_run:>8.1f}"
+            )
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
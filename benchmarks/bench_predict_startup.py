@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+predict_model.py のコールドスタート（新しいインタプリタで1日分を推論するまで）の時間を測る。
+
+  python benchmarks/bench_predict_startup.py --repeat 7
+
+import だけの時間も併記し、どのライブラリが起動時間を占めているかを確認できるようにする。
+"""
+
+from __future__ import annotations
+
+import argparse
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+COMMANDS = {
+    "python (bare)": ["-c", "pass"],
+    "import numpy": ["-c", "import numpy"],
+    "import pandas": ["-c", "import pandas"],
+    "import lightgbm": ["-c", "import lightgbm"],
+    "predict_model.py": [str(ROOT / "predict_model.py")],
+}
+
+
+def run_once(args: list[str], cwd: Path) -> float:
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-W", "ignore", *args], cwd=cwd, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="predict_model.py のコールドスタート計測")
+    parser.add_argument("--repeat", type=int, default=7)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        # 実データを汚さないよう、data/ と model/ のコピー上で実行する
+        shutil.copytree(ROOT / "data", workdir / "data")
+        shutil.copytree(ROOT / "model", workdir / "model")
+        run_once(COMMANDS["predict_model.py"], workdir)  # キャッシュ類を作成
+
+        print(f"{'command':<20}  {'median':>9}  {'min':>9}")
+        for label, command in COMMANDS.items():
+            samples = [run_once(command, workdir) for _ in range(args.repeat)]
+            print(f"{label:<20}  {statistics.median(samples) * 1000:>7.0f}ms  {min(samples) * 1000:>7.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+霧・城モデルの推論を、LightGBM（LGBMClassifier.predict_proba）・tree_model.TreeEnsemble（1行ずつ）・
+tree_model.FlatEnsemble（行列をまとめて）で比べ、所要時間と LightGBM との最大誤差を表示する。
+
+  python benchmarks/bench_tree_eval.py --rows 1 100 10000 100000
+
+入力は history.csv の特徴量の範囲から無作為に作り、前日特徴量の一部（--nan-fraction）を欠損にする。
+TreeEnsemble は 1000 行までで測る。model/ と data/ のあるディレクトリで実行する。
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import predict_model  # noqa: E402
+from features import BASE_FEATURE_COLUMNS, FEATURE_COLUMNS  # noqa: E402
+from train_model import load_history  # noqa: E402
+from tree_model import parse_model_text  # noqa: E402
+
+TREE_ENSEMBLE_MAX_ROWS = 1000
+
+
+def sample_features(rows: int, nan_fraction: float, rng: np.random.Generator) -> np.ndarray:
+    observed = load_history()[FEATURE_COLUMNS].to_numpy(dtype=np.float64)
+    low, high = np.nanmin(observed, axis=0), np.nanmax(observed, axis=0)
+    matrix = rng.uniform(low, high, size=(rows, len(FEATURE_COLUMNS))).astype(np.float32)
+    lag = slice(len(BASE_FEATURE_COLUMNS), None)
+    matrix[rng.random(rows) < nan_fraction, lag] = np.nan
+    return matrix
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - started, result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="木モデルの評価方法ごとの速度と誤差を比較します。")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1, 100, 10_000, 100_000])
+    parser.add_argument("--nan-fraction", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    import joblib
+    import pandas as pd
+
+    lgbm_models = [joblib.load(path) for path in (predict_model.FOG_MODEL_PATH, predict_model.CASTLE_MODEL_PATH)]
+    flat_models = predict_model.load_fast_models()[:2]
+    text_models = [parse_model_text(model.booster_.model_to_string()) for model in lgbm_models]
+    rng = np.random.default_rng(args.seed)
+
+    print(f"{'rows':>7}  {'lightgbm':>10}  {'per-row':>10}  {'flat':>10}  max |flat - lightgbm|")
+    for rows in args.rows:
+        matrix = sample_features(rows, args.nan_fraction, rng)
+        frame = pd.DataFrame(matrix, columns=FEATURE_COLUMNS)
+        lgbm_seconds, expected = timed(lambda: [m.predict_proba(frame)[:, 1] for m in lgbm_models])
+        flat_seconds, actual = timed(lambda: [m.predict_proba(matrix) for m in flat_models])
+        per_row = "-"
+        if rows <= TREE_ENSEMBLE_MAX_ROWS:
+            seconds, _ = timed(lambda: [[m.predict_proba(row) for row in matrix] for m in text_models])
+            per_row = f"{seconds * 1000:.1f}ms"
+        error = max(float(np.max(np.abs(a - e))) for a, e in zip(actual, expected))
+        print(
+            f"{rows:>7}  {lgbm_seconds * 1000:>8.1f}ms  {per_row:>10}  {flat_seconds * 1000:>8.1f}ms  {error:.2e}"
+        )
+
+
+if __name__ == "__main__":
+    main()
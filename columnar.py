@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+複数の NumPy 配列を1ファイルにまとめて保存・読み込みする簡易コンテナ形式。
+
+  [magic 8byte][ヘッダ長 uint64][ヘッダ JSON][64byte境界に揃えた各配列の生データ]...
+
+読み込みは mmap 上の np.frombuffer で行うため、配列のコピーは発生しない
+（ACCESS_COPY でマップするので、読み手が配列を書き換えてもファイルには反映されない）。
+書き込みは一時ファイルに書いてから os.replace で差し替える。
+"""
+
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterable, Mapping, Optional, Tuple
+
+import numpy as np
+
+MAGIC = b"SKYCOLS1"
+ALIGNMENT = 64
+_HEADER_LENGTH = struct.Struct("<Q")
+
+
+def _padding(offset: int) -> int:
+    return (-offset) % ALIGNMENT
+
+
+def write_arrays(path: Path, arrays: Mapping[str, np.ndarray], metadata: Optional[dict] = None) -> None:
+    """arrays（名前→配列）と metadata を path に保存する。"""
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    entries = []
+    offset = 0
+    digest = hashlib.sha256()
+    for name, array in arrays.items():
+        offset += _padding(offset)
+        entries.append(
+            {
+                "name": name,
+                "dtype": array.dtype.str,
+                "shape": list(array.shape),
+                "offset": offset,
+                "nbytes": array.nbytes,
+            }
+        )
+        digest.update(array.tobytes())
+        offset += array.nbytes
+
+    header = {
+        "metadata": metadata or {},
+        "arrays": entries,
+        "sha256": digest.hexdigest(),
+    }
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    data_start = len(MAGIC) + _HEADER_LENGTH.size + len(header_bytes)
+    data_start += _padding(data_start)
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=path.parent)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC)
+            f.write(_HEADER_LENGTH.pack(len(header_bytes)))
+            f.write(header_bytes)
+            f.write(b"\0" * (data_start - f.tell()))
+            for entry, array in zip(entries, arrays.values()):
+                f.write(b"\0" * (data_start + entry["offset"] - f.tell()))
+                f.write(array.tobytes())
+        # mkstemp は 0600 で作るので、通常のファイルと同じ権限にする（別ユーザーのプロセスからも読めるように）
+        os.chmod(tmp_name, 0o644)
+        os.replace(tmp_name, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp_name)
+        raise
+
+
+def _read_header(f) -> Tuple[dict, int]:
+    magic = f.read(len(MAGIC))
+    if magic != MAGIC:
+        raise ValueError(f"{f.name} は列形式ファイルではありません。")
+    (length,) = _HEADER_LENGTH.unpack(f.read(_HEADER_LENGTH.size))
+    header = json.loads(f.read(length).decode("utf-8"))
+    data_start = len(MAGIC) + _HEADER_LENGTH.size + length
+    return header, data_start + _padding(data_start)
+
+
+def read_metadata(path: Path) -> dict:
+    """配列を読まずに metadata だけを返す。"""
+    with Path(path).open("rb") as f:
+        header, _ = _read_header(f)
+    return header["metadata"]
+
+
+def read_arrays(
+    path: Path,
+    names: Optional[Iterable[str]] = None,
+    verify: bool = False,
+) -> Tuple[dict, Dict[str, np.ndarray]]:
+    """path から (metadata, 名前→配列) を読み込む。names を指定するとその配列だけを返す。"""
+    with Path(path).open("rb") as f:
+        header, data_start = _read_header(f)
+        size = os.fstat(f.fileno()).st_size
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY) if size > data_start else b""
+    entries = {entry["name"]: entry for entry in header["arrays"]}
+    wanted = list(entries) if names is None else [name for name in names if name in entries]
+
+    if verify:
+        digest = hashlib.sha256()
+        for entry in header["arrays"]:
+            start = data_start + entry["offset"]
+            digest.update(memoryview(buffer)[start : start + entry["nbytes"]])
+        if digest.hexdigest() != header["sha256"]:
+            raise ValueError(f"{path} のチェックサムが一致しません。")
+
+    arrays = {}
+    for name in wanted:
+        entry = entries[name]
+        dtype = np.dtype(entry["dtype"])
+        count = int(np.prod(entry["shape"], dtype=np.int64))
+        if count:
+            array = np.frombuffer(buffer, dtype=dtype, count=count, offset=data_start + entry["offset"])
+        else:
+            array = np.empty(0, dtype=dtype)
+        arrays[name] = array.reshape(entry["shape"])
+    return header["metadata"], arrays
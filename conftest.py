@@ -0,0 +1,5 @@
+"""pytest の設定。streamlit が入っていない環境では dashboard_test.py を集めない。"""
+
+import importlib.util
+
+collect_ignore = [] if importlib.util.find_spec("streamlit") else ["dashboard_test.py"]
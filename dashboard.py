@@ -2,7 +2,7 @@
 """
 Streamlit ダッシュボード:
   - feed.json から予測確率をメトリクス表示
-  - history.csv から過去推移グラフを描画
+  - 履歴（data/history.sqlite）から過去推移グラフを描画
   - 観測ログ入力フォーム（霧・城の実績更新）
   - 手動で最新予報を再計算するボタン
 """
@@ -19,6 +19,9 @@ from zoneinfo import ZoneInfo
 import pandas as pd
 import streamlit as st
 
+from history_snapshot import history_signature
+from history_store import HistoryStore, frame_changes, read_history_frame
+
 FEED_JSON = Path("data/feed.json")
 HISTORY_CSV = Path("data/history.csv")
 WEATHER_CSV = Path("data/weather.csv")
@@ -34,22 +37,31 @@ def load_feed(cache_key: float):
 
 
 @st.cache_data(show_spinner=False)
-def load_history(csv_path: str, last_modified: float):
+def load_history(csv_path: str, signature: str):
     csv_path = Path(csv_path)
-    if not csv_path.exists():
+    if not signature:
         return pd.DataFrame(columns=["date", *FEATURE_COLUMNS, "fog_observed", "castle_visible"])
-    df = pd.read_csv(csv_path)
+    df = read_history_frame(csv_path=csv_path)
     if df.empty:
         return df
-    df["date"] = pd.to_datetime(df["date"])
     df = df.sort_values("date")
     return df
 
 
-def save_history(df: pd.DataFrame) -> None:
-    df = df.copy()
-    df["date"] = df["date"].dt.strftime("%Y-%m-%d")
-    df.to_csv(HISTORY_CSV, index=False)
+def save_history(original: pd.DataFrame, edited: pd.DataFrame) -> None:
+    """表で編集した行・列だけを履歴ストアへ反映する（他プロセスが同時に更新した行は上書きしない）。"""
+    records, deleted = frame_changes(original, edited)
+    store = HistoryStore(HISTORY_CSV)
+    if deleted:
+        store.delete_many(deleted)
+    if records:
+        store.upsert_many(records)
+    st.cache_data.clear()
+
+
+def save_observation(record: dict) -> None:
+    """1日分の観測ログだけを履歴ストアへ反映する（他プロセスが更新した列は上書きしない）。"""
+    HistoryStore(HISTORY_CSV).upsert(record)
     st.cache_data.clear()
 
 
@@ -170,17 +182,17 @@ def render_observation_form(history_df: pd.DataFrame):
     save_clicked = st.button("保存", key="obs_save_button")
 
     if save_clicked:
-        history_df = history_df.copy()
         date_str = pd.to_datetime(st.session_state["obs_selected_date"])
 
-        if (history_df["date"] == date_str).any():
-            history_df.loc[history_df["date"] == date_str, ["fog_observed", "castle_visible", "note"]] = [
-                int(fog_flag),
-                int(castle_flag),
-                note,
-            ]
+        if not history_df.empty and (history_df["date"] == date_str).any():
+            record = {
+                "date": date_str,
+                "fog_observed": int(fog_flag),
+                "castle_visible": int(castle_flag),
+                "note": note,
+            }
         else:
-            new_row = {
+            record = {
                 "date": date_str,
                 "temp": history_df["temp"].mean() if "temp" in history_df.columns and not history_df.empty else 0,
                 "humidity": history_df["humidity"].mean() if "humidity" in history_df.columns and not history_df.empty else 0,
@@ -191,9 +203,8 @@ def render_observation_form(history_df: pd.DataFrame):
                 "castle_visible": int(castle_flag),
                 "note": note,
             }
-            history_df = pd.concat([history_df, pd.DataFrame([new_row])], ignore_index=True)
 
-        save_history(history_df)
+        save_observation(record)
         st.success("観測ログを保存しました")
         st.session_state["obs_last_synced_date"] = None
         st.rerun()
@@ -306,8 +317,8 @@ def render_observation_form(history_df: pd.DataFrame):
 
     if st.button("テーブルの変更を保存", type="primary"):
         edited["date"] = pd.to_datetime(edited["date"])
-        save_history(edited)
-        st.success("history.csv を更新しました")
+        save_history(editable_df, edited)
+        st.success("履歴を更新しました")
         st.rerun()
 
 
@@ -331,7 +342,7 @@ def render_manual_run_buttons():
         try:
             subprocess.run(["python", "main.py", "--date", manual_date.isoformat()], check=True)
             st.success(
-                f"{manual_date.isoformat()} の気象データを取得し、予報と history.csv を更新しました。"
+                f"{manual_date.isoformat()} の気象データを取得し、予報と履歴を更新しました。"
             )
             st.rerun()
         except subprocess.CalledProcessError as exc:
@@ -343,10 +354,10 @@ def main():
     st.title("🌤️ SkyCastle AI ダッシュボード")
 
     feed_mtime = FEED_JSON.stat().st_mtime if FEED_JSON.exists() else 0.0
-    history_mtime = HISTORY_CSV.stat().st_mtime if HISTORY_CSV.exists() else 0.0
+    history_version = history_signature(HISTORY_CSV) or ""
 
     feed_data = load_feed(feed_mtime)
-    history_df = load_history(str(HISTORY_CSV), history_mtime)
+    history_df = load_history(str(HISTORY_CSV), history_version)
 
     render_metrics(feed_data)
     render_history_chart(history_df)
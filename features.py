@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+霧モデル・城モデルの特徴量（FEATURE_COLUMNS）を作る唯一の場所。
+
+学習（train_model）と推論（predict_model / predict_forecast_window / pipeline）のどちらも
+build_features を通すため、同じ日の特徴量は常に同じ値になる。
+
+  - 前日特徴量（prev_* / temp_prev_diff）は、履歴と入力行を日付順に並べたときの、その行より前にある
+    直近の「BASE_FEATURE_COLUMNS のいずれかに値がある行」の値。推論側の以前の定義と同じで、学習側は
+    以前は「気象の列とラベルがすべて揃った行だけを残してから shift(1)」だったのをこちらに合わせた
+    （一部の列が欠けた行やラベルの無い行も前日になり、欠けた列の前日特徴量は NaN になる）
+  - 履歴側は日付の無い行を除き、日付の重複は後勝ち。入力と同じ日付の履歴行は入力行で置き換える
+  - 全行を1回の NumPy の配列演算で計算し、FEATURE_COLUMNS の順の float32 の行列（入力と同じ行順）を返す
+  - 入力配列の内容のハッシュをキーに直近 CACHE_SIZE 件の結果を覚えておき、同じ入力なら計算し直さない
+    （返す行列は書き込み不可）
+  - build_sample_features は、同じ日付の並びを値だけ変えた多数の標本（予報の揺らぎなど）の特徴量を
+    まとめて作る（前日の行の探索は1回だけ）
+
+pandas は import しない（predict_model の高速経路からも使うため）。
+"""
+
+from __future__ import annotations
+
+import hashlib
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+BASE_FEATURE_COLUMNS: List[str] = ["temp", "humidity", "wind", "cloud", "rain"]
+LAG_FEATURE_COLUMNS: List[str] = [
+    "prev_temp",
+    "prev_humidity",
+    "prev_wind",
+    "prev_cloud",
+    "prev_rain",
+    "temp_prev_diff",
+]
+FEATURE_COLUMNS: List[str] = BASE_FEATURE_COLUMNS + LAG_FEATURE_COLUMNS
+FEATURE_DTYPE = np.float32
+# 特徴量の作り方を変えたら上げる（特徴量を保存して使い回す側のキャッシュキーに含める）
+FEATURE_VERSION = 1
+CACHE_SIZE = 32
+
+_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+
+
+def to_day(value) -> np.datetime64:
+    try:
+        return np.datetime64(str(value).strip()[:10], "D")
+    except ValueError:
+        return np.datetime64("NaT", "D")
+
+
+def as_days(dates: Iterable) -> np.ndarray:
+    """日付の並び（文字列・datetime64・Timestamp など）を datetime64[D] の配列にする。"""
+    array = np.asarray(dates if hasattr(dates, "__len__") else list(dates))
+    if np.issubdtype(array.dtype, np.datetime64):
+        return array.astype("datetime64[D]")
+    return np.array([to_day(value) for value in array], dtype="datetime64[D]")
+
+
+def as_values(values, rows: int) -> np.ndarray:
+    """BASE_FEATURE_COLUMNS の順の値を (rows, 列数) の float64 配列にする（欠損は NaN）。"""
+    return np.asarray(values, dtype=np.float64).reshape(rows, len(BASE_FEATURE_COLUMNS))
+
+
+def frame_source(frame) -> Tuple[np.ndarray, np.ndarray]:
+    """"date" と BASE_FEATURE_COLUMNS の列を持つ表（HistoryView.frame など）の (日付, 値)。"""
+    if len(frame) == 0:
+        return np.empty(0, dtype="datetime64[D]"), np.empty((0, len(BASE_FEATURE_COLUMNS)))
+    dates = np.asarray(frame["date"].to_numpy(dtype="datetime64[D]"))
+    return dates, as_values(frame[BASE_FEATURE_COLUMNS].to_numpy(dtype=np.float64), len(dates))
+
+
+def cache_key(*arrays: np.ndarray) -> str:
+    digest = hashlib.sha1(str(FEATURE_VERSION).encode("ascii"))
+    for array in arrays:
+        digest.update(f"{array.dtype.str}{array.shape}".encode("ascii"))
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+def latest_per_date(dates: np.ndarray, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """日付の無い行を除き、日付順に並べて重複を後勝ちで1行にする。"""
+    valid = ~np.isnat(dates)
+    dates, values = dates[valid], values[valid]
+    order = np.argsort(dates, kind="stable")
+    dates, values = dates[order], values[order]
+    if not len(dates):
+        return dates, values
+    last = np.append(dates[1:] != dates[:-1], True)
+    return dates[last], values[last]
+
+
+def lag_rows(
+    dates: np.ndarray,
+    values: np.ndarray,
+    history_dates: np.ndarray,
+    history_values: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """各入力行の前日の行。(前日が入力行ならその番号（それ以外は -1）, 前日が履歴の行ならその値（それ以外は NaN）)。"""
+    history_dates, history_values = latest_per_date(history_dates, history_values)
+    outside = ~np.isin(history_dates, dates)
+    all_dates = np.concatenate([history_dates[outside], dates])
+    all_values = np.concatenate([history_values[outside], values])
+    order = np.argsort(all_dates, kind="stable")
+
+    # 並べ替えた各位置について、それより前で値のある直近の位置（無ければ -1）
+    has_value = ~np.isnan(all_values[order]).all(axis=1)
+    latest = np.maximum.accumulate(np.where(has_value, np.arange(len(order)), -1)) if len(order) else order
+    previous = np.concatenate([[-1], latest[:-1]]) if len(order) else order
+    previous_rows = np.where(previous >= 0, order[np.maximum(previous, 0)], -1)
+    source = np.empty(len(order), dtype=np.int64)
+    source[order] = previous_rows
+    history_rows = len(all_dates) - len(dates)
+    source = np.where(np.isnat(dates), -1, source[history_rows:])
+
+    from_history = (source >= 0) & (source < history_rows)
+    lags = np.full_like(values, np.nan)
+    lags[from_history] = all_values[source[from_history]]
+    return np.where(source >= history_rows, source - history_rows, -1), lags
+
+
+def assemble(values: np.ndarray, lags: np.ndarray) -> np.ndarray:
+    """基本の値と前日の値（最後の軸が BASE_FEATURE_COLUMNS）から FEATURE_COLUMNS の順の float32 の配列を作る。"""
+    matrix = np.empty(values.shape[:-1] + (len(FEATURE_COLUMNS),), dtype=FEATURE_DTYPE)
+    matrix[..., : len(BASE_FEATURE_COLUMNS)] = values
+    matrix[..., len(BASE_FEATURE_COLUMNS) : -1] = lags
+    matrix[..., -1] = lags[..., 0] - values[..., 0]
+    return matrix
+
+
+def build_features(
+    dates: Iterable,
+    values,
+    history_dates: Optional[Iterable] = None,
+    history_values=None,
+) -> np.ndarray:
+    """dates / values（BASE_FEATURE_COLUMNS の順）の各行の特徴量を FEATURE_COLUMNS の順の行列で返す。
+
+    history を渡すと前日特徴量の参照先に加える。入力行どうしも互いの前日になりうる
+    （学習では全履歴をそのまま入力にし、history は渡さない）。
+    """
+    dates = as_days(dates)
+    values = as_values(values, len(dates))
+    if history_dates is None:
+        history_dates = np.empty(0, dtype="datetime64[D]")
+        history_values = np.empty((0, len(BASE_FEATURE_COLUMNS)))
+    history_dates = as_days(history_dates)
+    history_values = as_values(history_values, len(history_dates))
+
+    key = cache_key(dates, values, history_dates, history_values)
+    cached = _cache.get(key)
+    if cached is not None:
+        _cache.move_to_end(key)
+        return cached
+
+    input_rows, lags = lag_rows(dates, values, history_dates, history_values)
+    lags[input_rows >= 0] = values[input_rows[input_rows >= 0]]
+    matrix = assemble(values, lags)
+    matrix.setflags(write=False)
+
+    _cache[key] = matrix
+    if len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return matrix
+
+
+def build_sample_features(
+    dates: Iterable,
+    samples,
+    history_dates: Optional[Iterable] = None,
+    history_values=None,
+) -> np.ndarray:
+    """同じ日付の並びに対する複数の標本（(標本数, 行数, BASE_FEATURE_COLUMNS の列数)）の特徴量。
+
+    build_features を標本ごとに呼んだのと同じ値を (標本数, 行数, FEATURE_COLUMNS の列数) の配列で返す。
+    前日の行は標本によらず同じ（欠損の位置はすべての標本で同じであること）で、前日が入力行なら
+    同じ標本のその行の値を使う。キャッシュはしない。
+    """
+    dates = as_days(dates)
+    samples = np.asarray(samples, dtype=np.float64)
+    samples = samples.reshape(len(samples), len(dates), len(BASE_FEATURE_COLUMNS))
+    if history_dates is None:
+        history_dates = np.empty(0, dtype="datetime64[D]")
+        history_values = np.empty((0, len(BASE_FEATURE_COLUMNS)))
+    history_dates = as_days(history_dates)
+    history_values = as_values(history_values, len(history_dates))
+
+    input_rows, history_lags = lag_rows(dates, samples[0], history_dates, history_values)
+    lags = np.repeat(history_lags[np.newaxis], len(samples), axis=0)
+    lags[:, input_rows >= 0] = samples[:, input_rows[input_rows >= 0]]
+    return assemble(samples, lags)
@@ -6,20 +6,32 @@ from __future__ import annotations
 import argparse
 import datetime as dt
 import json
+import operator
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterable, List
+from typing import Dict, Iterable, List, Sequence
 
-import requests
+import numpy as np
 from zoneinfo import ZoneInfo
 
-LATITUDE = 35.98
-LONGITUDE = 136.49
-FORECAST_URL = "https://api.open-meteo.com/v1/forecast"
+import http_cache
+import http_client
+from sites import ECHIZEN_ONO, Site, fetch_for_sites, select_sites
+
+FORECAST_URL = http_client.openmeteo_url("/v1/forecast", "https://api.open-meteo.com/v1/forecast")
 
 TZ = ZoneInfo("Asia/Tokyo")
 DEFAULT_DAYS = 16
 OUTPUT_PATH = Path("data/forecast_window.json")
+MORNING_HOURS = (5, 6, 7, 8)
+# MorningAverage の項目 → Open-Meteo の hourly 変数名
+HOURLY_VARIABLES = {
+    "temp": "temperature_2m",
+    "humidity": "relativehumidity_2m",
+    "wind": "windspeed_10m",
+    "cloud": "cloudcover",
+    "rain": "precipitation",
+}
 
 
 @dataclass
@@ -49,71 +61,151 @@ def parse_args() -> argparse.Namespace:
         default=OUTPUT_PATH,
         help="保存先パス（JSON）。デフォルトは data/forecast_window.json。",
     )
+    parser.add_argument(
+        "--sites",
+        help="複数地点をまとめて取得する（all または data/sites.json の id をカンマ区切り）。"
+        "結果は data/sites/<id>/forecast_window.json に保存する。",
+    )
     return parser.parse_args()
 
 
-def fetch_hourly_forecast(days: int) -> dict:
+def fetch_hourly_forecast(days: int, site: Site = ECHIZEN_ONO) -> dict:
+    return fetch_hourly_forecast_sites([site], days)[site.id]
+
+
+def fetch_hourly_forecast_sites(sites: Iterable[Site], days: int) -> Dict[str, dict]:
+    """複数地点の予報ウィンドウを {地点 id: hourly の応答} で返す（座標はまとめて1リクエストにする）。"""
     today = dt.datetime.now(TZ).date()
     # Open-Meteo forecast API is inclusive of both start and end dates. To fetch
     # `days` records starting today, subtract 1 day from the end date.
     end_date = today + dt.timedelta(days=days - 1)
     params = {
-        "latitude": LATITUDE,
-        "longitude": LONGITUDE,
         "hourly": "temperature_2m,relativehumidity_2m,windspeed_10m,cloudcover,precipitation,weathercode",
         "start_date": today.isoformat(),
         "end_date": end_date.isoformat(),
         "timezone": "Asia/Tokyo",
     }
-    resp = requests.get(FORECAST_URL, params=params, timeout=30)
-    resp.raise_for_status()
-    return resp.json()
-
-
-def select_indices_for_hours(times: Iterable[str], target_hours: set[int]) -> dict[str, List[int]]:
-    grouped: dict[str, List[int]] = {}
-    for idx, ts in enumerate(times):
-        try:
-            timestamp = dt.datetime.fromisoformat(ts)
-        except ValueError:
-            continue
-        if timestamp.hour not in target_hours:
-            continue
-        grouped.setdefault(timestamp.date().isoformat(), []).append(idx)
-    return grouped
-
-
-def compute_morning_average(hourly: dict, day_indices: List[int]) -> MorningAverage:
-    def mean(series):
-        values = [series[i] for i in day_indices]
-        if not values:
-            raise ValueError("対象時間帯のデータが空です。")
-        return sum(values) / len(values)
-
-    date = dt.datetime.fromisoformat(hourly["time"][day_indices[0]]).date().isoformat()
-    weathercode = None
-    if "weathercode" in hourly:
-        codes = [hourly["weathercode"][i] for i in day_indices]
-        weathercode = max(set(codes), key=codes.count) if codes else None
-
-    return MorningAverage(
-        date=date,
-        temp=mean(hourly["temperature_2m"]),
-        humidity=mean(hourly["relativehumidity_2m"]),
-        wind=mean(hourly["windspeed_10m"]),
-        cloud=mean(hourly["cloudcover"]),
-        rain=mean(hourly["precipitation"]),
-        weathercode=int(weathercode) if weathercode is not None else None,
+    return fetch_for_sites(
+        lambda chunk_params: http_cache.get_json(FORECAST_URL, chunk_params, http_cache.forecast_ttl()),
+        params,
+        sites,
     )
 
 
+def parse_hourly_times(times: Sequence[str] | np.ndarray) -> np.ndarray:
+    """ISO 形式の時刻列を datetime64[m] の配列にする（解釈できない値は NaT）。
+
+    Open-Meteo の hourly.time は1時間刻みの連続した列なので、先頭と末尾の間隔が
+    件数と合っていれば文字列の解釈は2回で済ませ、残りは等差数列として作る。
+    hourly_stream で読んだ hourly のように datetime64 の配列ならそのまま使う。
+    """
+    if isinstance(times, np.ndarray) and np.issubdtype(times.dtype, np.datetime64):
+        return times.astype("datetime64[m]")
+    times = list(times)
+    if not times:
+        return np.empty(0, dtype="datetime64[m]")
+    try:
+        first, last = np.array([times[0], times[-1]], dtype="datetime64[m]")
+        if last - first == np.timedelta64(len(times) - 1, "h"):
+            return first + np.arange(len(times)) * np.timedelta64(1, "h")
+        return np.array(times, dtype="datetime64[m]")
+    except ValueError:
+        parsed = []
+        for ts in times:
+            try:
+                parsed.append(np.datetime64(dt.datetime.fromisoformat(ts), "m"))
+            except (TypeError, ValueError):
+                parsed.append(np.datetime64("NaT", "m"))
+        return np.array(parsed, dtype="datetime64[m]")
+
+
+def take(values: Sequence | np.ndarray, positions: np.ndarray) -> np.ndarray:
+    """JSON の配列から positions の要素だけを float 配列として取り出す（null は NaN）。"""
+    if isinstance(values, np.ndarray):
+        return values[positions].astype(float)
+    if len(positions) == 1:
+        return np.array([values[positions[0]]], dtype=float)
+    return np.array(operator.itemgetter(*positions.tolist())(values), dtype=float)
+
+
+def daily_mode(day_index: np.ndarray, codes: np.ndarray, num_days: int) -> List[int | None]:
+    """日ごとの最頻値（同数なら小さいコード）。値が無い日は None。"""
+    result: List[int | None] = [None] * num_days
+    valid = ~np.isnan(codes)
+    if not valid.any():
+        return result
+    day_index, codes = day_index[valid], codes[valid].astype(np.int64)
+    offset = codes.min()
+    span = int(codes.max() - offset) + 1
+    keys, counts = np.unique(day_index * span + (codes - offset), return_counts=True)
+    # 日（昇順）→ 出現回数（降順）→ コード（昇順）に並べ、各日の先頭を採る
+    order = np.lexsort((keys, -counts, keys // span))
+    keys = keys[order]
+    days = keys // span
+    head = np.r_[True, days[1:] != days[:-1]]
+    for day, code in zip(days[head].tolist(), (keys[head] % span + offset).tolist()):
+        result[day] = code
+    return result
+
+
+def aggregate_hourly(
+    hourly: dict,
+    target_hours: Iterable[int] = MORNING_HOURS,
+    days: int | None = None,
+) -> List[MorningAverage]:
+    """hourly データを日ごとに target_hours の平均へ集計する（日付順、days 指定時は先頭から days 日分）。
+
+    時刻の解釈・日付と時間への分解・日ごとの平均を NumPy でまとめて行う。平均は各日の値を
+    時刻順に足して個数で割るため、Python で1日ずつ sum / len した場合と同じ値になる。
+    """
+    times = parse_hourly_times(hourly["time"])
+    valid = ~np.isnat(times)
+    day = times.astype("datetime64[D]")
+    hour = np.full(len(times), -1, dtype=np.int64)
+    hour[valid] = (times[valid] - day[valid]) // np.timedelta64(1, "h")
+    positions = np.flatnonzero(valid & np.isin(hour, list(target_hours)))
+    if not len(positions):
+        return []
+
+    selected_days = day[positions]
+    if np.all(selected_days[1:] >= selected_days[:-1]):
+        # 時刻順に並んでいれば、日付が変わる位置の累積和で日番号を振れる（ソート不要）
+        changes = np.r_[False, selected_days[1:] != selected_days[:-1]]
+        day_index = np.cumsum(changes)
+        unique_days = selected_days[np.r_[True, changes[1:]]]
+    else:
+        unique_days, day_index = np.unique(selected_days, return_inverse=True)
+    if days is not None and len(unique_days) > days:
+        keep = day_index < days
+        positions, day_index, unique_days = positions[keep], day_index[keep], unique_days[:days]
+    num_days = len(unique_days)
+    counts = np.bincount(day_index, minlength=num_days)
+
+    means = {
+        field: (np.bincount(day_index, weights=take(hourly[variable], positions), minlength=num_days) / counts).tolist()
+        for field, variable in HOURLY_VARIABLES.items()
+    }
+    if "weathercode" in hourly:
+        codes = daily_mode(day_index, take(hourly["weathercode"], positions), num_days)
+    else:
+        codes = [None] * num_days
+
+    return [
+        MorningAverage(
+            date=date,
+            temp=means["temp"][i],
+            humidity=means["humidity"][i],
+            wind=means["wind"][i],
+            cloud=means["cloud"][i],
+            rain=means["rain"][i],
+            weathercode=codes[i],
+        )
+        for i, date in enumerate(unique_days.astype(str).tolist())
+    ]
+
+
 def aggregate_mornings(weather_json: dict, days: int) -> List[MorningAverage]:
-    hourly = weather_json["hourly"]
-    grouped_indices = select_indices_for_hours(hourly["time"], {5, 6, 7, 8})
-    results: List[MorningAverage] = []
-    for date in sorted(grouped_indices.keys())[:days]:
-        indices = grouped_indices[date]
-        results.append(compute_morning_average(hourly, indices))
+    results = aggregate_hourly(weather_json["hourly"], MORNING_HOURS, days)
     if not results:
         raise ValueError("対象日数の平均値を計算できませんでした。")
     return results
@@ -135,6 +227,14 @@ def main() -> None:
     if args.days < 1 or args.days > 16:
         raise SystemExit("--days は 1〜16 の範囲で指定してください。")
 
+    if args.sites:
+        selected = select_sites(args.sites)
+        payloads = fetch_hourly_forecast_sites(selected, args.days)
+        for site in selected:
+            averages = aggregate_mornings(payloads[site.id], args.days)
+            save_json(serialize_results(averages), site.output_dir / OUTPUT_PATH.name)
+        return
+
     forecast_json = fetch_hourly_forecast(args.days)
     averages = aggregate_mornings(forecast_json, args.days)
     payload = serialize_results(averages)
@@ -9,83 +9,165 @@ from __future__ import annotations
 import argparse
 import csv
 import datetime as dt
+import functools
 from pathlib import Path
+from typing import Dict, Iterable, List
 
 import requests
 from zoneinfo import ZoneInfo
 
-LATITUDE = 35.98
-LONGITUDE = 136.49
+import http_cache
+import http_client
+import hourly_stream
+from fetch_forecast_window import MORNING_HOURS, MorningAverage, aggregate_hourly
+from sites import ECHIZEN_ONO, Site, fetch_for_sites, select_sites
+
 OUTPUT_CSV = Path("data/weather.csv")
 
-FORECAST_URL = "https://api.open-meteo.com/v1/forecast"
-ARCHIVE_URL = "https://archive-api.open-meteo.com/v1/archive"
+FORECAST_URL = http_client.openmeteo_url("/v1/forecast", "https://api.open-meteo.com/v1/forecast")
+ARCHIVE_URL = http_client.openmeteo_url("/v1/archive", "https://archive-api.open-meteo.com/v1/archive")
+# 期間指定で取得するときの 1 リクエストあたりの最大日数
+ARCHIVE_CHUNK_DAYS = 365
+# Archive API の値は直近数日分が後から差し替わることがあるため、これより古い期間だけを期限なしでキャッシュする
+ARCHIVE_SETTLED_DAYS = 7
+# 応答は少しずつ読み、hourly は早朝の時刻だけを残す（複数年分でも全時刻ぶんを持たない）
+parse_mornings = functools.partial(hourly_stream.parse_payload, target_hours=MORNING_HOURS)
 
 
 TZ = ZoneInfo("Asia/Tokyo")
 
 
-def fetch_weather(target_date: dt.date, use_archive: bool) -> dict:
-    """Open-Meteo から target_date の気象データ（hourly）を取得して返す。"""
+def fetch_weather_range(
+    start_date: dt.date,
+    end_date: dt.date,
+    use_archive: bool,
+    site: Site = ECHIZEN_ONO,
+) -> dict:
+    """Open-Meteo から start_date〜end_date の気象データ（hourly）を 1 リクエストで取得して返す。"""
+    return fetch_weather_range_sites([site], start_date, end_date, use_archive)[site.id]
+
+
+def fetch_weather_range_sites(
+    sites: Iterable[Site],
+    start_date: dt.date,
+    end_date: dt.date,
+    use_archive: bool,
+) -> Dict[str, dict]:
+    """複数地点の start_date〜end_date の気象データを {地点 id: hourly の応答} で返す。
+
+    座標は MAX_LOCATIONS_PER_REQUEST 地点ずつ1リクエストにまとめる。hourly には
+    MORNING_HOURS の時刻だけを NumPy 配列で残す（hourly_stream.parse_payload）。
+    """
     params = {
-        "latitude": LATITUDE,
-        "longitude": LONGITUDE,
         "hourly": "temperature_2m,relativehumidity_2m,windspeed_10m,cloudcover,precipitation",
-        "start_date": target_date.isoformat(),
-        "end_date": target_date.isoformat(),
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
         "timezone": "Asia/Tokyo",
     }
-    base_url = ARCHIVE_URL if use_archive else FORECAST_URL
-    resp = requests.get(base_url, params=params, timeout=30)
-
-    if use_archive and resp.status_code == 400:
-        # Archive API は当日データの確定版が未公開だと 400 を返すため、予報 API へフォールバックする。
-        print(
-            f"Archive API unavailable for {target_date.isoformat()}; falling back to forecast.",
-            flush=True,
-        )
-        resp = requests.get(FORECAST_URL, params=params, timeout=30)
 
-    resp.raise_for_status()
-    return resp.json()
+    def fetch_chunk(chunk_params: dict):
+        if not use_archive:
+            return http_cache.get_stream(FORECAST_URL, chunk_params, http_cache.forecast_ttl(), parse_mornings)
+        try:
+            return http_cache.get_stream(ARCHIVE_URL, chunk_params, archive_ttl(end_date), parse_mornings)
+        except requests.HTTPError as exc:
+            # Archive API は当日データの確定版が未公開だと 400 を返すため、予報 API へフォールバックする。
+            if exc.response is None or exc.response.status_code != 400:
+                raise
+            label = (
+                start_date.isoformat() if start_date == end_date else f"{start_date.isoformat()}〜{end_date.isoformat()}"
+            )
+            print(
+                f"Archive API unavailable for {label}; falling back to forecast.",
+                flush=True,
+            )
+            return http_cache.get_stream(FORECAST_URL, chunk_params, http_cache.forecast_ttl(), parse_mornings)
+
+    return fetch_for_sites(fetch_chunk, params, sites)
+
+
+def archive_ttl(end_date: dt.date) -> float | None:
+    """Archive API の応答のキャッシュ期限。確定済みの期間は期限なし（None）。"""
+    local_today = dt.datetime.now(TZ).date()
+    if (local_today - end_date).days > ARCHIVE_SETTLED_DAYS:
+        return None
+    return http_cache.forecast_ttl()
 
 
-def average_morning(weather_json: dict) -> dict:
-    """5:00〜8:00 の平均値を計算して辞書で返す。"""
-    hourly = weather_json["hourly"]
-    target_hours = {5, 6, 7, 8}
+def fetch_weather(target_date: dt.date, use_archive: bool) -> dict:
+    """Open-Meteo から target_date の気象データ（hourly）を取得して返す。"""
+    return fetch_weather_range(target_date, target_date, use_archive)
+
+
+def split_date_chunks(dates: Iterable[dt.date], chunk_days: int = ARCHIVE_CHUNK_DAYS) -> List[tuple[dt.date, dt.date]]:
+    """日付の集合を、連続した最大 chunk_days 日の (開始日, 終了日) 区間にまとめる。"""
+    chunks: List[tuple[dt.date, dt.date]] = []
+    for date in sorted(set(dates)):
+        if chunks:
+            start, end = chunks[-1]
+            if date == end + dt.timedelta(days=1) and (date - start).days < chunk_days:
+                chunks[-1] = (start, date)
+                continue
+        chunks.append((date, date))
+    return chunks
+
 
-    indices = []
-    for idx, ts in enumerate(hourly["time"]):
-        timestamp = dt.datetime.fromisoformat(ts)
-        if timestamp.hour in target_hours:
-            indices.append(idx)
+def fetch_weather_dates(dates: Iterable[dt.date], chunk_days: int = ARCHIVE_CHUNK_DAYS) -> List[dict]:
+    """複数日の気象データを区間ごとにまとめて取得する（過去日は Archive API、当日以降は予報 API）。
 
-    if not indices:
+    返すリストの順序は「過去日の区間（日付順）→ 当日以降の区間（日付順）」。
+    """
+    local_today = dt.datetime.now(TZ).date()
+    dates = list(dates)
+    past = [date for date in dates if date < local_today]
+    upcoming = [date for date in dates if date >= local_today]
+
+    requests_to_send = [
+        (start, end, use_archive)
+        for use_archive, group in ((True, past), (False, upcoming))
+        for start, end in split_date_chunks(group, chunk_days)
+    ]
+    # 区間ごとのリクエストは共有セッション上で同時実行数を抑えて並列に送る
+    return http_client.map_bounded(lambda request: fetch_weather_range(*request), requests_to_send)
+
+
+def average_morning(weather_json: dict) -> dict:
+    """5:00〜8:00 の平均値を計算して辞書で返す（複数日分ある場合は最初の日）。"""
+    averages = aggregate_hourly(weather_json["hourly"], MORNING_HOURS, days=1)
+    if not averages:
         raise ValueError("対象時間帯のデータが見つかりません。")
+    return morning_row(averages[0])
+
 
-    tomorrow_date = dt.datetime.fromisoformat(hourly["time"][indices[0]]).date().isoformat()
+def average_mornings(weather_json: dict) -> List[dict]:
+    """複数日分の hourly データから、日ごとの 5:00〜8:00 の平均値を辞書のリストで返す。"""
+    return [morning_row(average) for average in aggregate_hourly(weather_json["hourly"], MORNING_HOURS)]
 
-    def mean(values):
-        values = list(values)
-        if not values:
-            raise ValueError("平均を計算する値がありません。")
-        return sum(values) / len(values)
 
+def morning_row(average: MorningAverage) -> dict:
+    """MorningAverage を weather.csv の1行（average_morning と同じ形の辞書）に変換する。"""
     return {
-        "date": tomorrow_date,
-        "temp": mean(hourly["temperature_2m"][i] for i in indices),
-        "humidity": mean(hourly["relativehumidity_2m"][i] for i in indices),
-        "wind": mean(hourly["windspeed_10m"][i] for i in indices),
-        "cloud": mean(hourly["cloudcover"][i] for i in indices),
-        "rain": mean(hourly["precipitation"][i] for i in indices),
+        "date": average.date,
+        "temp": average.temp,
+        "humidity": average.humidity,
+        "wind": average.wind,
+        "cloud": average.cloud,
+        "rain": average.rain,
     }
 
 
-def save_csv(row: dict) -> None:
+def find_morning_row(averages: Iterable[MorningAverage], target_date: dt.date) -> dict | None:
+    """予報ウィンドウの集計結果から target_date の行を取り出す（無ければ None）。"""
+    for average in averages:
+        if average.date == target_date.isoformat():
+            return morning_row(average)
+    return None
+
+
+def save_csv(row: dict, output_path: Path = OUTPUT_CSV) -> None:
     """data/weather.csv に平均値を保存する（ヘッダ付きで1行）。"""
-    OUTPUT_CSV.parent.mkdir(parents=True, exist_ok=True)
-    with OUTPUT_CSV.open("w", newline="", encoding="utf-8") as f:
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with output_path.open("w", newline="", encoding="utf-8") as f:
         writer = csv.DictWriter(
             f, fieldnames=["date", "temp", "humidity", "wind", "cloud", "rain"]
         )
@@ -106,18 +188,36 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Archive API を強制的に使用して取得する。",
     )
+    parser.add_argument(
+        "--sites",
+        help="複数地点をまとめて取得する（all または data/sites.json の id をカンマ区切り）。"
+        "結果は data/sites/<id>/weather.csv に保存する。",
+    )
     return parser.parse_args()
 
 
+def resolve_target_date(date_str: str | None, use_archive: bool = False) -> tuple[dt.date, bool]:
+    """取得対象日と Archive API を使うかどうかを決める（未指定なら翌日）。"""
+    local_today = dt.datetime.now(TZ).date()
+    if date_str:
+        target_date = dt.date.fromisoformat(date_str)
+        return target_date, use_archive or target_date < local_today
+    return local_today + dt.timedelta(days=1), use_archive
+
+
 def main() -> None:
     args = parse_args()
-    local_today = dt.datetime.now(TZ).date()
-    if args.date:
-        target_date = dt.date.fromisoformat(args.date)
-        use_archive = args.use_archive or target_date < local_today
-    else:
-        target_date = local_today + dt.timedelta(days=1)
-        use_archive = args.use_archive
+    target_date, use_archive = resolve_target_date(args.date, args.use_archive)
+
+    if args.sites:
+        selected = select_sites(args.sites)
+        payloads = fetch_weather_range_sites(selected, target_date, target_date, use_archive)
+        for site in selected:
+            row = average_morning(payloads[site.id])
+            output_path = site.output_dir / OUTPUT_CSV.name
+            save_csv(row, output_path)
+            print(f"Saved weather averages for {row['date']} ({site.name}) to {output_path}")
+        return
 
     weather_json = fetch_weather(target_date, use_archive)
     averages = average_morning(weather_json)
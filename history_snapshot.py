@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+履歴の列形式スナップショット（data/history.cols）を pandas なしで扱うための小さな層。
+
+スナップショットの作成・pandas への変換は history_store が行う。ここでは
+「履歴（history.csv と履歴ストア data/history.sqlite）と同期しているスナップショットがあれば、
+その配列を mmap で返す」だけを担い、
+predict_model の高速経路のように起動時間を抑えたい処理から使う。
+列ごとの配列のほか、前日特徴量の元データ（LAG_SOURCE_ARRAY）を評価に使う形のまま持つ。
+"""
+
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+import columnar
+
+SNAPSHOT_VERSION = 2
+# (行数, features.BASE_FEATURE_COLUMNS の列数) の float64 配列（列が無い・数値でない値は NaN）
+LAG_SOURCE_ARRAY = "lag_source"
+
+
+def file_signature(path: Path) -> Optional[str]:
+    if not path.exists():
+        return None
+    stat = path.stat()
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def snapshot_path_for(csv_path: Path) -> Path:
+    return Path(csv_path).with_suffix(".cols")
+
+
+def store_path_for(csv_path: Path) -> Path:
+    return Path(csv_path).with_suffix(".sqlite")
+
+
+def store_signature(db_path: Path) -> Optional[str]:
+    """SQLite ファイルの (inode, ヘッダの変更カウンタ)。書き込みをコミットするたびに変わる。無ければ None。
+
+    更新時刻は分解能が粗く、同じ時刻に続けてコミットすると見分けられないのでカウンタを使う。
+    """
+    try:
+        with open(db_path, "rb") as f:
+            header = f.read(28)
+            inode = os.fstat(f.fileno()).st_ino
+    except FileNotFoundError:
+        return None
+    counter = int.from_bytes(header[24:28], "big") if len(header) == 28 else 0
+    return f"{inode}:{counter}"
+
+
+def history_signature(csv_path: Path) -> Optional[str]:
+    """history.csv と履歴ストアを合わせた版。どちらも無ければ None。"""
+    csv_signature = file_signature(Path(csv_path))
+    db_signature = store_signature(store_path_for(csv_path))
+    if csv_signature is None and db_signature is None:
+        return None
+    return f"{csv_signature}|{db_signature}"
+
+
+def read_fresh_snapshot(
+    csv_path: Path,
+    columns: Optional[Iterable[str]] = None,
+    extra: Iterable[str] = (),
+) -> Optional[Tuple[dict, Dict[str, np.ndarray]]]:
+    """履歴と同期しているスナップショットの (metadata, 列名→配列) を返す。
+
+    スナップショットが無い・古い・壊れている場合は None（呼び出し側で history_store から作り直す）。
+    int / string 列は欠損マスク（"<列名>.mask"）も一緒に返す。extra には列以外の配列（LAG_SOURCE_ARRAY）の名前を渡す。
+    """
+    csv_path = Path(csv_path)
+    signature = history_signature(csv_path)
+    snapshot_path = snapshot_path_for(csv_path)
+    if signature is None or not snapshot_path.exists():
+        return None
+    try:
+        metadata = columnar.read_metadata(snapshot_path)
+        if metadata.get("version") != SNAPSHOT_VERSION or metadata.get("source_signature") != signature:
+            return None
+        kinds = metadata["kinds"]
+        wanted = metadata["columns"] if columns is None else [col for col in columns if col in kinds]
+        names = [*wanted, *(f"{col}.mask" for col in wanted if kinds[col] in ("int", "string")), *extra]
+        _, arrays = columnar.read_arrays(snapshot_path, names=names)
+    except (OSError, ValueError, KeyError):
+        return None
+    return metadata, arrays
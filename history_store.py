@@ -0,0 +1,727 @@
+#!/usr/bin/env python3
+"""
+履歴の保存層。
+  - 実体（正本）は data/history.sqlite に (site, date) をキーとして1行ずつ保存し、upsert / 削除は索引付きの行更新で行う。
+    書き込みの費用は履歴の行数によらない
+  - 書き込みはプロセス間ロック（data/history.lock）を取ったうえで1トランザクションとして行う。
+    まだ history.csv に書き出していない日付はストアの pending 表に記録する
+  - history.csv はエクスポートしたビューで、`python history_store.py --export`（GitHub Actions のコミット前の手順）
+    でだけ一時ファイルに書いてから os.replace で差し替える。書き込む側はエクスポートしない
+  - history.csv が外部で変更された場合（手編集・git pull など）は次回のトランザクションで取り込む。
+    未エクスポートの日付はストアの値を残す（書き出していない変更を失わない）
+  - 読み込みは列形式スナップショット（data/history.cols）を mmap して行う（read_history_frame）。
+    スナップショットは history.csv とストアの版（history_signature）と照合し、古ければストアから作り直す
+  - 推論用には日付索引付きの HistoryView を履歴の版ごとにプロセス内でキャッシュする
+  - pipeline / main.py が1日分の記録を組み立て、メモリ上の履歴へ反映する関数（build_history_record・
+    upsert_history_records）もここに置く
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import datetime as dt
+import json
+import os
+import sqlite3
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pandas as pd
+
+import columnar
+from features import BASE_FEATURE_COLUMNS
+from history_snapshot import (
+    LAG_SOURCE_ARRAY,
+    SNAPSHOT_VERSION,
+    file_signature,
+    history_signature,
+    snapshot_path_for,
+    store_path_for,
+)
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows ではロックなしで動かす
+    fcntl = None
+
+HISTORY_CSV = Path("data/history.csv")
+DEFAULT_SITE = "echizen-ono"
+
+# history.csv の列定義（空ファイルや列欠けのときに補完する）
+FLOAT_COLUMNS = {
+    "temp",
+    "humidity",
+    "wind",
+    "cloud",
+    "rain",
+    "fog_probability",
+    "castle_probability",
+    "fog_score",
+    "castle_score",
+    "dew_point",
+    "dew_spread",
+    "castle_event_probability",
+}
+INT_COLUMNS = {"fog_observed", "castle_visible"}
+STRING_COLUMNS = {"note", "event", "updated_at"}
+REQUIRED_COLUMNS = ["date"] + sorted(FLOAT_COLUMNS) + sorted(INT_COLUMNS) + sorted(STRING_COLUMNS)
+DTYPE_MAP = {
+    **{col: "Float64" for col in FLOAT_COLUMNS},
+    **{col: "Int64" for col in INT_COLUMNS},
+    **{col: "string" for col in STRING_COLUMNS},
+    "date": "string",
+}
+# 新しい日付の行を追加するときの初期値
+INSERT_DEFAULTS = {"fog_observed": 0, "castle_visible": 0, "note": ""}
+
+
+def normalize_history(history_df: pd.DataFrame) -> pd.DataFrame:
+    """history_df に必要な列を揃え、列ごとの型を DTYPE_MAP に合わせる。"""
+    # history.csv が空の場合は必要な列を整える
+    if history_df.empty:
+        history_df = pd.DataFrame({col: pd.Series(dtype=DTYPE_MAP[col]) for col in REQUIRED_COLUMNS})
+
+    # 既存の列がない場合は追加、存在する場合は型を揃える
+    for key in REQUIRED_COLUMNS:
+        if key not in history_df.columns:
+            history_df[key] = pd.Series(dtype=DTYPE_MAP[key])
+        else:
+            history_df[key] = history_df[key].astype(DTYPE_MAP[key])
+    return history_df
+
+
+def normalize_date(value) -> str:
+    if isinstance(value, str):
+        return value
+    return pd.Timestamp(value).strftime("%Y-%m-%d")
+
+
+def to_sql_value(value):
+    if value is None:
+        return None
+    try:
+        if pd.isna(value):
+            return None
+    except (TypeError, ValueError):
+        return value
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+
+def atomic_write_csv(df: pd.DataFrame, path: Path) -> None:
+    """一時ファイルに書き出してから置き換え、読み手が書きかけのファイルを見ないようにする。"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=path.parent)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+            df.to_csv(f, index=False)
+        os.replace(tmp_name, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp_name)
+        raise
+
+
+@contextlib.contextmanager
+def file_lock(lock_path: Path) -> Iterator[None]:
+    """lock_path に対する排他ロック（プロセス間）。"""
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with lock_path.open("a+") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def column_kind(column: str, series: Optional[pd.Series] = None) -> str:
+    """スナップショット上の列の種類（date / float / int / string）。"""
+    if column == "date":
+        return "date"
+    if column in FLOAT_COLUMNS:
+        return "float"
+    if column in INT_COLUMNS:
+        return "int"
+    if column in STRING_COLUMNS:
+        return "string"
+    if series is not None and pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+        return "float"
+    return "string"
+
+
+def encode_history(df: pd.DataFrame) -> tuple[Dict[str, np.ndarray], Dict[str, str]]:
+    """history の DataFrame を列ごとの固定長配列（欠損はマスク配列）に変換する。"""
+    arrays: Dict[str, np.ndarray] = {}
+    kinds: Dict[str, str] = {}
+    for col in df.columns:
+        series = df[col]
+        kind = column_kind(col, series)
+        kinds[col] = kind
+        if kind == "date":
+            arrays[col] = pd.to_datetime(series, errors="coerce").to_numpy(dtype="datetime64[D]")
+        elif kind == "float":
+            arrays[col] = pd.to_numeric(series, errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+        else:
+            mask = series.isna().to_numpy()
+            if kind == "int":
+                values = pd.to_numeric(series, errors="coerce").fillna(0).to_numpy(dtype="int64")
+            else:
+                values = series.astype("string").fillna("").to_numpy(dtype=str)
+            arrays[col] = values
+            arrays[f"{col}.mask"] = mask
+    return arrays, kinds
+
+
+def decode_history(arrays: Dict[str, np.ndarray], columns: List[str], kinds: Dict[str, str]) -> pd.DataFrame:
+    data = {}
+    for col in columns:
+        kind = kinds[col]
+        values = arrays[col]
+        if kind == "date":
+            data[col] = pd.Series(values.astype("datetime64[s]"), copy=False)
+        elif kind == "float":
+            data[col] = pd.Series(values, copy=False)
+        elif kind == "int":
+            data[col] = pd.Series(pd.arrays.IntegerArray(values, arrays[f"{col}.mask"]), copy=False)
+        else:
+            objects = values.astype(object)
+            objects[arrays[f"{col}.mask"]] = None
+            data[col] = pd.Series(pd.array(objects, dtype="string"), copy=False)
+    return pd.DataFrame(data, columns=columns, copy=False)
+
+
+def write_history_snapshot(df: pd.DataFrame, csv_path: Path, signature: Optional[str]) -> dict:
+    """履歴 df を列形式スナップショットとして保存する（signature は df を読んだときの history_signature）。"""
+    arrays, kinds = encode_history(df)
+    missing = np.full(len(df), np.nan)
+    arrays[LAG_SOURCE_ARRAY] = np.column_stack(
+        [arrays[col] if kinds.get(col) == "float" else missing for col in BASE_FEATURE_COLUMNS]
+    ).reshape(len(df), len(BASE_FEATURE_COLUMNS))
+    metadata = {
+        "version": SNAPSHOT_VERSION,
+        "source_signature": signature,
+        "rows": len(df),
+        "columns": list(df.columns),
+        "kinds": kinds,
+    }
+    columnar.write_arrays(snapshot_path_for(csv_path), arrays, metadata)
+    return metadata
+
+
+def empty_history_frame(columns: Optional[Iterable[str]] = None) -> pd.DataFrame:
+    columns = list(columns) if columns is not None else list(REQUIRED_COLUMNS)
+    data = {}
+    for col in columns:
+        kind = column_kind(col)
+        dtype = {"date": "datetime64[s]", "float": "float64", "int": "Int64"}.get(kind, "string")
+        data[col] = pd.Series(dtype=dtype)
+    return pd.DataFrame(data, columns=columns)
+
+
+def read_history_frame(
+    columns: Optional[Iterable[str]] = None,
+    csv_path: Path = HISTORY_CSV,
+) -> pd.DataFrame:
+    """履歴を列形式スナップショットから読み込む（columns で必要な列だけを読む）。
+
+    型は DTYPE_MAP に沿って float64（欠損は NaN）/ Int64 / string になり、date は datetime64 で返す。
+    未エクスポートの書き込みも含む。スナップショットが無いか履歴より古い場合は、
+    履歴ストア（無ければ history.csv）から1回だけ作り直す。
+    """
+    csv_path = Path(csv_path)
+    signature = history_signature(csv_path)
+    if signature is None:
+        return empty_history_frame(columns)
+
+    snapshot_path = snapshot_path_for(csv_path)
+    metadata = None
+    if snapshot_path.exists():
+        try:
+            metadata = columnar.read_metadata(snapshot_path)
+        except (OSError, ValueError):
+            metadata = None
+    if (
+        metadata is None
+        or metadata.get("version") != SNAPSHOT_VERSION
+        or metadata.get("source_signature") != signature
+    ):
+        metadata = refresh_history_snapshot(csv_path)
+
+    kinds = metadata["kinds"]
+    wanted = metadata["columns"] if columns is None else [col for col in columns if col in kinds]
+    names = [*wanted, *(f"{col}.mask" for col in wanted if kinds[col] in ("int", "string"))]
+    _, arrays = columnar.read_arrays(snapshot_path, names=names)
+    return decode_history(arrays, wanted, kinds)
+
+
+def refresh_history_snapshot(csv_path: Path = HISTORY_CSV) -> dict:
+    """履歴ストア（無ければ history.csv）から列形式スナップショットを作り直し、その metadata を返す。"""
+    csv_path = Path(csv_path)
+    if store_path_for(csv_path).exists():
+        return HistoryStore(csv_path).write_snapshot()
+    signature = history_signature(csv_path)
+    return write_history_snapshot(pd.read_csv(csv_path), csv_path, signature)
+
+
+def to_day(value) -> np.datetime64:
+    return pd.Timestamp(value).to_datetime64().astype("datetime64[D]")
+
+
+class HistoryView:
+    """日付順に並べた履歴（日付の重複は後勝ち）と、その日付索引。
+
+    「ある日付より前の直近の行」や「日付の完全一致」を二分探索で引けるようにする。
+    数値列は float64（欠損は NaN）に揃える。
+    """
+
+    def __init__(self, frame: pd.DataFrame) -> None:
+        self.frame = frame
+        self.dates = frame["date"].to_numpy(dtype="datetime64[D]")
+        self._subsets: Dict[tuple, tuple[np.ndarray, np.ndarray]] = {}
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "HistoryView":
+        frame = df.copy() if "date" in df.columns else empty_history_frame()
+        frame["date"] = pd.to_datetime(frame["date"], errors="coerce")
+        frame = frame.dropna(subset=["date"]).sort_values("date", kind="stable")
+        frame = frame.drop_duplicates(subset=["date"], keep="last").reset_index(drop=True)
+        for col in frame.columns:
+            if isinstance(frame[col].dtype, pd.Float64Dtype):
+                frame[col] = frame[col].astype("float64")
+        return cls(frame)
+
+    @property
+    def empty(self) -> bool:
+        return self.frame.empty
+
+    def _subset_index(self, subset: Optional[Iterable[str]]) -> tuple[np.ndarray, np.ndarray]:
+        """subset の列のいずれかに値がある行の (位置, 日付)。subset 未指定なら全行。"""
+        key = tuple(subset) if subset else ()
+        if key not in self._subsets:
+            if key:
+                columns = [col for col in key if col in self.frame.columns]
+                mask = self.frame[columns].notna().any(axis=1).to_numpy()
+                positions = np.flatnonzero(mask)
+            else:
+                positions = np.arange(len(self.frame))
+            self._subsets[key] = (positions, self.dates[positions])
+        return self._subsets[key]
+
+    def previous_row(self, date, subset: Optional[Iterable[str]] = None) -> Optional[pd.Series]:
+        """date より前の直近の行（subset 指定時はその列がすべて欠損の行を飛ばす）。"""
+        positions, dates = self._subset_index(subset)
+        idx = int(np.searchsorted(dates, to_day(date), side="left")) - 1
+        if idx < 0:
+            return None
+        return self.frame.iloc[positions[idx]]
+
+    def positions_for(self, dates: Iterable) -> np.ndarray:
+        """各日付に完全一致する行の位置（無ければ -1）。"""
+        targets = pd.to_datetime(pd.Index(list(dates))).to_numpy(dtype="datetime64[D]")
+        if not len(self.dates):
+            return np.full(len(targets), -1)
+        idx = np.searchsorted(self.dates, targets, side="left")
+        clipped = np.minimum(idx, len(self.dates) - 1)
+        found = (idx < len(self.dates)) & (self.dates[clipped] == targets)
+        return np.where(found, idx, -1)
+
+    def row_for(self, date) -> Optional[pd.Series]:
+        position = self.positions_for([date])[0]
+        return None if position < 0 else self.frame.iloc[position]
+
+    def latest(self) -> Optional[pd.Series]:
+        return None if self.frame.empty else self.frame.iloc[-1]
+
+
+_VIEW_CACHE: Dict[Path, tuple[str, HistoryView]] = {}
+
+
+def load_history_view(csv_path: Path = HISTORY_CSV) -> HistoryView:
+    """履歴の HistoryView を返す。同じプロセス内では履歴の版（history_signature）が変わるまで使い回す。"""
+    csv_path = Path(csv_path)
+    signature = history_signature(csv_path)
+    if signature is None:
+        return HistoryView.from_frame(empty_history_frame())
+
+    key = csv_path.resolve()
+    cached = _VIEW_CACHE.get(key)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    view = HistoryView.from_frame(read_history_frame(csv_path=csv_path))
+    _VIEW_CACHE[key] = (signature, view)
+    return view
+
+
+def read_history() -> pd.DataFrame:
+    """履歴全体を DTYPE_MAP の型で読む（date は "YYYY-MM-DD" の文字列。pipeline のメモリ上の履歴用）。"""
+    history_df = read_history_frame(csv_path=HISTORY_CSV)
+    history_df["date"] = history_df["date"].dt.strftime("%Y-%m-%d")
+    return normalize_history(history_df)
+
+
+def build_history_record(weather: dict, feed: dict) -> dict:
+    """weather.csv の最新行と feed.json の内容から history.csv の1行分を組み立てる。"""
+
+    def to_float(value):
+        return float(value) if value is not None else pd.NA
+
+    return {
+        "date": feed["date"],
+        "temp": to_float(weather.get("temp")),
+        "humidity": to_float(weather.get("humidity")),
+        "wind": to_float(weather.get("wind")),
+        "cloud": to_float(weather.get("cloud")),
+        "rain": to_float(weather.get("rain")),
+        "fog_probability": to_float(feed.get("fog_probability")),
+        "castle_probability": to_float(feed.get("castle_probability")),
+        "castle_event_probability": to_float(feed.get("castle_event_probability")),
+        "fog_score": to_float(feed.get("fog_score")),
+        "castle_score": to_float(feed.get("castle_score")),
+        "dew_point": to_float(feed.get("dew_point")),
+        "dew_spread": to_float(feed.get("dew_spread")),
+        "event": feed.get("event", "") or "",
+        "updated_at": dt.datetime.now(ZoneInfo("Asia/Tokyo")).isoformat(),
+    }
+
+
+def upsert_history_records(history_df: pd.DataFrame, records: list[dict]) -> tuple[pd.DataFrame, int, int]:
+    """複数の record を history_df にまとめて反映し、(更新後の DataFrame, 更新件数, 追加件数) を返す。"""
+    history_df = normalize_history(history_df)
+    if not records:
+        return history_df, 0, 0
+
+    records_df = pd.DataFrame.from_records(records).drop_duplicates(subset=["date"], keep="last")
+    records_df = records_df.astype({col: DTYPE_MAP[col] for col in records_df.columns if col in DTYPE_MAP})
+
+    existing_mask = history_df["date"].isin(records_df["date"])
+    if existing_mask.any():
+        indexed = records_df.set_index("date")
+        existing_dates = history_df.loc[existing_mask, "date"]
+        for key in indexed.columns:
+            history_df.loc[existing_mask, key] = existing_dates.map(indexed[key]).to_numpy()
+
+    new_df = records_df[~records_df["date"].isin(history_df["date"])].copy()
+    if not new_df.empty:
+        for key, value in INSERT_DEFAULTS.items():
+            if key not in new_df.columns:
+                new_df[key] = value
+        new_df = new_df.reindex(columns=history_df.columns).astype(history_df.dtypes.to_dict())
+        history_df = pd.concat([history_df, new_df], ignore_index=True)
+
+    return history_df, int(existing_mask.sum()), len(new_df)
+
+
+def upsert_history_record(history_df: pd.DataFrame, record: dict) -> tuple[pd.DataFrame, str]:
+    """record を history_df に追加（同じ日付があれば上書き）し、更新後の DataFrame と処理内容を返す。"""
+    history_df, updated, _ = upsert_history_records(history_df, [record])
+    action = "updated existing record" if updated else "appended new record"
+    return history_df, action
+
+
+def sql_type(column: str) -> str:
+    if column in FLOAT_COLUMNS:
+        return "REAL"
+    if column in INT_COLUMNS:
+        return "INTEGER"
+    return "TEXT"
+
+
+def quote(column: str) -> str:
+    return '"' + column.replace('"', '""') + '"'
+
+
+class HistoryStore:
+    """サイトごとの履歴を date キーで保持し（正本）、history.csv をビューとして書き出す。"""
+
+    def __init__(
+        self,
+        csv_path: Path = HISTORY_CSV,
+        db_path: Optional[Path] = None,
+        site: str = DEFAULT_SITE,
+    ) -> None:
+        self.csv_path = Path(csv_path)
+        self.db_path = Path(db_path) if db_path is not None else store_path_for(self.csv_path)
+        self.lock_path = self.db_path.with_suffix(".lock")
+        self.site = site
+
+    # ------------------------------------------------------------------
+    # 接続・同期
+    # ------------------------------------------------------------------
+    @contextlib.contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """ロックを取り、history.csv と同期した状態で1トランザクションを実行する。"""
+        with file_lock(self.lock_path), self._begin() as conn:
+            yield conn
+
+    @contextlib.contextmanager
+    def _begin(self) -> Iterator[sqlite3.Connection]:
+        """ロックを取った状態で呼ぶ。history.csv と同期してから1トランザクションを実行する。"""
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            self._ensure_schema(conn)
+            self._sync_from_csv(conn)
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _ensure_schema(self, conn: sqlite3.Connection) -> None:
+        columns = ", ".join(
+            f"{quote(col)} {sql_type(col)}" for col in REQUIRED_COLUMNS if col != "date"
+        )
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS history (site TEXT NOT NULL, date TEXT NOT NULL, {columns}, "
+            "PRIMARY KEY (site, date))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (site TEXT NOT NULL, key TEXT NOT NULL, value TEXT, "
+            "PRIMARY KEY (site, key))"
+        )
+        # history.csv にまだ書き出していない（追加・更新・削除した）日付
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS pending (site TEXT NOT NULL, date TEXT NOT NULL, PRIMARY KEY (site, date))"
+        )
+
+    def _table_columns(self, conn: sqlite3.Connection) -> List[str]:
+        return [row[1] for row in conn.execute("PRAGMA table_info(history)")]
+
+    def _add_columns(self, conn: sqlite3.Connection, columns: Iterable[str]) -> None:
+        existing = set(self._table_columns(conn))
+        for col in columns:
+            if col not in existing:
+                conn.execute(f"ALTER TABLE history ADD COLUMN {quote(col)} {sql_type(col)}")
+                existing.add(col)
+
+    def _get_meta(self, conn: sqlite3.Connection, key: str) -> Optional[str]:
+        row = conn.execute("SELECT value FROM meta WHERE site = ? AND key = ?", (self.site, key)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, conn: sqlite3.Connection, key: str, value: Optional[str]) -> None:
+        conn.execute(
+            "INSERT INTO meta (site, key, value) VALUES (?, ?, ?) "
+            "ON CONFLICT(site, key) DO UPDATE SET value = excluded.value",
+            (self.site, key, value),
+        )
+
+    def _column_order(self, conn: sqlite3.Connection) -> List[str]:
+        stored = self._get_meta(conn, "csv_columns")
+        order = json.loads(stored) if stored else list(REQUIRED_COLUMNS)
+        extra = [col for col in self._table_columns(conn) if col not in order and col != "site"]
+        return order + [col for col in REQUIRED_COLUMNS if col in extra] + [
+            col for col in extra if col not in REQUIRED_COLUMNS
+        ]
+
+    def _pending_dates(self, conn: sqlite3.Connection) -> set[str]:
+        return {row[0] for row in conn.execute("SELECT date FROM pending WHERE site = ?", (self.site,))}
+
+    def _mark_pending(self, conn: sqlite3.Connection, dates: Iterable[str]) -> None:
+        conn.executemany(
+            "INSERT OR IGNORE INTO pending (site, date) VALUES (?, ?)",
+            ((self.site, date) for date in dates),
+        )
+
+    def _sync_from_csv(self, conn: sqlite3.Connection) -> None:
+        """外部で変更された history.csv を取り込む。未エクスポートの日付はストアの値を残す。"""
+        signature = file_signature(self.csv_path)
+        if signature is None or signature == self._get_meta(conn, "csv_signature"):
+            return
+
+        csv_df = pd.read_csv(self.csv_path)
+        csv_df = csv_df.dropna(subset=["date"]) if "date" in csv_df.columns else csv_df
+        self._add_columns(conn, [col for col in csv_df.columns if col != "date"])
+        conn.execute(
+            "DELETE FROM history WHERE site = ? AND date NOT IN (SELECT date FROM pending WHERE site = ?)",
+            (self.site, self.site),
+        )
+        pending = self._pending_dates(conn)
+        if pending and "date" in csv_df.columns:
+            csv_df = csv_df[~csv_df["date"].map(normalize_date).isin(pending)]
+        self._insert_frame(conn, csv_df)
+        self._set_meta(conn, "csv_columns", json.dumps(list(csv_df.columns)))
+        self._set_meta(conn, "csv_signature", signature)
+
+    def _insert_frame(self, conn: sqlite3.Connection, df: pd.DataFrame) -> None:
+        if df.empty:
+            return
+        columns = [col for col in df.columns if col != "date"]
+        placeholders = ", ".join("?" for _ in range(len(columns) + 2))
+        sql = (
+            f"INSERT OR REPLACE INTO history (site, date{''.join(', ' + quote(c) for c in columns)}) "
+            f"VALUES ({placeholders})"
+        )
+        dates = [normalize_date(value) for value in df["date"]]
+        values = df[columns].astype(object).to_numpy() if columns else [[] for _ in dates]
+        conn.executemany(
+            sql,
+            (
+                (self.site, date, *(to_sql_value(value) for value in row))
+                for date, row in zip(dates, values)
+            ),
+        )
+
+    # ------------------------------------------------------------------
+    # 読み書き
+    # ------------------------------------------------------------------
+    def _upsert(self, conn: sqlite3.Connection, records: List[dict]) -> tuple[int, int]:
+        before = conn.execute("SELECT COUNT(*) FROM history WHERE site = ?", (self.site,)).fetchone()[0]
+        groups: dict[tuple[str, ...], list] = {}
+        for record in records:
+            columns = tuple(key for key in record if key != "date")
+            groups.setdefault(columns, []).append(record)
+
+        for columns, group in groups.items():
+            self._add_columns(conn, columns)
+            insert_columns = list(columns) + [col for col in INSERT_DEFAULTS if col not in columns]
+            placeholders = ", ".join("?" for _ in range(len(insert_columns) + 2))
+            if columns:
+                update = ", ".join(f"{quote(col)} = excluded.{quote(col)}" for col in columns)
+                conflict = f"DO UPDATE SET {update}"
+            else:
+                conflict = "DO NOTHING"
+            sql = (
+                f"INSERT INTO history (site, date{''.join(', ' + quote(c) for c in insert_columns)}) "
+                f"VALUES ({placeholders}) ON CONFLICT(site, date) {conflict}"
+            )
+            conn.executemany(
+                sql,
+                (
+                    (
+                        self.site,
+                        normalize_date(record["date"]),
+                        *(to_sql_value(record[col]) for col in columns),
+                        *(INSERT_DEFAULTS[col] for col in insert_columns[len(columns):]),
+                    )
+                    for record in group
+                ),
+            )
+        after = conn.execute("SELECT COUNT(*) FROM history WHERE site = ?", (self.site,)).fetchone()[0]
+        inserted = after - before
+        # 同じ日付が複数回あっても1行の更新として数える
+        dates = {normalize_date(record["date"]) for record in records}
+        self._mark_pending(conn, dates)
+        return len(dates) - inserted, inserted
+
+    def upsert_many(self, records: Iterable[dict]) -> tuple[int, int]:
+        """records を date キーで反映し、(更新した行数, 追加した行数) を返す。
+
+        record に含まれる列だけを更新するため、同時に別の列を更新したプロセスの変更は失われない。
+        history.csv への反映は次の export_csv（`python history_store.py --export`）で行う。
+        """
+        records = list(records)
+        with self.transaction() as conn:
+            return self._upsert(conn, records)
+
+    def upsert(self, record: dict) -> str:
+        updated, _ = self.upsert_many([record])
+        return "updated existing record" if updated else "appended new record"
+
+    def delete_many(self, dates: Iterable) -> int:
+        """dates の行を削除し、削除した行数を返す。"""
+        dates = sorted({normalize_date(date) for date in dates})
+        with self.transaction() as conn:
+            deleted = conn.executemany(
+                "DELETE FROM history WHERE site = ? AND date = ?",
+                ((self.site, date) for date in dates),
+            ).rowcount
+            self._mark_pending(conn, dates)
+        return deleted
+
+    def _read(self, conn: sqlite3.Connection) -> pd.DataFrame:
+        columns = self._column_order(conn)
+        df = pd.read_sql_query(
+            f"SELECT {', '.join(quote(col) for col in columns)} FROM history WHERE site = ? ORDER BY date",
+            conn,
+            params=(self.site,),
+        )
+        for col in columns:
+            if col in DTYPE_MAP:
+                df[col] = df[col].astype(DTYPE_MAP[col])
+        return df
+
+    def read_frame(self) -> pd.DataFrame:
+        with self.transaction() as conn:
+            return self._read(conn)
+
+    def write_snapshot(self) -> dict:
+        """いまのストアの内容で列形式スナップショットを書き直し、その metadata を返す。"""
+        with file_lock(self.lock_path):
+            with self._begin() as conn:
+                df = self._read(conn)
+            # コミットした後の版を記録する（ロック中なので他の書き込みは入らない）
+            return write_history_snapshot(df, self.csv_path, history_signature(self.csv_path))
+
+    def export_csv(self, force: bool = False) -> bool:
+        """未エクスポートの変更があれば history.csv（ビュー）と列形式スナップショットを書き出す。
+
+        書き出したら True。force なら変更が無くても書き出す。
+        """
+        with file_lock(self.lock_path):
+            with self._begin() as conn:
+                if not (force or self._pending_dates(conn) or not self.csv_path.exists()):
+                    return False
+                df = self._read(conn)
+                atomic_write_csv(df, self.csv_path)
+                self._set_meta(conn, "csv_signature", file_signature(self.csv_path))
+                conn.execute("DELETE FROM pending WHERE site = ?", (self.site,))
+            write_history_snapshot(df, self.csv_path, history_signature(self.csv_path))
+        return True
+
+
+def frame_changes(before: pd.DataFrame, after: pd.DataFrame) -> tuple[List[dict], List[str]]:
+    """表の編集前後（行は index で対応付ける）を比べ、(upsert する記録, 削除する日付) を返す。
+
+    既存の行は値が変わった列だけを記録に含める。新しい行は全列を含め、消えた行・日付を変えた行の元の日付は削除する。
+    """
+    def same(old, new) -> bool:
+        if pd.isna(old) or pd.isna(new):
+            return bool(pd.isna(old) and pd.isna(new))
+        return bool(old == new)
+
+    columns = [col for col in after.columns if col != "date"]
+    before_dates = {idx: normalize_date(date) for idx, date in before["date"].items() if not pd.isna(date)}
+    records: List[dict] = []
+    kept: set[str] = set()
+    for idx, row in after.iterrows():
+        if pd.isna(row["date"]):
+            continue
+        date = normalize_date(row["date"])
+        kept.add(date)
+        if before_dates.get(idx) == date:
+            old = before.loc[idx]
+            changed = {col: row[col] for col in columns if col not in old.index or not same(old[col], row[col])}
+        else:
+            changed = {col: row[col] for col in columns}
+        if changed or before_dates.get(idx) != date:
+            records.append({"date": date, **changed})
+    deleted = sorted(set(before_dates.values()) - kept)
+    return records, deleted
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="履歴ストア（data/history.sqlite）を操作します。")
+    parser.add_argument(
+        "--export",
+        action="store_true",
+        help="未エクスポートの変更を history.csv と列形式スナップショットへ書き出す。",
+    )
+    parser.add_argument("--force", action="store_true", help="--export で、変更が無くても書き出す。")
+    args = parser.parse_args()
+    if args.export:
+        exported = HistoryStore(HISTORY_CSV).export_csv(force=args.force)
+        print(f"Exported {HISTORY_CSV}" if exported else f"{HISTORY_CSV} is up to date")
+
+
+if __name__ == "__main__":
+    main()
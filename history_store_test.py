@@ -0,0 +1,155 @@
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+import model_store
+from features import BASE_FEATURE_COLUMNS
+from history_store import HistoryStore, frame_changes, read_history_frame
+
+
+def write_history(path, rows):
+    pd.DataFrame(rows).to_csv(path, index=False)
+
+
+def make_store(tmp_path):
+    csv_path = tmp_path / "history.csv"
+    write_history(
+        csv_path,
+        [
+            {"date": "2025-10-28", "temp": 9.5, "humidity": 90.0, "fog_observed": 0, "castle_visible": 0, "note": "a"},
+            {"date": "2025-10-29", "temp": 7.75, "humidity": 78.5, "fog_observed": 1, "castle_visible": 1, "note": ""},
+        ],
+    )
+    return HistoryStore(csv_path), csv_path
+
+
+def test_upsert_round_trip_and_export(tmp_path):
+    store, csv_path = make_store(tmp_path)
+    exported = csv_path.read_text()
+
+    counts = store.upsert_many(
+        [
+            {"date": "2025-10-28", "temp": 10.25},
+            {"date": "2025-10-30", "temp": 6.0, "humidity": 95.0},
+        ]
+    )
+    assert counts == (1, 1)
+    # upsert だけでは history.csv は書き換えない
+    assert csv_path.read_text() == exported
+
+    frame = store.read_frame().set_index("date")
+    assert frame.loc["2025-10-28", "temp"] == 10.25
+    assert frame.loc["2025-10-28", "note"] == "a"  # 渡していない列はそのまま
+    assert frame.loc["2025-10-30", "humidity"] == 95.0
+
+    assert store.export_csv() is True
+    assert store.export_csv() is False  # 変更が無ければ書き出さない
+    csv = pd.read_csv(csv_path).set_index("date")
+    assert list(csv.index) == ["2025-10-28", "2025-10-29", "2025-10-30"]
+    assert csv.loc["2025-10-28", "temp"] == 10.25
+    assert csv.loc["2025-10-29", "fog_observed"] == 1
+
+    snapshot = read_history_frame(["date", "temp"], csv_path)
+    assert snapshot["temp"].tolist() == [10.25, 7.75, 6.0]
+
+
+def test_upsert_counts_duplicate_dates_once(tmp_path):
+    store, csv_path = make_store(tmp_path)
+
+    counts = store.upsert_many(
+        [
+            {"date": "2025-10-29", "temp": 1.0},
+            {"date": "2025-10-29", "temp": 2.0},
+            {"date": "2025-11-01", "temp": 3.0},
+            {"date": "2025-11-01", "temp": 4.0},
+        ]
+    )
+    assert counts == (1, 1)
+    assert store.upsert({"date": "2025-11-01", "temp": 5.0}) == "updated existing record"
+    assert store.upsert({"date": "2025-11-02", "temp": 5.0}) == "appended new record"
+
+    store.export_csv()
+    temps = pd.read_csv(csv_path).set_index("date")["temp"]
+    assert temps["2025-10-29"] == 2.0  # 同じ日付は後勝ち
+    assert temps["2025-11-01"] == 5.0
+    assert len(temps) == 4
+
+
+def test_external_csv_edit_is_picked_up(tmp_path):
+    store, csv_path = make_store(tmp_path)
+    store.upsert({"date": "2025-10-28", "temp": 11.0})
+    store.export_csv()
+
+    frame = pd.read_csv(csv_path)
+    frame.loc[frame["date"] == "2025-10-29", "note"] = "edited"
+    frame.to_csv(csv_path, index=False)
+
+    store.upsert({"date": "2025-10-30", "temp": 6.0})
+    store.export_csv()
+    csv = pd.read_csv(csv_path).set_index("date")
+    assert csv.loc["2025-10-29", "note"] == "edited"
+    assert csv.loc["2025-10-28", "temp"] == 11.0
+    assert csv.loc["2025-10-30", "temp"] == 6.0
+
+
+def test_external_csv_edit_keeps_unexported_writes(tmp_path):
+    store, csv_path = make_store(tmp_path)
+    store.upsert({"date": "2025-10-28", "temp": 11.0})  # まだ history.csv に書き出していない
+
+    frame = pd.read_csv(csv_path)
+    frame.loc[frame["date"] == "2025-10-28", "temp"] = 0.0
+    frame.loc[frame["date"] == "2025-10-29", "note"] = "edited"
+    frame.to_csv(csv_path, index=False)
+
+    history = store.read_frame().set_index("date")
+    assert history.loc["2025-10-28", "temp"] == 11.0  # 未エクスポートの日付はストアの値を残す
+    assert history.loc["2025-10-29", "note"] == "edited"
+
+
+def test_readers_see_unexported_writes(tmp_path):
+    store, csv_path = make_store(tmp_path)
+    assert read_history_frame(["date", "temp"], csv_path)["temp"].tolist() == [9.5, 7.75]
+
+    store.upsert({"date": "2025-10-30", "temp": 6.0})
+    assert model_store.read_lag_source(csv_path) is None  # スナップショットが古い
+    assert read_history_frame(["date", "temp"], csv_path)["temp"].tolist() == [9.5, 7.75, 6.0]
+    dates, _ = model_store.read_lag_source(csv_path)
+    assert len(dates) == 3
+
+
+def test_frame_changes_writes_only_edited_rows(tmp_path):
+    store, csv_path = make_store(tmp_path)
+    before = store.read_frame()
+    after = before.copy()
+    after.loc[0, "note"] = "edited"
+    after = after.drop(index=1)
+    after.loc[5] = {**{col: pd.NA for col in after.columns}, "date": "2025-11-01", "temp": 5.0}
+
+    records, deleted = frame_changes(before, after)
+    assert records[0] == {"date": "2025-10-28", "note": "edited"}  # 変わった列だけ
+    assert records[1]["date"] == "2025-11-01" and records[1]["temp"] == 5.0  # 新しい行は全列
+    assert deleted == ["2025-10-29"]
+
+    # 表を読んだ後に別のプロセスが更新した列は上書きしない
+    store.upsert({"date": "2025-10-28", "temp": 12.0})
+    assert store.delete_many(deleted) == 1
+    store.upsert_many(records)
+    assert store.export_csv() is True
+    csv = pd.read_csv(csv_path).set_index("date")
+    assert list(csv.index) == ["2025-10-28", "2025-11-01"]
+    assert csv.loc["2025-10-28", "temp"] == 12.0
+    assert csv.loc["2025-10-28", "note"] == "edited"
+    assert csv.loc["2025-11-01", "temp"] == 5.0
+
+
+def test_lag_source_is_read_from_the_snapshot(tmp_path):
+    _, csv_path = make_store(tmp_path)
+    read_history_frame(csv_path=csv_path)  # スナップショットを作る
+
+    dates, values = model_store.read_lag_source(csv_path)
+    assert dates.tolist() == [dt.date(2025, 10, 28), dt.date(2025, 10, 29)]
+    assert values.shape == (2, len(BASE_FEATURE_COLUMNS))
+    assert values[1].tolist()[:2] == [7.75, 78.5]
+    assert np.isnan(values[:, 2:]).all()  # history.csv に無い列は NaN
+    assert not values.flags.owndata and not values.flags.writeable  # mmap の配列をそのまま使う
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Open-Meteo の応答 JSON を少しずつ読み、hourly のうち必要な時刻だけを残す。
+
+  - 応答本文はテキストのチャンク列として受け取り、全体を1つの文字列・dict にはしない
+  - hourly.time を読みながら残す時刻（target_hours）の位置を決め、各変数の配列からは
+    その位置の値だけを float64 の NumPy 配列に詰める（null は NaN）
+  - hourly.time は datetime64[m] の配列として返す。fetch_forecast_window.aggregate_hourly は
+    この形の hourly をそのまま集計できる
+  - hourly 以外の項目（latitude や hourly_units など）は小さいので、そのまま読み込む
+
+保持するのは「読みかけのチャンク」と「残した時刻の値」だけなので、何年分を取得しても
+一度に持つ Python オブジェクトの数は増えない。
+hourly の配列の要素は数値・null・時刻文字列（カンマや ] を含まない）を前提にしている。
+"""
+
+from __future__ import annotations
+
+import json
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+
+import numpy as np
+
+_WHITESPACE = re.compile(r"\s*")
+_DECODER = json.JSONDecoder()
+
+
+class ChunkReader:
+    """テキストのチャンク列を先頭から読み進める、JSON 用の小さなリーダー。"""
+
+    def __init__(self, chunks: Iterable[str]) -> None:
+        self._chunks = iter(chunks)
+        self.buffer = ""
+        self.pos = 0
+
+    def fill(self) -> bool:
+        """次のチャンクを読み足す（読み終えた部分は捨てる）。残りが無ければ False。"""
+        for chunk in self._chunks:
+            if chunk:
+                self.buffer = self.buffer[self.pos :] + chunk
+                self.pos = 0
+                return True
+        return False
+
+    def peek(self) -> str:
+        """空白を読み飛ばし、次の1文字を返す（読み進めない）。"""
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                raise ValueError("JSON の途中で応答が終わりました。")
+
+    def expect(self, char: str) -> None:
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"JSON の {char!r} の位置に {found!r} がありました。")
+        self.pos += 1
+
+    def value(self) -> object:
+        """次の値を1つ丸ごと読み込む（小さい値向け）。"""
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # チャンクの末尾で終わった数値やリテラルは、続きが次のチャンクにあるかもしれない
+            if end == len(self.buffer) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+    def keys(self) -> Iterator[str]:
+        """オブジェクトのキーを順に返す。呼び出し側は値を読んでから次のキーを受け取る。"""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            separator = self.peek()
+            self.pos += 1
+            if separator == "}":
+                return
+            if separator != ",":
+                raise ValueError(f"JSON のオブジェクトに予期しない {separator!r} がありました。")
+
+    def elements(self) -> Iterator[None]:
+        """配列の要素ごとに1回ずつ返す。呼び出し側は要素を読んでから次へ進む。"""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield None
+            separator = self.peek()
+            self.pos += 1
+            if separator == "]":
+                return
+            if separator != ",":
+                raise ValueError(f"JSON の配列に予期しない {separator!r} がありました。")
+
+    def scalar_batches(self) -> Iterator[List[str]]:
+        """スカラーだけの配列を、読み込んだチャンクごとに要素のテキストのリストで返す。"""
+        self.expect("[")
+        while True:
+            end = self.buffer.find("]", self.pos)
+            if end >= 0:
+                body = self.buffer[self.pos : end]
+                self.pos = end + 1
+                if body.strip():
+                    yield body.split(",")
+                return
+            cut = self.buffer.rfind(",", self.pos)
+            if cut >= 0:
+                yield self.buffer[self.pos : cut].split(",")
+                self.pos = cut + 1
+            if not self.fill():
+                raise ValueError("JSON の配列の途中で応答が終わりました。")
+
+
+def to_floats(texts: List[str]) -> np.ndarray:
+    return np.array([float("nan") if text.strip() == "null" else float(text) for text in texts], dtype=float)
+
+
+def read_times(reader: ChunkReader, wanted_hours: set[str]) -> tuple[np.ndarray, np.ndarray, int]:
+    """hourly.time から (残す時刻, その位置, 全要素数) を返す。"""
+    times: List[np.ndarray] = []
+    positions: List[np.ndarray] = []
+    count = 0
+    for batch in reader.scalar_batches():
+        # 要素は '"YYYY-MM-DDTHH:MM"' の形（先頭は引用符）
+        items = [item.strip() for item in batch]
+        selected = [i for i, item in enumerate(items) if item[11:12] == "T" and item[12:14] in wanted_hours]
+        if selected:
+            times.append(np.array([items[i][1:-1] for i in selected], dtype="datetime64[m]"))
+            positions.append(np.array(selected, dtype=np.int64) + count)
+        count += len(items)
+    if not times:
+        return np.empty(0, dtype="datetime64[m]"), np.empty(0, dtype=np.int64), count
+    return np.concatenate(times), np.concatenate(positions), count
+
+
+def read_values(reader: ChunkReader, positions: Optional[np.ndarray]) -> tuple[np.ndarray, int]:
+    """数値の配列から positions の要素だけを返す（positions=None なら全要素）。"""
+    parts: List[np.ndarray] = []
+    count = 0
+    for batch in reader.scalar_batches():
+        if positions is None:
+            parts.append(to_floats(batch))
+        else:
+            lo, hi = np.searchsorted(positions, [count, count + len(batch)])
+            if hi > lo:
+                parts.append(to_floats([batch[i] for i in (positions[lo:hi] - count).tolist()]))
+        count += len(batch)
+    return (np.concatenate(parts) if parts else np.empty(0, dtype=float)), count
+
+
+def read_hourly(reader: ChunkReader, target_hours: Iterable[int]) -> Dict[str, object]:
+    wanted_hours = {f"{hour:02d}" for hour in target_hours}
+    hourly: Dict[str, object] = {}
+    positions: Optional[np.ndarray] = None
+    expected: Optional[int] = None
+    # time より前に来た変数は全時刻ぶんを読み、time を読んでから絞る
+    pending: Dict[str, np.ndarray] = {}
+
+    def check_length(key: str, count: int) -> None:
+        nonlocal expected
+        if expected is None:
+            expected = count
+        elif count != expected:
+            raise ValueError(f"hourly.{key} の要素数 {count} が他の配列（{expected}）と揃っていません。")
+
+    for key in reader.keys():
+        if reader.peek() != "[":
+            hourly[key] = reader.value()
+        elif key == "time":
+            hourly[key], positions, count = read_times(reader, wanted_hours)
+            check_length(key, count)
+        else:
+            values, count = read_values(reader, positions)
+            check_length(key, count)
+            if positions is None:
+                pending[key] = values
+            else:
+                hourly[key] = values
+    for key, values in pending.items():
+        hourly[key] = values[positions] if positions is not None else values
+    return hourly
+
+
+def read_location(reader: ChunkReader, target_hours: Iterable[int]) -> object:
+    if reader.peek() != "{":
+        return reader.value()
+    location: Dict[str, object] = {}
+    for key in reader.keys():
+        if key == "hourly" and reader.peek() == "{":
+            location[key] = read_hourly(reader, target_hours)
+        else:
+            location[key] = reader.value()
+    return location
+
+
+def parse_payload(chunks: Iterable[str], target_hours: Iterable[int]) -> Union[dict, list]:
+    """Open-Meteo の応答（1地点なら dict、複数地点ならリスト）を、hourly を絞り込んで返す。
+
+    最初の値を読み終えたところで止まり、その後ろのテキストは読まない。
+    """
+    target_hours = tuple(target_hours)
+    reader = ChunkReader(chunks)
+    if reader.peek() == "[":
+        return [read_location(reader, target_hours) for _ in reader.elements()]
+    return read_location(reader, target_hours)
@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+Open-Meteo へのリクエスト結果をディスクにキャッシュする。
+
+  - キーは「エンドポイント URL + 正規化したクエリパラメータ」の SHA-256
+  - 確定済みの Archive API の応答は期限なし、予報 API の応答は TTL 付きで保存する
+    （TTL は環境変数 SKYCASTLE_FORECAST_TTL で秒数を指定、既定は 3600 秒）
+  - 合計サイズが上限（SKYCASTLE_HTTP_CACHE_MAX_MB、既定 200MB）を超えたら、
+    最後に使われた時刻（ファイルの mtime）が古いものから削除する
+  - ヒット・ミスなどの件数はプロセス内で集計し、stats で参照できる
+  - get_stream は応答本文を全体を読み込まずにパーサーへ流す（保存・読み出しとも同じエントリ形式）
+
+保存先は data/http_cache/（SKYCASTLE_HTTP_CACHE_DIR で変更可）。
+SKYCASTLE_HTTP_CACHE=0 でキャッシュを無効にできる。
+
+  python http_cache.py           # キャッシュの件数・サイズを表示
+  python http_cache.py --clear   # キャッシュを削除
+"""
+
+from __future__ import annotations
+
+import argparse
+import codecs
+import contextlib
+import hashlib
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Mapping, Optional, TypeVar
+from urllib.parse import urlencode
+
+import http_client
+
+CACHE_DIR = Path(os.environ.get("SKYCASTLE_HTTP_CACHE_DIR", "data/http_cache"))
+DEFAULT_FORECAST_TTL = 3600
+DEFAULT_MAX_MB = 200
+ENTRY_SUFFIX = ".json"
+# エントリの JSON で本文の直前に来る文字列（body は最後のキーとして保存する）
+BODY_MARKER = ',"body":'
+STREAM_CHUNK_BYTES = 64 * 1024
+
+T = TypeVar("T")
+
+
+def forecast_ttl() -> float:
+    """予報 API の応答を使い回す秒数（SKYCASTLE_FORECAST_TTL）。"""
+    try:
+        return float(os.environ.get("SKYCASTLE_FORECAST_TTL", DEFAULT_FORECAST_TTL))
+    except ValueError:
+        return float(DEFAULT_FORECAST_TTL)
+
+
+def cache_enabled() -> bool:
+    return os.environ.get("SKYCASTLE_HTTP_CACHE", "1").lower() not in ("0", "false", "off", "no")
+
+
+def normalize_params(params: Mapping[str, object]) -> str:
+    """パラメータをキー順に並べ、値を文字列に揃えたクエリ文字列にする。"""
+    items = []
+    for key in sorted(params):
+        value = params[key]
+        if isinstance(value, (list, tuple)):
+            value = ",".join(str(item) for item in value)
+        elif isinstance(value, float):
+            value = repr(value)
+        items.append((key, str(value)))
+    return urlencode(items)
+
+
+def cache_key(url: str, params: Mapping[str, object]) -> str:
+    return hashlib.sha256(f"{url}?{normalize_params(params)}".encode("utf-8")).hexdigest()
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    expired: int = 0
+    stores: int = 0
+    evictions: int = 0
+
+    def summary(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0.0
+        return (
+            f"hits={self.hits} misses={self.misses} (hit rate {rate:.0f}%) "
+            f"expired={self.expired} stored={self.stores} evicted={self.evictions}"
+        )
+
+
+class ResponseCache:
+    """1応答を1ファイル（メタ情報と JSON 本体）として保存するキャッシュ。"""
+
+    def __init__(self, directory: Path = CACHE_DIR, max_bytes: Optional[int] = None) -> None:
+        self.directory = Path(directory)
+        if max_bytes is None:
+            try:
+                max_mb = float(os.environ.get("SKYCASTLE_HTTP_CACHE_MAX_MB", DEFAULT_MAX_MB))
+            except ValueError:
+                max_mb = DEFAULT_MAX_MB
+            max_bytes = int(max_mb * 1024 * 1024)
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+        self._stats_lock = threading.Lock()
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._stats_lock:
+            setattr(self.stats, name, getattr(self.stats, name) + amount)
+
+    def path_for(self, key: str) -> Path:
+        return self.directory / f"{key}{ENTRY_SUFFIX}"
+
+    def lookup(self, url: str, params: Mapping[str, object], ttl: Optional[float] = None) -> Optional[dict]:
+        """有効期限内の応答があれば返す（期限切れ・壊れたエントリは削除してミス扱い）。
+
+        期限なしで保存したエントリは常に有効。それ以外は ttl（未指定なら保存時の TTL）を
+        保存時刻からの経過秒数と比べる。
+        """
+        path = self.path_for(cache_key(url, params))
+        try:
+            with path.open("r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self._count("misses")
+            return None
+
+        if self._expire(path, entry, ttl):
+            return None
+        self._hit(path)
+        return entry["body"]
+
+    def _expire(self, path: Path, entry: Mapping[str, object], ttl: Optional[float]) -> bool:
+        """期限切れならエントリを削除してミスを数え、True を返す。"""
+        expires_at = entry.get("expires_at")
+        if expires_at is None:
+            return False
+        max_age = ttl if ttl is not None else expires_at - entry["stored_at"]
+        if time.time() - entry["stored_at"] < max_age:
+            return False
+        with contextlib.suppress(FileNotFoundError):
+            path.unlink()
+        self._count("expired")
+        self._count("misses")
+        return True
+
+    def _hit(self, path: Path) -> None:
+        # LRU 用に最終利用時刻を更新する
+        with contextlib.suppress(OSError):
+            os.utime(path)
+        self._count("hits")
+
+    def lookup_stream(
+        self,
+        url: str,
+        params: Mapping[str, object],
+        ttl: Optional[float],
+        parse: Callable[[Iterator[str]], T],
+    ) -> Optional[T]:
+        """lookup と同じ判定で、有効な応答の本文をチャンクごとに parse へ渡した結果を返す。
+
+        エントリは body を最後に置いて保存しているので、',"body":' より前だけを
+        メタ情報として読み、本文は全体を読み込まずに parse へ流す。
+        """
+        path = self.path_for(cache_key(url, params))
+        try:
+            with path.open("r", encoding="utf-8") as f:
+                head = f.read(STREAM_CHUNK_BYTES)
+                marker = head.find(BODY_MARKER)
+                entry = json.loads(head[:marker] + "}") if marker >= 0 else None
+                if entry is not None and not self._expire(path, entry, ttl):
+                    rest = head[marker + len(BODY_MARKER) :]
+                    result = parse(itertools.chain([rest], iter(lambda: f.read(STREAM_CHUNK_BYTES), "")))
+                    self._hit(path)
+                    return result
+                if entry is None:
+                    self._count("misses")
+                return None
+        except (OSError, ValueError):
+            self._count("misses")
+            return None
+
+    def store(self, url: str, params: Mapping[str, object], body: dict, ttl: Optional[float]) -> None:
+        """応答を保存する。ttl=None は期限なし（確定済みデータ）。"""
+        now = time.time()
+        entry = {
+            "url": url,
+            "params": normalize_params(params),
+            "stored_at": now,
+            "expires_at": None if ttl is None else now + ttl,
+            "body": body,
+        }
+        path = self.path_for(cache_key(url, params))
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp_name, path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(tmp_name)
+            raise
+        self._count("stores")
+        self.evict()
+
+    def store_stream(
+        self,
+        url: str,
+        params: Mapping[str, object],
+        chunks: Iterable[bytes],
+        ttl: Optional[float],
+        parse: Callable[[Iterator[str]], T],
+    ) -> T:
+        """応答本文（バイト列のチャンク）をそのままファイルに書きながら parse に渡し、その結果を返す。
+
+        保存する形は store と同じ（body が最後）。parse が例外を送出したら何も保存しない。
+        """
+        now = time.time()
+        header = {
+            "url": url,
+            "params": normalize_params(params),
+            "stored_at": now,
+            "expires_at": None if ttl is None else now + ttl,
+        }
+        path = self.path_for(cache_key(url, params))
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=self.directory)
+        chunks = iter(chunks)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(json.dumps(header, ensure_ascii=False, separators=(",", ":"))[:-1].encode("utf-8"))
+                f.write(BODY_MARKER.encode("utf-8"))
+
+                def tee() -> Iterator[bytes]:
+                    for chunk in chunks:
+                        f.write(chunk)
+                        yield chunk
+
+                result = parse(decode_chunks(tee()))
+                # parse は本文の値を読み終えたところで止まるので、残りもそのまま書き切る
+                for chunk in chunks:
+                    f.write(chunk)
+                f.write(b"}")
+            os.replace(tmp_name, path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(tmp_name)
+            raise
+        self._count("stores")
+        self.evict()
+        return result
+
+    def entries(self) -> list[tuple[Path, os.stat_result]]:
+        if not self.directory.exists():
+            return []
+        found = []
+        for path in self.directory.glob(f"*{ENTRY_SUFFIX}"):
+            with contextlib.suppress(FileNotFoundError):
+                found.append((path, path.stat()))
+        return found
+
+    def evict(self) -> int:
+        """合計サイズが max_bytes 以下になるまで、最後に使われた時刻が古い順に削除する。"""
+        entries = self.entries()
+        total = sum(stat.st_size for _, stat in entries)
+        removed = 0
+        for path, stat in sorted(entries, key=lambda item: item[1].st_mtime):
+            if total <= self.max_bytes:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                path.unlink()
+            total -= stat.st_size
+            removed += 1
+        self._count("evictions", removed)
+        return removed
+
+    def clear(self) -> int:
+        entries = self.entries()
+        for path, _ in entries:
+            with contextlib.suppress(FileNotFoundError):
+                path.unlink()
+        return len(entries)
+
+    def disk_usage(self) -> tuple[int, int]:
+        """(エントリ数, 合計バイト数)。"""
+        entries = self.entries()
+        return len(entries), sum(stat.st_size for _, stat in entries)
+
+
+_DEFAULT_CACHE: Optional[ResponseCache] = None
+
+
+def default_cache() -> ResponseCache:
+    global _DEFAULT_CACHE
+    if _DEFAULT_CACHE is None:
+        _DEFAULT_CACHE = ResponseCache()
+    return _DEFAULT_CACHE
+
+
+def stats() -> CacheStats:
+    return default_cache().stats
+
+
+def get_json(url: str, params: Mapping[str, object], ttl: Optional[float], timeout: float = 30) -> dict:
+    """GET して JSON を返す。キャッシュにあればネットワークに出ない。
+
+    成功した応答（2xx）だけを保存し、失敗時は requests.HTTPError をそのまま送出する。
+    """
+    if not cache_enabled():
+        resp = http_client.get(url, params=params, timeout=timeout)
+        resp.raise_for_status()
+        return resp.json()
+
+    cache = default_cache()
+    cached = cache.lookup(url, params, ttl)
+    if cached is not None:
+        return cached
+    resp = http_client.get(url, params=params, timeout=timeout)
+    resp.raise_for_status()
+    body = resp.json()
+    cache.store(url, params, body, ttl)
+    return body
+
+
+def decode_chunks(chunks: Iterable[bytes]) -> Iterator[str]:
+    """UTF-8 のバイト列のチャンクを、文字の途中で切れないようにテキストのチャンクへ変換する。"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def get_stream(
+    url: str,
+    params: Mapping[str, object],
+    ttl: Optional[float],
+    parse: Callable[[Iterator[str]], T],
+    timeout: float = 30,
+) -> T:
+    """get_json と同じキャッシュを使い、応答本文を全体を読み込まずに parse へ流してその結果を返す。
+
+    キャッシュのエントリは get_json と共通で、どちらで保存したものもどちらからでも読める。
+    """
+    if cache_enabled():
+        cache = default_cache()
+        cached = cache.lookup_stream(url, params, ttl, parse)
+        if cached is not None:
+            return cached
+    resp = http_client.get(url, params=params, timeout=timeout, stream=True)
+    with contextlib.closing(resp):
+        resp.raise_for_status()
+        chunks = resp.iter_content(STREAM_CHUNK_BYTES)
+        if not cache_enabled():
+            return parse(decode_chunks(chunks))
+        return default_cache().store_stream(url, params, chunks, ttl, parse)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Open-Meteo 応答キャッシュの状態表示・削除を行います。")
+    parser.add_argument("--clear", action="store_true", help="キャッシュをすべて削除する。")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    cache = default_cache()
+    if args.clear:
+        print(f"Removed {cache.clear()} entries from {cache.directory}")
+        return
+    count, size = cache.disk_usage()
+    print(
+        json.dumps(
+            {
+                "directory": str(cache.directory),
+                "entries": count,
+                "bytes": size,
+                "max_bytes": cache.max_bytes,
+                "forecast_ttl": forecast_ttl(),
+            },
+            ensure_ascii=False,
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Open-Meteo への HTTP リクエストを行う共通クライアント。
+
+  - プロセス内で1つの requests.Session を共有し、keep-alive で接続（TLS セッション）を使い回す
+  - 429 / 5xx と接続エラー・タイムアウトは、ジッター付き指数バックオフで再試行する
+    （Retry-After ヘッダがあればその秒数を優先する）
+  - map_bounded で同時実行数を SKYCASTLE_HTTP_CONCURRENCY（既定 4）以下に抑えて並列に取得する
+  - 1リクエストごとの所要時間・試行回数を記録し、latency_summary で集計を返す
+"""
+
+from __future__ import annotations
+
+import email.utils
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Iterable, List, Mapping, Optional, TypeVar
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_TIMEOUT = 30
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+
+def env_int(name: str, default: int) -> int:
+    try:
+        return max(int(os.environ.get(name, default)), 0)
+    except ValueError:
+        return default
+
+
+def openmeteo_url(path: str, default: str) -> str:
+    """Open-Meteo のエンドポイント URL。
+
+    SKYCASTLE_OPENMETEO_URL（例: http://127.0.0.1:8765）を指定すると、forecast / archive とも
+    そのホストの path に向ける（openmeteo_stub.py などのローカルの代替サーバー用）。
+    """
+    base = os.environ.get("SKYCASTLE_OPENMETEO_URL")
+    return f"{base.rstrip('/')}{path}" if base else default
+
+
+MAX_CONCURRENCY = max(env_int("SKYCASTLE_HTTP_CONCURRENCY", 4), 1)
+MAX_RETRIES = env_int("SKYCASTLE_HTTP_RETRIES", 4)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+@dataclass
+class RequestMetric:
+    url: str
+    status: Optional[int]
+    seconds: float
+    attempts: int
+
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+_metrics: List[RequestMetric] = []
+_metrics_lock = threading.Lock()
+
+
+def session() -> requests.Session:
+    """プロセス内で共有する Session（同時実行数ぶんの接続をプールする）。"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=MAX_CONCURRENCY, pool_maxsize=MAX_CONCURRENCY)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+def retry_after_seconds(resp: requests.Response) -> Optional[float]:
+    """Retry-After ヘッダ（秒数または HTTP 日付）を秒数で返す。"""
+    value = resp.headers.get("Retry-After") if resp.headers else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0.0)
+
+
+def backoff_seconds(attempt: int) -> float:
+    """attempt 回目（0 始まり）の再試行までの待ち時間（full jitter）。"""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2**attempt)))
+
+
+def record(metric: RequestMetric) -> None:
+    with _metrics_lock:
+        _metrics.append(metric)
+
+
+def get(
+    url: str,
+    params: Optional[Mapping[str, object]] = None,
+    timeout: float = DEFAULT_TIMEOUT,
+    retries: int = MAX_RETRIES,
+    stream: bool = False,
+) -> requests.Response:
+    """GET する。再試行しても 429 / 5xx のままなら最後の応答を返す（raise_for_status は呼び出し側）。
+
+    stream=True なら本文を読まずに返す（呼び出し側が iter_content で読み、close する）。
+    """
+    started = time.perf_counter()
+    attempt = 0
+    while True:
+        try:
+            resp = session().get(url, params=params, timeout=timeout, stream=stream)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt >= retries:
+                record(RequestMetric(url, None, time.perf_counter() - started, attempt + 1))
+                raise
+            time.sleep(backoff_seconds(attempt))
+            attempt += 1
+            continue
+
+        if resp.status_code not in RETRY_STATUSES or attempt >= retries:
+            record(RequestMetric(url, resp.status_code, time.perf_counter() - started, attempt + 1))
+            return resp
+        wait = retry_after_seconds(resp)
+        resp.close()
+        time.sleep(min(wait, BACKOFF_MAX) if wait is not None else backoff_seconds(attempt))
+        attempt += 1
+
+
+def map_bounded(func: Callable[[T], R], items: Iterable[T], max_workers: int = MAX_CONCURRENCY) -> List[R]:
+    """items の各要素に func を同時実行数 max_workers 以下で適用し、入力と同じ順序で結果を返す。"""
+    items = list(items)
+    if len(items) <= 1 or max_workers <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(func, items))
+
+
+def metrics() -> List[RequestMetric]:
+    with _metrics_lock:
+        return list(_metrics)
+
+
+def latency_summary() -> str:
+    """記録したリクエストの件数・再試行回数・所要時間（p50 / p95 / 最大）。"""
+    recorded = metrics()
+    if not recorded:
+        return "requests=0"
+    seconds = sorted(metric.seconds for metric in recorded)
+
+    def percentile(q: float) -> float:
+        return seconds[min(int(q * len(seconds)), len(seconds) - 1)]
+
+    retries = sum(metric.attempts - 1 for metric in recorded)
+    return (
+        f"requests={len(recorded)} retries={retries} "
+        f"p50={percentile(0.5) * 1000:.0f}ms p95={percentile(0.95) * 1000:.0f}ms max={seconds[-1] * 1000:.0f}ms"
+    )
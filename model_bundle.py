@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+推論に必要なものを1ファイルにまとめたモデルバンドル（model/skycastle_bundle.cols）。
+
+  - 霧・城モデル（tree_model.FlatEnsemble の配列）、校正器（ロジスティック回帰の係数）、
+    特徴量の列（features.FEATURE_COLUMNS）、学習時の情報、元の pkl の sha256 を列形式ファイル
+    （columnar）に保存する
+  - 読み込みは mmap なので、複数のプロセスが同じバンドルを読んでもページキャッシュを共有する。
+    書き込みは一時ファイルから os.replace で差し替えるため、読み込み中のプロセスは古い版を読み続けられる
+  - 配列全体の sha256 をヘッダに持ち、読み込み時に照合する（壊れたバンドルは ValueError）
+  - BundleClassifier / BundleCalibrator は LGBMClassifier / LogisticRegression と同じ predict_proba を持つ
+    薄い包みで、lightgbm / scikit-learn を import せずに既存の推論コードへそのまま渡せる
+
+pandas / joblib / lightgbm は import しない。
+"""
+
+from __future__ import annotations
+
+import datetime as dt
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import columnar
+from tree_model import FlatEnsemble
+
+BUNDLE_PATH = Path("model/skycastle_bundle.cols")
+BUNDLE_VERSION = 4
+MODELS = ["fog", "castle"]
+
+
+@dataclass
+class ModelBundle:
+    fog: FlatEnsemble
+    castle: FlatEnsemble
+    # {"feature_names": [...], "coef": [...], "intercept": float}。校正器が無ければ None
+    calibrator: Optional[dict]
+    feature_columns: List[str]
+    training: dict = field(default_factory=dict)
+    sources: Dict[str, Optional[str]] = field(default_factory=dict)
+    created_at: Optional[str] = None
+
+
+def write_bundle(bundle: ModelBundle, path: Path = BUNDLE_PATH) -> None:
+    arrays: Dict[str, np.ndarray] = {}
+    models = {}
+    for name in MODELS:
+        ensemble = getattr(bundle, name)
+        arrays.update(ensemble.to_arrays(prefix=f"{name}."))
+        models[name] = {"feature_names": ensemble.feature_names, "sigmoid": ensemble.sigmoid}
+    calibrator = None
+    if bundle.calibrator is not None:
+        arrays["calibrator.coef"] = np.asarray(bundle.calibrator["coef"], dtype=np.float64)
+        calibrator = {
+            "feature_names": list(bundle.calibrator["feature_names"]),
+            "intercept": float(bundle.calibrator["intercept"]),
+        }
+    metadata = {
+        "version": BUNDLE_VERSION,
+        "created_at": bundle.created_at or dt.datetime.now(dt.timezone.utc).isoformat(),
+        "feature_columns": list(bundle.feature_columns),
+        "models": models,
+        "calibrator": calibrator,
+        "training": bundle.training,
+        "sources": bundle.sources,
+    }
+    columnar.write_arrays(path, arrays, metadata)
+
+
+def read_bundle(path: Path = BUNDLE_PATH, verify: bool = True) -> ModelBundle:
+    """バンドルを読み込む（verify でチェックサムを照合する）。形式が違う・壊れている場合は ValueError。"""
+    metadata, arrays = columnar.read_arrays(path, verify=verify)
+    if metadata.get("version") != BUNDLE_VERSION:
+        raise ValueError(f"{path} の形式（version={metadata.get('version')}）には対応していません。")
+    ensembles = {
+        name: FlatEnsemble.from_arrays(arrays, prefix=f"{name}.", **metadata["models"][name]) for name in MODELS
+    }
+    calibrator = metadata.get("calibrator")
+    if calibrator is not None:
+        calibrator = {**calibrator, "coef": [float(value) for value in arrays["calibrator.coef"]]}
+    return ModelBundle(
+        fog=ensembles["fog"],
+        castle=ensembles["castle"],
+        calibrator=calibrator,
+        feature_columns=list(metadata["feature_columns"]),
+        training=metadata.get("training", {}),
+        sources=metadata.get("sources", {}),
+        created_at=metadata.get("created_at"),
+    )
+
+
+def read_bundle_sources(path: Path = BUNDLE_PATH) -> Optional[Dict[str, Optional[str]]]:
+    """配列を読まずに、バンドルの元になった pkl の sha256 を返す（バンドルが無い・壊れていれば None）。"""
+    try:
+        metadata = columnar.read_metadata(path)
+    except (OSError, ValueError):
+        return None
+    if metadata.get("version") != BUNDLE_VERSION:
+        return None
+    return metadata.get("sources", {})
+
+
+def _matrix(features, columns: List[str]) -> np.ndarray:
+    """DataFrame なら columns の順に並べ替え、配列ならそのまま float64 の行列にする。"""
+    if hasattr(features, "columns"):
+        features = features[columns].to_numpy(dtype=np.float64)
+    return np.atleast_2d(np.asarray(features, dtype=np.float64))
+
+
+class BundleClassifier:
+    """FlatEnsemble を LGBMClassifier と同じ predict_proba（陰性・陽性の2列）で使うための包み。"""
+
+    def __init__(self, ensemble: FlatEnsemble) -> None:
+        self.ensemble = ensemble
+
+    def predict_proba(self, features) -> np.ndarray:
+        positive = self.ensemble.predict_proba(_matrix(features, self.ensemble.feature_names))
+        return np.column_stack([1.0 - positive, positive])
+
+
+class BundleCalibrator:
+    """校正器の係数を LogisticRegression と同じ predict_proba で使うための包み。"""
+
+    def __init__(self, calibrator: dict) -> None:
+        self.feature_names = list(calibrator["feature_names"])
+        self.coef = np.asarray(calibrator["coef"], dtype=np.float64)
+        self.intercept = float(calibrator["intercept"])
+
+    def predict_proba(self, features) -> np.ndarray:
+        z = self.intercept + _matrix(features, self.feature_names) @ self.coef
+        positive = 1.0 / (1.0 + np.exp(-z))
+        return np.column_stack([1.0 - positive, positive])
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+常駐して推論するプロセス（API のワーカー・ダッシュボード・スケジューラ・pipeline）が共有する、
+モデルと前日特徴量の元データの置き場。
+
+  - モデルバンドル（model/skycastle_bundle.cols）と履歴の列形式スナップショット（data/history.cols）は
+    columnar で mmap する。同じファイルを開いたプロセスどうしはページキャッシュを共有するので、
+    ワーカーを増やしてもファイルの中身の分のメモリは増えない
+  - 書き込み側（train_model.py / history_store）は一時ファイルから os.replace で差し替える。
+    ModelStore は呼ばれるたびに stat でファイルの識別情報（inode・更新時刻・サイズ）を確かめ、
+    変わっていれば読み直して参照を差し替える（プロセスの再起動は要らない）
+  - 差し替える前に渡したバンドルは、参照が残っている間は古いファイルの mmap のまま使える。
+    1回の推論の中で新旧のモデルが混ざらないよう、呼び出し側はバンドルを1回だけ取得して使う
+  - 新しい版の読み込みに失敗した（壊れている・消えた）場合は、前の版を使い続ける
+
+pandas / joblib / lightgbm は import しない。
+"""
+
+from __future__ import annotations
+
+import functools
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from history_snapshot import LAG_SOURCE_ARRAY, history_signature, read_fresh_snapshot, snapshot_path_for
+from model_bundle import BUNDLE_PATH, ModelBundle, read_bundle
+
+FileIdentity = Optional[Tuple[int, int, int, int]]
+
+
+def file_identity(path: Path) -> FileIdentity:
+    """ファイルの (デバイス, inode, 更新時刻, サイズ)。os.replace で差し替えられると変わる。無ければ None。"""
+    try:
+        stat = Path(path).stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def read_lag_source(csv_path: Path) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """履歴と同期したスナップショットの (日付, BASE_FEATURE_COLUMNS の値)。使えなければ None。
+
+    どちらもスナップショットを mmap した配列そのもので、プロセスごとのコピーは作らない。
+    """
+    snapshot = read_fresh_snapshot(csv_path, ["date"], extra=[LAG_SOURCE_ARRAY])
+    if snapshot is None:
+        return None
+    _, arrays = snapshot
+    if "date" not in arrays:
+        return None
+    dates, values = arrays["date"].astype("datetime64[D]", copy=False), arrays[LAG_SOURCE_ARRAY]
+    dates.setflags(write=False)
+    values.setflags(write=False)
+    return dates, values
+
+
+class ModelStore:
+    """ファイルごとに「最後に読んだときの識別情報と中身」を持ち、ファイルが差し替えられたら読み直す。"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[Any, Any]] = {}
+
+    def _current(self, key: str, identity: Any, load: Callable[[], Any]) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == identity:
+            return entry[1]
+        with self._lock:
+            # 待っている間に別のスレッドが読み直していればそれを使う
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == identity:
+                return entry[1]
+            try:
+                value = load()
+            except (OSError, ValueError):
+                if entry is None:
+                    raise
+                return entry[1]
+            self._entries[key] = (identity, value)
+            return value
+
+    def bundle(self, path: Path = BUNDLE_PATH) -> ModelBundle:
+        """いまのモデルバンドル。無い・壊れている場合は（前の版も無ければ）OSError / ValueError。"""
+        path = Path(path)
+        return self._current(f"bundle:{path}", file_identity(path), lambda: read_bundle(path))
+
+    def lag_source(self, csv_path: Path) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """履歴の前日特徴量の元データ（read_lag_source。返す配列は書き込み不可）。"""
+        csv_path = Path(csv_path)
+        identity = (history_signature(csv_path), file_identity(snapshot_path_for(csv_path)))
+        return self._current(f"lag:{csv_path}", identity, lambda: read_lag_source(csv_path))
+
+
+@functools.lru_cache(maxsize=None)
+def default_store() -> ModelStore:
+    """プロセスで共通の ModelStore。"""
+    return ModelStore()
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Open-Meteo（/v1/forecast, /v1/archive）のローカル代替サーバー。
+
+ネットワークに出られない環境でも取得処理を動かし、パイプライン全体の所要時間を
+再現性のある条件で測れるようにする。
+
+  - record    : 実際の Open-Meteo に中継し、応答（ステータスと JSON）を記録する
+  - replay    : 記録した応答を返す（同じパス・同じパラメータのものだけ。無ければ 404）
+  - synthetic : パラメータから決定的に作った疑似データを返す（記録が無くても動く）
+
+replay / synthetic では遅延（--latency-ms, --jitter-ms）とエラー（--error-rate で 429 / 5xx、
+--archive-lag-days で Archive API の 400）を注入できる。乱数は --seed で固定する。
+
+  python openmeteo_stub.py --mode synthetic --port 8765 --latency-ms 80 --error-rate 0.05
+  SKYCASTLE_OPENMETEO_URL=http://127.0.0.1:8765 python pipeline.py --window-days 14
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import hashlib
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+import http_cache
+import http_client
+
+RECORDINGS_DIR = Path("data/openmeteo_recordings")
+UPSTREAM_URLS = {
+    "/v1/forecast": "https://api.open-meteo.com/v1/forecast",
+    "/v1/archive": "https://archive-api.open-meteo.com/v1/archive",
+}
+HOURLY_UNITS = {
+    "time": "iso8601",
+    "temperature_2m": "°C",
+    "relativehumidity_2m": "%",
+    "windspeed_10m": "km/h",
+    "cloudcover": "%",
+    "precipitation": "mm",
+    "weathercode": "wmo code",
+}
+WEATHERCODES = [0, 1, 2, 3, 45, 48, 51, 61, 80]
+
+
+@dataclass
+class StubConfig:
+    mode: str = "synthetic"
+    recordings_dir: Path = RECORDINGS_DIR
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+    error_statuses: List[int] = field(default_factory=lambda: [429, 500, 503])
+    retry_after: Optional[float] = None
+    archive_lag_days: int = 0
+    seed: int = 0
+
+
+def recording_path(directory: Path, path: str, params: Dict[str, str]) -> Path:
+    key = hashlib.sha256(f"{path}?{http_cache.normalize_params(params)}".encode("utf-8")).hexdigest()
+    return directory / f"{key}.json"
+
+
+def synthetic_location(latitude: float, longitude: float, params: Dict[str, str]) -> dict:
+    """1地点分の疑似 hourly データ。同じ地点・日付・時刻なら常に同じ値になる。"""
+    start = dt.date.fromisoformat(params["start_date"])
+    end = dt.date.fromisoformat(params["end_date"])
+    variables = [name for name in params.get("hourly", "").split(",") if name]
+    hourly: Dict[str, list] = {"time": []}
+    for name in variables:
+        hourly[name] = []
+
+    day = start
+    while day <= end:
+        rnd = random.Random(f"{latitude:.4f},{longitude:.4f},{day.isoformat()}")
+        base_temp = 12 + 10 * rnd.random()
+        base_humidity = 60 + 35 * rnd.random()
+        rainy = rnd.random() < 0.3
+        for hour in range(24):
+            hourly["time"].append(f"{day.isoformat()}T{hour:02d}:00")
+            # 早朝に最低気温・最高湿度になる日変化
+            diurnal = -abs(hour - 14) / 14
+            values = {
+                "temperature_2m": round(base_temp + 6 * diurnal + rnd.uniform(-0.5, 0.5), 1),
+                "relativehumidity_2m": int(min(100, base_humidity - 20 * diurnal - 20 + rnd.uniform(-3, 3))),
+                "windspeed_10m": round(rnd.uniform(0, 15), 1),
+                "cloudcover": int(rnd.uniform(0, 100)),
+                "precipitation": round(rnd.uniform(0, 3), 1) if rainy else 0.0,
+                "weathercode": rnd.choice(WEATHERCODES),
+            }
+            for name in variables:
+                hourly[name].append(values.get(name, 0.0))
+        day += dt.timedelta(days=1)
+
+    return {
+        "latitude": latitude,
+        "longitude": longitude,
+        "generationtime_ms": 0.1,
+        "utc_offset_seconds": 32400,
+        "timezone": params.get("timezone", "Asia/Tokyo"),
+        "timezone_abbreviation": "JST",
+        "elevation": 200.0,
+        "hourly_units": {name: HOURLY_UNITS.get(name, "") for name in ["time", *variables]},
+        "hourly": hourly,
+    }
+
+
+def synthetic_response(params: Dict[str, str]) -> object:
+    """Open-Meteo と同じく、座標が複数ならリスト、1つなら dict を返す。"""
+    latitudes = [float(value) for value in params["latitude"].split(",")]
+    longitudes = [float(value) for value in params["longitude"].split(",")]
+    if len(latitudes) != len(longitudes):
+        raise ValueError("latitude と longitude の数が一致しません。")
+    locations = [synthetic_location(lat, lon, params) for lat, lon in zip(latitudes, longitudes)]
+    return locations if len(locations) > 1 else locations[0]
+
+
+class OpenMeteoStub:
+    def __init__(self, config: StubConfig) -> None:
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def injected_error(self, path: str, params: Dict[str, str]) -> Optional[Tuple[int, dict, Dict[str, str]]]:
+        if self.config.mode == "record":
+            return None
+        if path == "/v1/archive" and self.config.archive_lag_days and "end_date" in params:
+            cutoff = dt.date.today() - dt.timedelta(days=self.config.archive_lag_days)
+            if dt.date.fromisoformat(params["end_date"]) > cutoff:
+                return 400, {"error": True, "reason": "Parameter 'end_date' is out of allowed range"}, {}
+        with self.lock:
+            failed = self.config.error_rate > 0 and self.rng.random() < self.config.error_rate
+            status = self.rng.choice(self.config.error_statuses) if failed else None
+        if status is None:
+            return None
+        headers = {}
+        if status == 429 and self.config.retry_after is not None:
+            headers["Retry-After"] = f"{self.config.retry_after:g}"
+        return status, {"error": True, "reason": f"Injected error {status}"}, headers
+
+    def delay(self) -> None:
+        if self.config.mode == "record":
+            return
+        with self.lock:
+            jitter = self.rng.uniform(-self.config.jitter_ms, self.config.jitter_ms) if self.config.jitter_ms else 0.0
+        seconds = max(self.config.latency_ms + jitter, 0.0) / 1000
+        if seconds:
+            time.sleep(seconds)
+
+    def respond(self, path: str, params: Dict[str, str]) -> Tuple[int, object, Dict[str, str]]:
+        with self.lock:
+            self.requests += 1
+        if path not in UPSTREAM_URLS:
+            return 404, {"error": True, "reason": f"Unknown endpoint {path}"}, {}
+        self.delay()
+        error = self.injected_error(path, params)
+        if error is not None:
+            return error
+
+        if self.config.mode == "record":
+            resp = http_client.get(UPSTREAM_URLS[path], params=params)
+            body = resp.json()
+            target = recording_path(self.config.recordings_dir, path, params)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            with target.open("w", encoding="utf-8") as f:
+                json.dump({"path": path, "params": params, "status": resp.status_code, "body": body}, f)
+            return resp.status_code, body, {}
+
+        if self.config.mode == "replay":
+            target = recording_path(self.config.recordings_dir, path, params)
+            if not target.exists():
+                return 404, {"error": True, "reason": "No recording for this request"}, {}
+            with target.open("r", encoding="utf-8") as f:
+                recorded = json.load(f)
+            return recorded["status"], recorded["body"], {}
+
+        try:
+            return 200, synthetic_response(params), {}
+        except (KeyError, ValueError) as exc:
+            return 400, {"error": True, "reason": str(exc)}, {}
+
+
+def make_handler(stub: OpenMeteoStub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self) -> None:  # noqa: N802 - BaseHTTPRequestHandler の規約
+            url = urlsplit(self.path)
+            params = dict(parse_qsl(url.query, keep_blank_values=True))
+            status, body, headers = stub.respond(url.path, params)
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(payload)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format: str, *args) -> None:  # noqa: A002
+            pass
+
+    return Handler
+
+
+def start_server(config: StubConfig, host: str = "127.0.0.1", port: int = 0) -> Tuple[ThreadingHTTPServer, OpenMeteoStub]:
+    """別スレッドでサーバーを起動して返す（port=0 なら空いているポート）。"""
+    stub = OpenMeteoStub(config)
+    server = ThreadingHTTPServer((host, port), make_handler(stub))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stub
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Open-Meteo のローカル代替サーバーを起動します。")
+    parser.add_argument("--mode", choices=["record", "replay", "synthetic"], default="synthetic")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--recordings", type=Path, default=RECORDINGS_DIR, help="記録の保存先ディレクトリ。")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="応答ごとに加える遅延（ミリ秒）。")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="遅延の揺らぎ（±ミリ秒）。")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="エラーを返す割合（0〜1）。")
+    parser.add_argument(
+        "--error-statuses",
+        default="429,500,503",
+        help="注入するエラーのステータスコード（カンマ区切り）。",
+    )
+    parser.add_argument("--retry-after", type=float, help="429 に付ける Retry-After（秒）。")
+    parser.add_argument(
+        "--archive-lag-days",
+        type=int,
+        default=0,
+        help="Archive API が end_date が直近 N 日以内のリクエストに 400 を返す（予報 API へのフォールバック確認用）。",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    config = StubConfig(
+        mode=args.mode,
+        recordings_dir=args.recordings,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        error_statuses=[int(value) for value in args.error_statuses.split(",") if value],
+        retry_after=args.retry_after,
+        archive_lag_days=args.archive_lag_days,
+        seed=args.seed,
+    )
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(OpenMeteoStub(config)))
+    print(f"Open-Meteo stub ({args.mode}) listening on http://{args.host}:{server.server_address[1]}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
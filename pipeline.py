@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+SkyCastle AI インプロセス・パイプライン
+  fetch_weather / score_fog / predict_model / fetch_forecast_window / predict_forecast_window の
+  各ステージを 1 プロセス内で関数として呼び出す。
+  - ステージ間のデータはメモリ上で受け渡し、history.csv の読み込みとモデルのロードは 1 回だけ行う
+  - 予報ウィンドウを取得する場合、翌朝分（weather.csv / feed.json）も同じ1回の取得結果から作る
+  - weather.csv / feed.json / forecast_*.json の書き出しと履歴への upsert は最後にまとめて行う
+  - ステージごとの実行時間（wall time）をログと標準出力に報告する
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import datetime as dt
+import logging
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+from zoneinfo import ZoneInfo
+
+import pandas as pd
+
+import fetch_forecast_window
+import fetch_weather
+import http_cache
+import http_client
+import predict_forecast_window
+import predict_model
+import score_fog
+from history_store import (
+    HISTORY_CSV,
+    HistoryStore,
+    HistoryView,
+    build_history_record,
+    read_history,
+    upsert_history_record,
+    upsert_history_records,
+)
+
+LOG_DIR = Path("logs")
+LOG_FILE = LOG_DIR / "main.log"
+
+
+def setup_logger() -> logging.Logger:
+    LOG_DIR.mkdir(parents=True, exist_ok=True)
+    logger = logging.getLogger("skycastle.main")
+    logger.setLevel(logging.INFO)
+    if not logger.handlers:
+        handler = logging.FileHandler(LOG_FILE, encoding="utf-8")
+        formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+
+        # Forces JST timestamps in logger
+        formatter.converter = lambda *args: dt.datetime.now(ZoneInfo("Asia/Tokyo")).timetuple()
+    return logger
+
+
+@dataclass
+class StageTiming:
+    name: str
+    seconds: float
+
+
+@dataclass
+class Pipeline:
+    logger: logging.Logger
+    timings: List[StageTiming] = field(default_factory=list)
+    _history_df: Optional[pd.DataFrame] = None
+    _history_view: Optional[HistoryView] = None
+    _pending_records: List[dict] = field(default_factory=list)
+    _models: Optional[tuple] = None
+    _weather: Optional[Dict[str, float]] = None
+    _feed: Optional[dict] = None
+    _window_days: int = 0
+    _window_averages: Optional[List[fetch_forecast_window.MorningAverage]] = None
+    _window_entries: Optional[list] = None
+    _window_output: Path = fetch_forecast_window.OUTPUT_PATH
+    _predictions: Optional[List[dict]] = None
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.timings.append(StageTiming(name, elapsed))
+            self.logger.info("Stage %s finished in %.3fs", name, elapsed)
+
+    @property
+    def history(self) -> pd.DataFrame:
+        if self._history_df is None:
+            with self.stage("load_history"):
+                self._history_df = read_history()
+        return self._history_df
+
+    @property
+    def history_view(self) -> HistoryView:
+        """メモリ上の履歴（未書き込みの upsert を含む）に対する日付索引。"""
+        if self._history_view is None:
+            self._history_view = HistoryView.from_frame(self.history)
+        return self._history_view
+
+    def _set_history(self, history_df: pd.DataFrame) -> None:
+        self._history_df = history_df
+        self._history_view = None
+
+    @property
+    def models(self) -> tuple:
+        """(fog_model, castle_model, calibrator) を 1 回だけロードして使い回す。"""
+        if self._models is None:
+            with self.stage("load_models"):
+                self._models = predict_forecast_window.load_models()
+        return self._models
+
+    def window_averages(self, days: int) -> List[fetch_forecast_window.MorningAverage]:
+        """今日から days 日分の予報ウィンドウを取得・集計する（取得済みの範囲内なら再取得しない）。"""
+        if self._window_averages is None or days > self._window_days:
+            with self.stage(f"fetch_forecast_window[{days}d]"):
+                forecast_json = fetch_forecast_window.fetch_hourly_forecast(days)
+                self._window_averages = fetch_forecast_window.aggregate_mornings(forecast_json, days)
+                self._window_days = days
+        return self._window_averages[:days]
+
+    def run_daily(self, date_str: Optional[str] = None, update_history: bool = True, window_days: int = 0) -> dict:
+        """翌朝（または指定日）の取得→スコア→推論→履歴反映を行い、feed の内容を返す。
+
+        window_days を指定すると、対象日がその予報ウィンドウに含まれる場合は
+        ウィンドウの取得結果を使い回し、翌朝分だけのリクエストは送らない。
+        """
+        target_date, use_archive = fetch_weather.resolve_target_date(date_str, use_archive=bool(date_str))
+
+        weather = None
+        if window_days and not use_archive:
+            weather = fetch_weather.find_morning_row(self.window_averages(window_days), target_date)
+        if weather is None:
+            with self.stage(f"fetch_weather[{target_date.isoformat()}]"):
+                weather_json = fetch_weather.fetch_weather(target_date, use_archive)
+                weather = fetch_weather.average_morning(weather_json)
+
+        with self.stage("score_fog"):
+            scores = score_fog.score_weather(weather)
+
+        history = self.history_view
+        fog_model, castle_model, calibrator = self.models
+        with self.stage("predict_model"):
+            features = predict_model.build_feature_frame(weather, history)
+            fog_prob, castle_prob = predict_model.predict_probabilities(features, (fog_model, castle_model))
+            event_prob = predict_model.compute_event_probability(fog_prob, castle_prob, calibrator)
+            prediction = predict_model.build_feed_payload(weather["date"], fog_prob, castle_prob, event_prob)
+
+        feed = {"date": weather["date"], **scores, **prediction}
+        self._weather = weather
+        self._feed = feed
+
+        if update_history:
+            with self.stage("update_history"):
+                record = build_history_record(weather, feed)
+                history_df, action = upsert_history_record(self.history, record)
+                self._set_history(history_df)
+                self._pending_records.append(record)
+            self.logger.info("History %s for date %s", action, record["date"])
+        return feed
+
+    def run_backfill(self, dates: List[dt.date], chunk_days: int = fetch_weather.ARCHIVE_CHUNK_DAYS) -> int:
+        """複数日の実測値を区間ごとにまとめて取得し、スコア・推論・履歴反映を一括で行う。"""
+        wanted = {date.isoformat() for date in dates}
+        with self.stage(f"fetch_weather[{len(wanted)} days]"):
+            payloads = fetch_weather.fetch_weather_dates(dates, chunk_days)
+            rows = [row for payload in payloads for row in fetch_weather.average_mornings(payload)]
+            rows = [row for row in rows if row["date"] in wanted]
+        if not rows:
+            self.logger.warning("No weather rows were returned for the requested dates.")
+            return 0
+
+        with self.stage("score_fog"):
+            scores = score_fog.score_rows(rows)
+
+        history = self.history_view
+        fog_model, castle_model, calibrator = self.models
+        with self.stage("predict_model"):
+            features = predict_model.build_bulk_feature_frame(rows, history)
+            fog_probs, castle_probs = predict_model.predict_probabilities_batch(features, (fog_model, castle_model))
+            event_probs = predict_model.compute_event_probabilities(fog_probs, castle_probs, calibrator)
+
+        with self.stage("update_history"):
+            records = []
+            for row, row_scores, fog_prob, castle_prob, event_prob in zip(
+                rows, scores, fog_probs, castle_probs, event_probs
+            ):
+                prediction = predict_model.build_feed_payload(
+                    row["date"], float(fog_prob), float(castle_prob), float(event_prob)
+                )
+                records.append(build_history_record(row, {**row_scores, **prediction}))
+            history_df, updated, appended = upsert_history_records(self.history, records)
+            self._set_history(history_df)
+            self._pending_records.extend(records)
+        self.logger.info("Backfill updated %d and appended %d history records", updated, appended)
+        return len(records)
+
+    def run_window(
+        self,
+        days: int,
+        output_path: Path = fetch_forecast_window.OUTPUT_PATH,
+        ensemble_samples: int = 0,
+    ) -> List[dict]:
+        """最大16日分の予報ウィンドウを取得して推論する（ensemble_samples が 1 以上なら確率の幅も付ける）。"""
+        averages = self.window_averages(days)
+        entries = [predict_forecast_window.ForecastEntry(**avg.__dict__) for avg in averages]
+        history = self.history_view
+        models = self.models
+        with self.stage("predict_forecast_window"):
+            predictions = predict_forecast_window.run_prediction(entries, models, history, samples=ensemble_samples)
+
+        self._window_entries = averages
+        self._window_output = output_path
+        self._predictions = predictions
+        return predictions
+
+    def flush(self) -> None:
+        """メモリ上の結果をまとめてファイルへ書き出す。"""
+        with self.stage("write_outputs"):
+            if self._weather is not None:
+                fetch_weather.save_csv(self._weather)
+            if self._feed is not None:
+                feed = dict(self._feed)
+                score_fog.write_feed(feed.pop("date"), feed)
+            if self._pending_records:
+                HistoryStore(HISTORY_CSV).upsert_many(self._pending_records)
+                self._pending_records = []
+            if self._window_entries is not None:
+                payload = fetch_forecast_window.serialize_results(self._window_entries)
+                fetch_forecast_window.save_json(payload, self._window_output)
+            if self._predictions is not None:
+                predict_forecast_window.save_results(self._predictions, predict_forecast_window.OUTPUT_JSON)
+
+    def report(self) -> str:
+        total = sum(timing.seconds for timing in self.timings)
+        width = max((len(timing.name) for timing in self.timings), default=5)
+        lines = [f"{timing.name:<{width}}  {timing.seconds:8.3f}s" for timing in self.timings]
+        lines.append(f"{'total':<{width}}  {total:8.3f}s")
+        return "\n".join(lines)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="SkyCastle AI パイプラインを 1 プロセスで実行します。"
+    )
+    parser.add_argument(
+        "--date",
+        help="取得したい日付（YYYY-MM-DD）。指定しない場合は翌日を取得。",
+    )
+    parser.add_argument(
+        "--observed-date",
+        help="先に Archive API で実測値を取得して履歴へ反映する日付（YYYY-MM-DD）。",
+    )
+    parser.add_argument(
+        "--no-history",
+        action="store_true",
+        help="history.csv を更新しない（予報のみ）。",
+    )
+    parser.add_argument(
+        "--skip-daily",
+        action="store_true",
+        help="翌朝（--date）の取得・推論を行わない。",
+    )
+    parser.add_argument(
+        "--window-days",
+        type=int,
+        default=0,
+        help="予報ウィンドウの取得日数（1〜16）。0 の場合は実行しない。",
+    )
+    parser.add_argument(
+        "--ensemble-samples",
+        type=int,
+        default=0,
+        help="予報ウィンドウの各日について、予報値を揺らした標本の数（確率の幅を出力する）。0 の場合は出さない。",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    if args.window_days < 0 or args.window_days > 16:
+        raise SystemExit("--window-days は 0〜16 の範囲で指定してください。")
+    if args.ensemble_samples < 0:
+        raise SystemExit("--ensemble-samples は 0 以上で指定してください。")
+
+    logger = setup_logger()
+    pipeline = Pipeline(logger)
+    update_history = not args.no_history
+
+    if args.observed_date:
+        pipeline.run_daily(args.observed_date, update_history=update_history)
+    if not args.skip_daily:
+        # 翌朝分は予報ウィンドウと同じ1回の取得でまかなう
+        pipeline.run_daily(args.date, update_history=update_history, window_days=args.window_days)
+    if args.window_days:
+        pipeline.run_window(args.window_days, ensemble_samples=args.ensemble_samples)
+
+    pipeline.flush()
+    report = pipeline.report()
+    cache_summary = http_cache.stats().summary()
+    latency_summary = http_client.latency_summary()
+    logger.info(
+        "Pipeline completed successfully\n%s\nHTTP cache: %s\nHTTP requests: %s",
+        report,
+        cache_summary,
+        latency_summary,
+    )
+    print(report)
+    print(f"HTTP cache: {cache_summary}")
+    print(f"HTTP requests: {latency_summary}")
+
+
+if __name__ == "__main__":
+    main()
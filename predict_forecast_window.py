@@ -1,42 +1,69 @@
 #!/usr/bin/env python3
-"""forecast_window.json を読み込み、各日をモデルで推論してまとめて出力する。"""
+"""
+forecast_window.json を読み込み、各日をモデルで推論してまとめて出力する。
+
+  python predict_forecast_window.py                          # 各日の確率を1つずつ
+  python predict_forecast_window.py --ensemble --samples 1000  # 予報の揺らぎによる幅も付ける
+
+--ensemble では、各日の予報値に先の日ほど大きい揺らぎ（ENSEMBLE_NOISE の正規分布）を加えた標本を
+日ごとに --samples 個作り、全標本をまとめて推論する。fog_probability / castle_event_probability の
+ENSEMBLE_PERCENTILES のパーセンタイルを、各日の "<列名>_band"（{"p10": ..., "p50": ..., "p90": ...}）として
+出力する。history に同じ日付の行がある日（実測で上書きする日）の幅は null。
+"""
 
 from __future__ import annotations
 
+import argparse
 import datetime as dt
 import json
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterable, List, Optional
+from typing import Dict, Iterable, List, Optional, Tuple
 
-import joblib
 import numpy as np
 import pandas as pd
 from zoneinfo import ZoneInfo
 
+import features
+import predict_model
+from features import BASE_FEATURE_COLUMNS, FEATURE_COLUMNS
+from history_store import HistoryView, load_history_view
+from score_fog import round_half_even
+
 FORECAST_JSON = Path("data/forecast_window.json")
 OUTPUT_JSON = Path("data/forecast_predictions.json")
 HISTORY_CSV = Path("data/history.csv")
-FOG_MODEL_PATH = Path("model/skycastle_fog.pkl")
-CASTLE_MODEL_PATH = Path("model/skycastle_castle.pkl")
-EVENT_CALIBRATOR_PATH = Path("model/skycastle_event_calibrator.pkl")
 TZ = ZoneInfo("Asia/Tokyo")
 
-BASE_FEATURE_COLUMNS = ["temp", "humidity", "wind", "cloud", "rain"]
-LAG_FEATURE_COLUMNS = [
-    "prev_temp",
-    "prev_humidity",
-    "prev_wind",
-    "prev_cloud",
-    "prev_rain",
-    "temp_prev_diff",
-]
-FEATURE_COLUMNS = BASE_FEATURE_COLUMNS + LAG_FEATURE_COLUMNS
 CALIBRATOR_FEATURE_COLUMNS = [
     "fog_probability",
     "castle_probability",
     "fog_castle_product",
 ]
+PROBABILITY_COLUMNS = ["fog_probability", "castle_probability", "castle_event_probability"]
+# history に同じ日付の行があるとき、その値で上書きする列
+OVERRIDE_COLUMNS = BASE_FEATURE_COLUMNS + PROBABILITY_COLUMNS
+
+ENSEMBLE_SAMPLES = 1000
+ENSEMBLE_PERCENTILES = [10, 50, 90]
+# 幅を出す列
+BAND_COLUMNS = ["fog_probability", "castle_event_probability"]
+# 予報値の揺らぎ（正規分布の標準偏差）。(当日の分, 1日先になるごとに増える分)
+ENSEMBLE_NOISE = {
+    "temp": (0.8, 0.3),
+    "humidity": (4.0, 1.5),
+    "wind": (0.5, 0.2),
+    "cloud": (10.0, 4.0),
+    "rain": (0.2, 0.15),
+}
+# 揺らした値を収める範囲（None は制限なし）
+VALUE_LIMITS = {
+    "temp": (None, None),
+    "humidity": (0.0, 100.0),
+    "wind": (0.0, None),
+    "cloud": (0.0, 100.0),
+    "rain": (0.0, None),
+}
 
 
 @dataclass
@@ -77,155 +104,188 @@ def load_forecast_entries(path: Path) -> List[ForecastEntry]:
 
 
 def load_models():
-    if not FOG_MODEL_PATH.exists() or not CASTLE_MODEL_PATH.exists():
-        raise FileNotFoundError("学習済みモデルが見つかりません。train_model.py を実行してから再度お試しください。")
-    fog_model = joblib.load(FOG_MODEL_PATH)
-    castle_model = joblib.load(CASTLE_MODEL_PATH)
-    calibrator: Optional[tuple] = None
-    if EVENT_CALIBRATOR_PATH.exists():
-        payload = joblib.load(EVENT_CALIBRATOR_PATH)
-        calibrator = (payload.get("model"), payload.get("feature_names", CALIBRATOR_FEATURE_COLUMNS))
-    return fog_model, castle_model, calibrator
-
-
-def build_feature_frame(entries: Iterable[ForecastEntry]) -> pd.DataFrame:
-    df = pd.DataFrame([entry.__dict__ for entry in entries])
-    if df.empty:
+    """(霧モデル, 城モデル, 校正器) をモデルバンドルの同じ版から取り出す（呼ぶたびにその時点の最新の版になる）。"""
+    bundle = predict_model.load_bundle()
+    return (*predict_model.load_models(bundle), predict_model.load_calibrator(bundle))
+
+
+def build_feature_frame(
+    entries: Iterable[ForecastEntry],
+    history: Optional[HistoryView] = None,
+) -> pd.DataFrame:
+    """各日の特徴量（features.build_features。前日特徴量は history と予報の各日を日付順に並べた1つ前の日）。"""
+    entries = list(entries)
+    if not entries:
         raise ValueError("推論対象となる日付がありません。")
 
-    # 既存historyを参照して前日値を推測するため、最新1行を取得
-    history_tail = None
-    if HISTORY_CSV.exists():
-        history_df = pd.read_csv(HISTORY_CSV)
-        if not history_df.empty:
-            history_df["date"] = pd.to_datetime(history_df["date"], errors="coerce")
-            history_df = history_df.dropna(subset=["date"]).sort_values("date")
-            history_tail = history_df.iloc[-1]
-
-    lag_sources = []
-    prev_values = None
-    if history_tail is not None:
-        prev_values = {col: float(history_tail.get(col, np.nan)) for col in BASE_FEATURE_COLUMNS}
-
-    for _, row in df.iterrows():
-        lag_sources.append(prev_values)
-        prev_values = {col: float(row[col]) for col in BASE_FEATURE_COLUMNS}
+    if history is None:
+        history = load_history_view(HISTORY_CSV)
+    history_dates, history_values = features.frame_source(history.frame)
+    dates = [entry.date for entry in entries]
+    values = [[getattr(entry, col) for col in BASE_FEATURE_COLUMNS] for entry in entries]
+    matrix = features.build_features(dates, values, history_dates, history_values)
+    return pd.DataFrame(matrix, columns=FEATURE_COLUMNS, copy=True)
 
-    lag_df = pd.DataFrame(lag_sources, columns=BASE_FEATURE_COLUMNS)
-    lag_df = lag_df.add_prefix("prev_")
-    df = pd.concat([df, lag_df], axis=1)
-    df["temp_prev_diff"] = df["prev_temp"] - df["temp"]
-    return df[FEATURE_COLUMNS]
 
-
-def compute_event_probability(fog_prob: float, castle_prob: float, calibrator: Optional[tuple]) -> float:
+def compute_event_probabilities(fog_probs, castle_probs, calibrator: Optional[tuple]) -> np.ndarray:
+    """全日の Castle イベント確率（校正器の predict_proba は1回だけ呼ぶ）。校正器が無い・失敗したら霧×城。"""
+    fog_probs = np.asarray(fog_probs, dtype=float)
+    castle_probs = np.asarray(castle_probs, dtype=float)
+    product = fog_probs * castle_probs
     if not calibrator:
-        return fog_prob * castle_prob
+        return product
     model, feature_names = calibrator
-    features = pd.DataFrame([[fog_prob, castle_prob, fog_prob * castle_prob]], columns=CALIBRATOR_FEATURE_COLUMNS)[
-        feature_names
-    ]
+    inputs = pd.DataFrame(
+        dict(zip(CALIBRATOR_FEATURE_COLUMNS, [fog_probs, castle_probs, product])),
+        columns=CALIBRATOR_FEATURE_COLUMNS,
+    )[feature_names]
     try:
-        return float(model.predict_proba(features)[0, 1])
+        return np.asarray(model.predict_proba(inputs)[:, 1], dtype=float)
     except Exception:
-        return fog_prob * castle_prob
-
-
-def determine_event(fog_prob: float, castle_prob: float, event_prob: float) -> str:
-    if event_prob >= 0.5:
-        return "Castle"
-    if fog_prob >= 0.5:
-        return "FogOnly"
-    return "None"
-
+        return product
 
-def build_history_lookup() -> dict[str, pd.Series]:
-    if not HISTORY_CSV.exists():
-        return {}
 
-    history_df = pd.read_csv(HISTORY_CSV)
-    if history_df.empty:
-        return {}
-
-    history_df["date"] = pd.to_datetime(history_df["date"], errors="coerce")
-    history_df = history_df.dropna(subset=["date"]).sort_values("date")
-    history_df = history_df.drop_duplicates(subset=["date"], keep="last")
-    return {row["date"].date().isoformat(): row for _, row in history_df.iterrows()}
+def compute_event_probability(fog_prob: float, castle_prob: float, calibrator: Optional[tuple]) -> float:
+    return float(compute_event_probabilities([fog_prob], [castle_prob], calibrator)[0])
+
+
+def determine_events(fog_probs: np.ndarray, castle_probs: np.ndarray, event_probs: np.ndarray) -> np.ndarray:
+    """各日の event。イベント確率が 0.5 以上なら Castle、霧確率が 0.5 以上なら FogOnly、それ以外は None。"""
+    return np.select([event_probs >= 0.5, fog_probs >= 0.5], ["Castle", "FogOnly"], "None").astype(object)
+
+
+def lookup_history_columns(dates: List[str], history: HistoryView) -> Tuple[np.ndarray, Dict[str, np.ndarray], np.ndarray]:
+    """各日付に一致する history の行の (一致したか, 列名→数値（欠損・数値にできない値は NaN）, event（無ければ None）)。"""
+    positions = history.positions_for(dates)
+    matched = positions >= 0
+    rows = history.frame.iloc[positions[matched]]
+    numbers = {}
+    for col in OVERRIDE_COLUMNS:
+        values = np.full(len(dates), np.nan)
+        if col in rows.columns:
+            values[matched] = pd.to_numeric(rows[col], errors="coerce").to_numpy(dtype=float)
+        numbers[col] = values
+    events = np.full(len(dates), None, dtype=object)
+    if "event" in rows.columns:
+        events[matched] = rows["event"].to_numpy(dtype=object)
+    return matched, numbers, events
+
+
+def sample_inputs(
+    entries: List[ForecastEntry],
+    samples: int,
+    rng: np.random.Generator,
+    today: dt.date,
+) -> np.ndarray:
+    """予報値に揺らぎを加えた標本（(標本数, 日数, BASE_FEATURE_COLUMNS の列数)）。揺らぎは today から先の日ほど大きい。"""
+    values = np.array([[getattr(entry, col) for col in BASE_FEATURE_COLUMNS] for entry in entries], dtype=float)
+    lead = (features.as_days([entry.date for entry in entries]) - np.datetime64(today, "D")).astype(np.int64)
+    base, growth = (np.array([ENSEMBLE_NOISE[col][i] for col in BASE_FEATURE_COLUMNS]) for i in (0, 1))
+    sigma = base + np.maximum(lead, 0)[:, np.newaxis] * growth
+    draws = values + rng.standard_normal((samples, *values.shape)) * sigma
+    low, high = (
+        np.array([np.nan if VALUE_LIMITS[col][i] is None else VALUE_LIMITS[col][i] for col in BASE_FEATURE_COLUMNS])
+        for i in (0, 1)
+    )
+    return np.clip(draws, np.nan_to_num(low, nan=-np.inf), np.nan_to_num(high, nan=np.inf))
+
+
+def predict_bands(
+    entries: List[ForecastEntry],
+    models: tuple,
+    history: HistoryView,
+    samples: int = ENSEMBLE_SAMPLES,
+    seed: Optional[int] = None,
+    today: Optional[dt.date] = None,
+) -> Dict[str, np.ndarray]:
+    """各日の BAND_COLUMNS の確率の ENSEMBLE_PERCENTILES（列名→(パーセンタイルの数, 日数) の配列）。
+
+    全日・全標本の特徴量を1つの行列にして、霧・城モデルと校正器をそれぞれ1回ずつ呼ぶ
+    （1000 標本 × 16 日で 0.08〜0.1 秒ほど。ほとんどが FlatEnsemble の評価）。
+    """
+    fog_model, castle_model, calibrator = models
+    today = today or dt.datetime.now(TZ).date()
+    draws = sample_inputs(entries, samples, np.random.default_rng(seed), today)
+    history_dates, history_values = features.frame_source(history.frame)
+    matrix = features.build_sample_features([entry.date for entry in entries], draws, history_dates, history_values)
+    matrix = matrix.reshape(-1, len(FEATURE_COLUMNS))
+
+    fog_probs = fog_model.predict_proba(matrix)[:, 1]
+    castle_probs = castle_model.predict_proba(matrix)[:, 1]
+    probabilities = {
+        "fog_probability": fog_probs,
+        "castle_event_probability": compute_event_probabilities(fog_probs, castle_probs, calibrator),
+    }
+    return {
+        col: np.percentile(probabilities[col].reshape(samples, len(entries)), ENSEMBLE_PERCENTILES, axis=0)
+        for col in BAND_COLUMNS
+    }
 
 
-def safe_float(value, default=None):
-    if value is None:
-        return default
-    if isinstance(value, (int, float)):
-        if pd.isna(value):
-            return default
-        return float(value)
-    try:
-        converted = float(value)
-    except (TypeError, ValueError):
-        return default
-    return converted
-
-
-def run_prediction(entries: List[ForecastEntry]) -> List[dict]:
-    fog_model, castle_model, calibrator = load_models()
-    feature_frame = build_feature_frame(entries)
-    history_lookup = build_history_lookup()
-
-    fog_probs = fog_model.predict_proba(feature_frame)[:, 1]
-    castle_probs = castle_model.predict_proba(feature_frame)[:, 1]
-
-    results = []
-    for entry, fog_prob, castle_prob in zip(entries, fog_probs, castle_probs):
-        event_prob = compute_event_probability(float(fog_prob), float(castle_prob), calibrator)
-        base_payload = {
-            "date": entry.date,
-            "temp": round(entry.temp, 2),
-            "humidity": round(entry.humidity, 2),
-            "wind": round(entry.wind, 2),
-            "cloud": round(entry.cloud, 2),
-            "rain": round(entry.rain, 2),
-            "weathercode": entry.weathercode,
-            "fog_probability": round(float(fog_prob), 3),
-            "castle_probability": round(float(castle_prob), 3),
-            "castle_event_probability": round(event_prob, 3),
-            "event": determine_event(float(fog_prob), float(castle_prob), event_prob),
+def run_prediction(
+    entries: List[ForecastEntry],
+    models: Optional[tuple] = None,
+    history: Optional[HistoryView] = None,
+    samples: int = 0,
+    seed: Optional[int] = None,
+) -> List[dict]:
+    """予報期間の全日をまとめて推論する。
+
+    history に同じ日付の行があれば、その値（欠損の列は予報・推論の値のまま）と event で上書きする。
+    history の event が空なら、上書き後の確率から event を決め直す。
+    samples が 1 以上なら predict_bands の幅（"<列名>_band"）も付ける。
+    """
+    fog_model, castle_model, calibrator = models if models is not None else load_models()
+    if history is None:
+        history = load_history_view(HISTORY_CSV)
+    dates = [entry.date for entry in entries]
+    feature_frame = build_feature_frame(entries, history)
+
+    fog_probs = fog_model.predict_proba(feature_frame)[:, 1].astype(float)
+    castle_probs = castle_model.predict_proba(feature_frame)[:, 1].astype(float)
+    event_probs = compute_event_probabilities(fog_probs, castle_probs, calibrator)
+
+    # 予報・推論の値（丸めた値が、history に値が無い列の既定値になる）
+    weather = np.array([[getattr(entry, col) for col in BASE_FEATURE_COLUMNS] for entry in entries], dtype=float)
+    predicted = {col: round_half_even(weather[:, i], 2) for i, col in enumerate(BASE_FEATURE_COLUMNS)}
+    predicted.update(
+        {
+            "fog_probability": round_half_even(fog_probs, 3),
+            "castle_probability": round_half_even(castle_probs, 3),
+            "castle_event_probability": round_half_even(event_probs, 3),
         }
+    )
+    events = determine_events(fog_probs, castle_probs, event_probs)
 
-        history_row = history_lookup.get(entry.date)
-        if history_row is not None:
-            actual_temp = safe_float(history_row.get("temp"), base_payload["temp"])
-            actual_humidity = safe_float(history_row.get("humidity"), base_payload["humidity"])
-            actual_wind = safe_float(history_row.get("wind"), base_payload["wind"])
-            actual_cloud = safe_float(history_row.get("cloud"), base_payload["cloud"])
-            actual_rain = safe_float(history_row.get("rain"), base_payload["rain"])
-
-            actual_fog_prob = safe_float(history_row.get("fog_probability"), base_payload["fog_probability"])
-            actual_castle_prob = safe_float(history_row.get("castle_probability"), base_payload["castle_probability"])
-            actual_event_prob = safe_float(history_row.get("castle_event_probability"), base_payload["castle_event_probability"])
-
-            base_payload.update(
-                {
-                    "temp": round(actual_temp, 2),
-                    "humidity": round(actual_humidity, 2),
-                    "wind": round(actual_wind, 2),
-                    "cloud": round(actual_cloud, 2),
-                    "rain": round(actual_rain, 2),
-                    "fog_probability": round(actual_fog_prob, 3),
-                    "castle_probability": round(actual_castle_prob, 3),
-                    "castle_event_probability": round(actual_event_prob, 3),
-                }
+    matched, history_numbers, history_events = lookup_history_columns(dates, history)
+    actual = {
+        col: np.where(matched & ~np.isnan(history_numbers[col]), history_numbers[col], predicted[col])
+        for col in OVERRIDE_COLUMNS
+    }
+    stripped = pd.Series(history_events, dtype=object).str.strip()
+    has_event = (stripped.notna() & stripped.ne("")).to_numpy()
+    redetermined = determine_events(
+        actual["fog_probability"], actual["castle_probability"], actual["castle_event_probability"]
+    )
+    events = np.where(has_event, history_events, np.where(matched, redetermined, events))
+
+    results = pd.DataFrame({"date": dates})
+    for col in BASE_FEATURE_COLUMNS:
+        results[col] = round_half_even(actual[col], 2)
+    results["weathercode"] = pd.Series([entry.weathercode for entry in entries], dtype=object)
+    for col in PROBABILITY_COLUMNS:
+        results[col] = round_half_even(actual[col], 3)
+    results["event"] = events
+
+    if samples:
+        bands = predict_bands(entries, (fog_model, castle_model, calibrator), history, samples, seed)
+        for col in BAND_COLUMNS:
+            percentiles = pd.DataFrame(
+                round_half_even(bands[col], 3).T, columns=[f"p{p}" for p in ENSEMBLE_PERCENTILES]
             )
-
-            history_event = history_row.get("event")
-            if isinstance(history_event, str) and history_event.strip():
-                base_payload["event"] = history_event
-            else:
-                base_payload["event"] = determine_event(actual_fog_prob, actual_castle_prob, actual_event_prob)
-
-        results.append(base_payload)
-
-    return results
+            band = pd.Series(percentiles.to_dict("records"), dtype=object)
+            results[f"{col}_band"] = band.where(~matched, None)
+    return results.to_dict("records")
 
 
 def save_results(results: List[dict], output_path: Path) -> None:
@@ -239,9 +299,24 @@ def save_results(results: List[dict], output_path: Path) -> None:
     print(f"Saved predictions ({len(results)} days) to {output_path} (generated_at={payload['generated_at']})")
 
 
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="予報ウィンドウの各日を推論します。")
+    parser.add_argument(
+        "--ensemble",
+        action="store_true",
+        help="予報値を揺らした標本をまとめて推論し、確率の幅（パーセンタイル）も出力する。",
+    )
+    parser.add_argument("--samples", type=int, default=ENSEMBLE_SAMPLES, help="--ensemble で1日あたりに作る標本の数。")
+    parser.add_argument("--seed", type=int, help="--ensemble の乱数の種（指定すると毎回同じ幅になる）。")
+    return parser.parse_args()
+
+
 def main() -> None:
+    args = parse_args()
+    if args.ensemble and args.samples < 1:
+        raise SystemExit("--samples は 1 以上で指定してください。")
     entries = load_forecast_entries(FORECAST_JSON)
-    results = run_prediction(entries)
+    results = run_prediction(entries, samples=args.samples if args.ensemble else 0, seed=args.seed)
     save_results(results, OUTPUT_JSON)
 
 
@@ -2,16 +2,41 @@
 """
 weather.csv と学習済みモデルを使って霧発生確率・天空の城成立確率を推論し、
 feed.json に fog_probability / castle_probability / event を追記する。
+
+推論には学習済みの pkl ではなく、pkl から書き出したモデルバンドル（model_bundle、
+model/skycastle_bundle.cols）を使う。LightGBM のモデルは tree_model の FlatEnsemble（全木の分岐を
+並べた配列）として NumPy だけで評価し、校正器もロジスティック回帰の係数から直接計算する。
+バンドルには元の pkl の sha256 を記録しており、pkl が更新されていれば作り直す（このときだけ
+joblib / lightgbm を import する）。バンドルと履歴のスナップショットは model_store を通して読むので、
+常駐プロセスでは train_model.py がバンドルを書き出し直すと、再起動しなくても次の推論から新しいモデルになる。
+
+スクリプトとして実行した場合は高速経路を使い、pandas / joblib / lightgbm は import しない
+（履歴が書き込まれた後の最初の1回だけ、スナップショットを作り直すために pandas を import する）。
 """
 
 from __future__ import annotations
 
+import csv
+import functools
+import hashlib
 import json
+import math
 from pathlib import Path
-from typing import Dict, Optional
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import features
+from history_snapshot import history_signature
+from features import BASE_FEATURE_COLUMNS, FEATURE_COLUMNS
+from model_bundle import BundleCalibrator, BundleClassifier, ModelBundle, read_bundle_sources, write_bundle
+from model_store import default_store
+from tree_model import FlatEnsemble, parse_model_text
+
+if TYPE_CHECKING:
+    import pandas as pd
 
-import joblib
-import pandas as pd
+    from history_store import HistoryView
 
 WEATHER_CSV = Path("data/weather.csv")
 FEED_JSON = Path("data/feed.json")
@@ -19,16 +44,8 @@ HISTORY_CSV = Path("data/history.csv")
 FOG_MODEL_PATH = Path("model/skycastle_fog.pkl")
 CASTLE_MODEL_PATH = Path("model/skycastle_castle.pkl")
 EVENT_CALIBRATOR_PATH = Path("model/skycastle_event_calibrator.pkl")
-BASE_FEATURE_COLUMNS = ["temp", "humidity", "wind", "cloud", "rain"]
-LAG_FEATURE_COLUMNS = [
-    "prev_temp",
-    "prev_humidity",
-    "prev_wind",
-    "prev_cloud",
-    "prev_rain",
-    "temp_prev_diff",
-]
-FEATURE_COLUMNS = BASE_FEATURE_COLUMNS + LAG_FEATURE_COLUMNS
+BUNDLE_PATH = Path("model/skycastle_bundle.cols")
+TRAINING_STATE_PATH = Path("model/skycastle_training.json")
 CALIBRATOR_FEATURE_COLUMNS = [
     "fog_probability",
     "castle_probability",
@@ -36,112 +53,268 @@ CALIBRATOR_FEATURE_COLUMNS = [
 ]
 
 
+def to_float(value) -> float:
+    try:
+        return float(value) if str(value).strip() != "" else float("nan")
+    except (TypeError, ValueError):
+        return float("nan")
+
+
 def load_weather() -> Dict[str, float]:
     if not WEATHER_CSV.exists():
         raise FileNotFoundError(f"{WEATHER_CSV} が見つかりません。fetch_weather.py を先に実行してください。")
-    df = pd.read_csv(WEATHER_CSV)
-    if df.empty:
+    with WEATHER_CSV.open("r", encoding="utf-8", newline="") as f:
+        rows = list(csv.DictReader(f))
+    if not rows:
         raise ValueError(f"{WEATHER_CSV} にデータがありません。")
-    row = df.iloc[-1]
-    return {col: row[col] for col in ["date", *BASE_FEATURE_COLUMNS]}
+    row = rows[-1]
+    return {"date": row["date"], **{col: to_float(row.get(col)) for col in BASE_FEATURE_COLUMNS}}
 
 
-def load_previous_features(current_date: str):
-    if not HISTORY_CSV.exists():
-        return None
+def load_lag_source(csv_path: Path = HISTORY_CSV) -> Tuple[np.ndarray, np.ndarray]:
+    """履歴の (日付, BASE_FEATURE_COLUMNS の値) を読む。
 
-    history_df = pd.read_csv(HISTORY_CSV)
-    if history_df.empty:
-        return None
+    履歴と同期した列形式スナップショットがあれば model_store が mmap したものを使う（pandas を使わない）。
+    履歴が書き込まれてスナップショットが古い場合だけ、history_store で履歴ストアから作り直して読む。
+    """
+    source = default_store().lag_source(csv_path)
+    if source is not None:
+        return source
 
-    history_df = history_df.dropna(subset=BASE_FEATURE_COLUMNS, how="all")
-    history_df["date"] = pd.to_datetime(history_df["date"], errors="coerce")
-    history_df = history_df.dropna(subset=["date"]).sort_values("date")
+    if history_signature(csv_path) is None:
+        return np.empty(0, dtype="datetime64[D]"), np.empty((0, len(BASE_FEATURE_COLUMNS)))
+    from history_store import read_history_frame
 
-    target_dt = pd.to_datetime(current_date)
-    prev_rows = history_df[history_df["date"] < target_dt]
-    if prev_rows.empty:
-        return None
+    frame = read_history_frame(["date", *BASE_FEATURE_COLUMNS], csv_path=csv_path)
+    dates = frame["date"].to_numpy(dtype="datetime64[D]")
+    missing = np.full(len(frame), np.nan)
+    values = np.column_stack(
+        [frame[col].to_numpy(dtype=float) if col in frame.columns else missing for col in BASE_FEATURE_COLUMNS]
+    ).reshape(len(frame), len(BASE_FEATURE_COLUMNS))
+    return dates, values
 
-    prev = prev_rows.iloc[-1]
 
-    try:
-        return {
-            "prev_temp": float(prev["temp"]),
-            "prev_humidity": float(prev["humidity"]),
-            "prev_wind": float(prev["wind"]),
-            "prev_cloud": float(prev["cloud"]),
-            "prev_rain": float(prev["rain"]),
-        }
-    except (TypeError, ValueError):
-        return None
+def build_feature_vector(weather: Dict[str, float], csv_path: Path = HISTORY_CSV) -> np.ndarray:
+    """build_feature_frame と同じ特徴量を FEATURE_COLUMNS の順の1次元配列で返す（pandas を使わない）。"""
+    dates, values = load_lag_source(csv_path)
+    base = [[to_float(weather[col]) for col in BASE_FEATURE_COLUMNS]]
+    return features.build_features([weather["date"]], base, dates, values)[0]
 
 
-def build_feature_frame(weather: Dict[str, float]) -> pd.DataFrame:
-    features = {col: float(weather[col]) for col in BASE_FEATURE_COLUMNS}
-    lag_features = load_previous_features(str(weather["date"]))
-    if lag_features is None:
-        features.update(
-            {
-                "prev_temp": float("nan"),
-                "prev_humidity": float("nan"),
-                "prev_wind": float("nan"),
-                "prev_cloud": float("nan"),
-                "prev_rain": float("nan"),
-            }
-        )
-        features["temp_prev_diff"] = float("nan")
-    else:
-        features.update(lag_features)
-        features["temp_prev_diff"] = features["prev_temp"] - features["temp"]
-    return pd.DataFrame([[features[col] for col in FEATURE_COLUMNS]], columns=FEATURE_COLUMNS)
-
-
-def load_models():
-    if not FOG_MODEL_PATH.exists() or not CASTLE_MODEL_PATH.exists():
-        raise FileNotFoundError("学習済みモデルが見つかりません。train_model.py を先に実行してください。")
-    fog_model = joblib.load(FOG_MODEL_PATH)
-    castle_model = joblib.load(CASTLE_MODEL_PATH)
-    return fog_model, castle_model
+def build_feature_frame(weather: Dict[str, float], history: Optional[HistoryView] = None) -> pd.DataFrame:
+    return build_bulk_feature_frame([weather], history)
+
+
+def build_bulk_feature_frame(
+    weather_rows: List[Dict[str, float]],
+    history: Optional[HistoryView] = None,
+) -> pd.DataFrame:
+    """複数日の気象データをまとめて特徴量化する（features.build_features。返す行の順序は weather_rows と同じ）。"""
+    import pandas as pd
+
+    from history_store import load_history_view
+
+    if history is None:
+        history = load_history_view(HISTORY_CSV)
+    history_dates, history_values = features.frame_source(history.frame)
+    dates = [row["date"] for row in weather_rows]
+    values = [[to_float(row[col]) for col in BASE_FEATURE_COLUMNS] for row in weather_rows]
+    matrix = features.build_features(dates, values, history_dates, history_values)
+    return pd.DataFrame(matrix, columns=FEATURE_COLUMNS, copy=True)
+
+
+def load_models(bundle: Optional[ModelBundle] = None):
+    """(霧モデル, 城モデル)。LGBMClassifier と同じ predict_proba を持つ、バンドルの包み。"""
+    bundle = bundle or load_bundle()
+    return BundleClassifier(bundle.fog), BundleClassifier(bundle.castle)
 
 
 def build_calibrator_features(fog_prob: float, castle_prob: float) -> pd.DataFrame:
+    import pandas as pd
+
     return pd.DataFrame(
         [[fog_prob, castle_prob, fog_prob * castle_prob]],
         columns=CALIBRATOR_FEATURE_COLUMNS,
     )
 
 
-def load_calibrator():
-    if not EVENT_CALIBRATOR_PATH.exists():
+def load_calibrator(bundle: Optional[ModelBundle] = None):
+    """(校正器, 特徴量名)。校正器が無ければ None。"""
+    calibrator = (bundle or load_bundle()).calibrator
+    if calibrator is None:
         return None
-    payload = joblib.load(EVENT_CALIBRATOR_PATH)
-    model = payload.get("model")
-    feature_names = payload.get("feature_names", CALIBRATOR_FEATURE_COLUMNS)
-    return model, feature_names
+    return BundleCalibrator(calibrator), calibrator["feature_names"]
 
 
-def compute_event_probability(fog_prob: float, castle_prob: float) -> float:
-    calibrator = load_calibrator()
+def compute_event_probability(fog_prob: float, castle_prob: float, calibrator: Optional[tuple] = None) -> float:
+    if calibrator is None:
+        calibrator = load_calibrator()
     if calibrator is None:
         return fog_prob * castle_prob
 
     model, feature_names = calibrator
-    features = build_calibrator_features(fog_prob, castle_prob)[feature_names]
+    calibrator_inputs = build_calibrator_features(fog_prob, castle_prob)[feature_names]
     try:
-        return float(model.predict_proba(features)[0, 1])
+        return float(model.predict_proba(calibrator_inputs)[0, 1])
     except Exception:
         # 予期しない失敗時はフォールバックで積に戻す
         return fog_prob * castle_prob
 
 
-def predict_probabilities(features: pd.DataFrame):
-    fog_model, castle_model = load_models()
-    fog_prob = float(fog_model.predict_proba(features)[0, 1])
-    castle_prob = float(castle_model.predict_proba(features)[0, 1])
+def compute_event_probabilities(
+    fog_probs: np.ndarray,
+    castle_probs: np.ndarray,
+    calibrator: Optional[tuple] = None,
+) -> np.ndarray:
+    """compute_event_probability の配列版。複数日の総合出現率を1回の推論で求める。"""
+    fog_probs = np.asarray(fog_probs, dtype=float)
+    castle_probs = np.asarray(castle_probs, dtype=float)
+    if calibrator is None:
+        calibrator = load_calibrator()
+    if calibrator is None:
+        return fog_probs * castle_probs
+
+    import pandas as pd
+
+    model, feature_names = calibrator
+    calibrator_inputs = pd.DataFrame(
+        {
+            "fog_probability": fog_probs,
+            "castle_probability": castle_probs,
+            "fog_castle_product": fog_probs * castle_probs,
+        }
+    )[feature_names]
+    try:
+        return model.predict_proba(calibrator_inputs)[:, 1]
+    except Exception:
+        return fog_probs * castle_probs
+
+
+def predict_probabilities_batch(feature_frame: pd.DataFrame, models: Optional[tuple] = None):
+    fog_model, castle_model = models if models is not None else load_models()
+    fog_probs = fog_model.predict_proba(feature_frame)[:, 1]
+    castle_probs = castle_model.predict_proba(feature_frame)[:, 1]
+    return fog_probs, castle_probs
+
+
+def predict_probabilities(feature_frame: pd.DataFrame, models: Optional[tuple] = None):
+    fog_model, castle_model = models if models is not None else load_models()
+    fog_prob = float(fog_model.predict_proba(feature_frame)[0, 1])
+    castle_prob = float(castle_model.predict_proba(feature_frame)[0, 1])
     return fog_prob, castle_prob
 
 
+def file_sha256(path: Path) -> Optional[str]:
+    if not path.exists():
+        return None
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def artifact_hashes() -> Dict[str, Optional[str]]:
+    return {
+        str(path): file_sha256(path)
+        for path in (FOG_MODEL_PATH, CASTLE_MODEL_PATH, EVENT_CALIBRATOR_PATH)
+    }
+
+
+def load_training_summary() -> dict:
+    """train_model.py が記録した学習の情報（行ごとの記録は除く）。"""
+    if not TRAINING_STATE_PATH.exists():
+        return {}
+    with TRAINING_STATE_PATH.open("r", encoding="utf-8") as f:
+        state = json.load(f)
+    return {key: value for key, value in state.items() if key != "rows"}
+
+
+def export_inference_artifacts() -> ModelBundle:
+    """pkl からモデルバンドルを書き出す（joblib / lightgbm が必要）。"""
+    import joblib
+
+    if not FOG_MODEL_PATH.exists() or not CASTLE_MODEL_PATH.exists():
+        raise FileNotFoundError("学習済みモデルが見つかりません。train_model.py を先に実行してください。")
+    texts = [joblib.load(path).booster_.model_to_string() for path in (FOG_MODEL_PATH, CASTLE_MODEL_PATH)]
+    ensembles = [parse_model_text(text).flatten() for text in texts]
+
+    calibrator = None
+    if EVENT_CALIBRATOR_PATH.exists():
+        payload = joblib.load(EVENT_CALIBRATOR_PATH)
+        model = payload.get("model")
+        calibrator = {
+            "feature_names": list(payload.get("feature_names", CALIBRATOR_FEATURE_COLUMNS)),
+            "coef": [float(value) for value in np.ravel(model.coef_)],
+            "intercept": float(np.ravel(model.intercept_)[0]),
+        }
+
+    bundle = ModelBundle(
+        fog=ensembles[0],
+        castle=ensembles[1],
+        calibrator=calibrator,
+        feature_columns=FEATURE_COLUMNS,
+        training=load_training_summary(),
+        sources=artifact_hashes(),
+    )
+    write_bundle(bundle, BUNDLE_PATH)
+    return bundle
+
+
+def bundle_is_stale() -> bool:
+    """バンドルが無いか、記録された sha256 が今ある pkl と違えば True（pkl が無い環境ではバンドルをそのまま使う）。"""
+    sources = read_bundle_sources(BUNDLE_PATH)
+    if sources is None:
+        return True
+    current = artifact_hashes()
+    return any(digest is not None and sources.get(path) != digest for path, digest in current.items())
+
+
+@functools.lru_cache(maxsize=None)
+def refresh_stale_bundle() -> None:
+    """プロセスで最初にバンドルを読む前に1回だけ、pkl が更新されていればバンドルを作り直す。"""
+    if bundle_is_stale():
+        export_inference_artifacts()
+
+
+def load_bundle() -> ModelBundle:
+    """いまのモデルバンドル（model_store が mmap して共有し、train_model.py が書き出し直せば次から新しい版になる）。"""
+    refresh_stale_bundle()
+    bundle = default_store().bundle(BUNDLE_PATH)
+    if bundle.feature_columns != FEATURE_COLUMNS:
+        raise ValueError(f"{BUNDLE_PATH} の特徴量の列が現在のコードと違います。train_model.py を実行し直してください。")
+    return bundle
+
+
+def load_fast_models() -> Tuple[FlatEnsemble, FlatEnsemble, Optional[dict]]:
+    """高速経路用の (霧モデル, 城モデル, 校正器の係数)。"""
+    bundle = load_bundle()
+    return bundle.fog, bundle.castle, bundle.calibrator
+
+
+def predict_probabilities_fast(feature_vector: np.ndarray, models: Optional[tuple] = None):
+    """FEATURE_COLUMNS の順の1次元配列から (霧確率, 城確率) を求める。"""
+    fog_probs, castle_probs = predict_probabilities_fast_batch(np.atleast_2d(feature_vector), models)
+    return float(fog_probs[0]), float(castle_probs[0])
+
+
+def predict_probabilities_fast_batch(feature_matrix: np.ndarray, models: Optional[tuple] = None):
+    """FEATURE_COLUMNS の順の行列から (霧確率の配列, 城確率の配列) を求める（lightgbm を使わない）。"""
+    fog_model, castle_model = (models if models is not None else load_fast_models())[:2]
+    return fog_model.predict_proba(feature_matrix), castle_model.predict_proba(feature_matrix)
+
+
+def compute_event_probability_fast(fog_prob: float, castle_prob: float, calibrator: Optional[dict]) -> float:
+    """compute_event_probability と同じ値を、校正器（ロジスティック回帰）の係数から直接求める。"""
+    if calibrator is None:
+        return fog_prob * castle_prob
+    inputs = {
+        "fog_probability": fog_prob,
+        "castle_probability": castle_prob,
+        "fog_castle_product": fog_prob * castle_prob,
+    }
+    z = calibrator["intercept"] + sum(
+        coef * inputs[name] for coef, name in zip(calibrator["coef"], calibrator["feature_names"])
+    )
+    return 1.0 / (1.0 + math.exp(-z))
+
+
 def determine_event(fog_prob: float, castle_prob: float, event_prob: Optional[float] = None) -> str:
     if event_prob is not None:
         if event_prob >= 0.5:
@@ -157,14 +330,18 @@ def determine_event(fog_prob: float, castle_prob: float, event_prob: Optional[fl
     return "None"
 
 
-def update_feed(date: str, fog_prob: float, castle_prob: float, event_prob: float) -> None:
-    payload = {
+def build_feed_payload(date: str, fog_prob: float, castle_prob: float, event_prob: float) -> dict:
+    return {
         "date": date,
         "fog_probability": round(fog_prob, 3),
         "castle_probability": round(castle_prob, 3),
         "castle_event_probability": round(event_prob, 3),
         "event": determine_event(fog_prob, castle_prob, event_prob),
     }
+
+
+def update_feed(date: str, fog_prob: float, castle_prob: float, event_prob: float) -> None:
+    payload = build_feed_payload(date, fog_prob, castle_prob, event_prob)
     if FEED_JSON.exists():
         with FEED_JSON.open("r", encoding="utf-8") as f:
             existing = json.load(f)
@@ -178,10 +355,11 @@ def update_feed(date: str, fog_prob: float, castle_prob: float, event_prob: floa
 
 def main() -> None:
     weather = load_weather()
-    features = build_feature_frame(weather)
+    feature_vector = build_feature_vector(weather)
 
-    fog_prob, castle_prob = predict_probabilities(features)
-    event_prob = compute_event_probability(fog_prob, castle_prob)
+    fog_model, castle_model, calibrator = load_fast_models()
+    fog_prob, castle_prob = predict_probabilities_fast(feature_vector, (fog_model, castle_model))
+    event_prob = compute_event_probability_fast(fog_prob, castle_prob, calibrator)
     update_feed(weather["date"], fog_prob, castle_prob, event_prob)
 
 
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+history.csv の castle_event_probability を付け直すときに使う、予測結果のキャッシュ（data/prediction_cache.cols）。
+
+  - キーは (モデルの指紋, 特徴量行のハッシュ)。モデルの指紋は霧・城モデルと校正器の pkl の sha256 から作り、
+    指紋が変わったらキャッシュ全体を捨てる
+  - 特徴量行のハッシュは features.build_features が返す float32 の行を 64bit の FNV-1a でまとめたもの
+    （列ごとに全行をまとめて計算する）
+  - 前回と同じ特徴量の行は保存済みの確率を使い、新しい・変わった行だけを推論する
+  - 保存するのは今回渡された行の分だけ（消えた行や、変わる前の特徴量の結果は残さない）
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+from pathlib import Path
+from typing import Callable, Iterable, Tuple
+
+import numpy as np
+
+import columnar
+from predict_model import file_sha256
+
+CACHE_PATH = Path("data/prediction_cache.cols")
+# キャッシュする確率の列（この順で (行数, 3) の配列に入れる）
+PROBABILITY_COLUMNS = ["fog_probability", "castle_probability", "castle_event_probability"]
+FNV_OFFSET = np.uint64(0xCBF29CE484222325)
+FNV_PRIME = np.uint64(0x100000001B3)
+
+
+def row_hashes(matrix: np.ndarray) -> np.ndarray:
+    """特徴量の各行のハッシュ（uint64）。値のビット列が同じ行は同じハッシュになる。"""
+    words = np.ascontiguousarray(matrix, dtype=np.float32).view(np.uint32)
+    hashes = np.full(len(words), FNV_OFFSET, dtype=np.uint64)
+    for column in words.T:
+        hashes ^= column.astype(np.uint64)
+        hashes *= FNV_PRIME
+    return hashes
+
+
+def model_fingerprint(paths: Iterable[Path]) -> str:
+    """モデル・校正器のファイルの中身から作る指紋（どれかが変わると別の値になる）。"""
+    hashes = {str(path): file_sha256(Path(path)) for path in paths}
+    return hashlib.sha256(json.dumps(hashes, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def load_cache(fingerprint: str, path: Path = CACHE_PATH) -> Tuple[np.ndarray, np.ndarray]:
+    """指紋が一致するキャッシュの (ハッシュ（昇順）, 確率)。無い・指紋が違う・壊れている場合は空。"""
+    empty = np.empty(0, dtype=np.uint64), np.empty((0, len(PROBABILITY_COLUMNS)))
+    if not path.exists():
+        return empty
+    try:
+        metadata, arrays = columnar.read_arrays(path)
+    except (OSError, ValueError):
+        return empty
+    if metadata.get("fingerprint") != fingerprint or metadata.get("columns") != PROBABILITY_COLUMNS:
+        return empty
+    return arrays["row_hash"], arrays["probabilities"]
+
+
+def save_cache(fingerprint: str, hashes: np.ndarray, probabilities: np.ndarray, path: Path = CACHE_PATH) -> None:
+    hashes, first = np.unique(hashes, return_index=True)
+    metadata = {"fingerprint": fingerprint, "columns": PROBABILITY_COLUMNS}
+    columnar.write_arrays(path, {"row_hash": hashes, "probabilities": probabilities[first]}, metadata)
+
+
+def predict_cached(
+    matrix: np.ndarray,
+    predict: Callable[[np.ndarray], np.ndarray],
+    fingerprint: str,
+    path: Path = CACHE_PATH,
+) -> Tuple[np.ndarray, int]:
+    """matrix の各行の確率（PROBABILITY_COLUMNS の順）と、実際に推論した行数を返す。
+
+    predict はキャッシュに無い行だけの特徴量を受け取り、(行数, 3) の確率を返す関数。
+    キャッシュは matrix の行の分だけで書き直すので、matrix には使い回したい全行を渡す。
+    """
+    hashes = row_hashes(matrix)
+    cached_hashes, cached_probs = load_cache(fingerprint, path)
+    probabilities = np.empty((len(matrix), len(PROBABILITY_COLUMNS)))
+
+    hit = np.zeros(len(matrix), dtype=bool)
+    if len(cached_hashes):
+        idx = np.minimum(np.searchsorted(cached_hashes, hashes), len(cached_hashes) - 1)
+        hit = cached_hashes[idx] == hashes
+        probabilities[hit] = cached_probs[idx[hit]]
+    if not hit.all():
+        probabilities[~hit] = predict(np.asarray(matrix)[~hit])
+
+    # 全行がキャッシュにあり、キャッシュに余分な行も無ければ書き直さない
+    if not (hit.all() and len(cached_hashes) == len(np.unique(hashes))):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        save_cache(fingerprint, hashes, probabilities, path)
+    return probabilities, int((~hit).sum())
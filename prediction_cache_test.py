@@ -0,0 +1,76 @@
+import numpy as np
+
+import prediction_cache
+
+
+class CountingModel:
+    """渡された行数を記録し、行の合計から決まる確率を返す。"""
+
+    def __init__(self) -> None:
+        self.calls = []
+
+    def __call__(self, matrix: np.ndarray) -> np.ndarray:
+        self.calls.append(len(matrix))
+        total = np.asarray(matrix, dtype=float).sum(axis=1)
+        return np.column_stack([total, total * 2, total * 3])
+
+
+def make_matrix(rows: int = 50) -> np.ndarray:
+    matrix = np.random.default_rng(0).normal(size=(rows, 11)).astype(np.float32)
+    matrix[::5, 3] = np.nan
+    return matrix
+
+
+def test_cache_hits_and_misses(tmp_path):
+    path = tmp_path / "cache.cols"
+    model = CountingModel()
+    matrix = make_matrix()
+
+    first, predicted = prediction_cache.predict_cached(matrix, model, "v1", path)
+    assert predicted == len(matrix)
+    np.testing.assert_array_equal(first, model(matrix))
+    model.calls.clear()
+
+    second, predicted = prediction_cache.predict_cached(matrix, model, "v1", path)
+    assert predicted == 0
+    assert model.calls == []
+    np.testing.assert_array_equal(second, first)
+
+    changed = matrix.copy()
+    changed[7, 0] += 1.0
+    changed = np.vstack([changed, make_matrix(3) + 10])
+    third, predicted = prediction_cache.predict_cached(changed, model, "v1", path)
+    assert predicted == 4
+    assert model.calls == [4]
+    np.testing.assert_array_equal(third, model(changed))
+
+
+def test_fingerprint_change_invalidates(tmp_path):
+    path = tmp_path / "cache.cols"
+    model = CountingModel()
+    matrix = make_matrix()
+    prediction_cache.predict_cached(matrix, model, "v1", path)
+
+    _, predicted = prediction_cache.predict_cached(matrix, model, "v2", path)
+    assert predicted == len(matrix)
+    hashes, _ = prediction_cache.load_cache("v1", path)
+    assert len(hashes) == 0  # 古い指紋の結果は残らない
+    hashes, _ = prediction_cache.load_cache("v2", path)
+    assert len(hashes) == len(matrix)
+
+
+def test_model_fingerprint_follows_file_contents(tmp_path):
+    model_path = tmp_path / "model.pkl"
+    model_path.write_bytes(b"first")
+    before = prediction_cache.model_fingerprint([model_path])
+    assert prediction_cache.model_fingerprint([model_path]) == before
+    model_path.write_bytes(b"second")
+    assert prediction_cache.model_fingerprint([model_path]) != before
+
+
+def test_row_hashes_depend_on_values_only():
+    matrix = make_matrix()
+    hashes = prediction_cache.row_hashes(matrix)
+    assert len(np.unique(hashes)) == len(matrix)
+    np.testing.assert_array_equal(prediction_cache.row_hashes(matrix.astype(np.float64)), hashes)
+    np.testing.assert_array_equal(prediction_cache.row_hashes(matrix[::-1]), hashes[::-1])
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+ある朝の気象データを基準に、temp / humidity / wind / cloud / rain をずらした組み合わせ（シナリオ）を
+格子状に作り、スコア・霧／城モデル・校正器でまとめて評価する。
+
+  python scenario_grid.py --wind=-3:3:0.25 --humidity=-10:10:1 --temp=-2:2:0.5
+  python scenario_grid.py --date 2025-11-02 --cloud=-40:40:5 --heatmap cloud wind
+
+  - ずらし幅は「開始:終了:刻み」（終了を含む）または単一の値で、基準値からの差で指定する。
+    負の値から始まる範囲は argparse がオプションと見なすので、--wind=-3:3:0.25 のように = でつなぐ
+  - 格子は CHUNK_ROWS 点ずつ score_fog.score_weather_batch と predict_model の配列版の推論に通す
+  - 結果は格子の形の配列（float32 / event は int8）として .npz に保存し、
+    基準の判定が変わる最小のずらし幅（変数ごと・全体）を表示する
+
+humidity は (0, 100]、cloud は 0〜100、wind / rain は 0 以上に収まるよう切り詰める。
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import predict_model
+import score_fog
+from history_store import HISTORY_CSV, load_history_view
+
+OUTPUT_PATH = Path("data/scenario_grid.npz")
+AXES = ["temp", "humidity", "wind", "cloud", "rain"]
+# 各変数の取りうる範囲（ずらした結果をこの範囲に切り詰める）
+LIMITS = {
+    "temp": (-np.inf, np.inf),
+    "humidity": (0.1, 100.0),
+    "wind": (0.0, np.inf),
+    "cloud": (0.0, 100.0),
+    "rain": (0.0, np.inf),
+}
+EVENT_LABELS = ["None", "FogOnly", "Castle"]
+RESULT_COLUMNS = [
+    "fog_score",
+    "castle_score",
+    "fog_probability",
+    "castle_probability",
+    "castle_event_probability",
+]
+CHUNK_ROWS = 200_000
+
+
+def parse_offsets(spec: str) -> np.ndarray:
+    """"開始:終了:刻み"（終了を含む）または単一の値を、ずらし幅の配列にする。"""
+    parts = [float(part) for part in spec.split(":")]
+    if len(parts) == 1:
+        return np.array(parts)
+    if len(parts) != 3 or parts[2] <= 0 or parts[1] < parts[0]:
+        raise ValueError(f"ずらし幅は 開始:終了:刻み（刻みは正の値）で指定してください: {spec}")
+    start, stop, step = parts
+    count = int(np.floor((stop - start) / step + 1e-9)) + 1
+    return start + np.arange(count) * step
+
+
+def event_codes(fog_probs: np.ndarray, event_probs: np.ndarray) -> np.ndarray:
+    """predict_model.determine_event（校正器の確率あり）の配列版。EVENT_LABELS の番号で返す。"""
+    codes = np.zeros(len(fog_probs), dtype=np.int8)
+    codes[fog_probs >= 0.5] = EVENT_LABELS.index("FogOnly")
+    codes[event_probs >= 0.5] = EVENT_LABELS.index("Castle")
+    return codes
+
+
+def load_base_weather(date: Optional[str]) -> Dict[str, object]:
+    """基準の気象データ。date 指定時は history.csv のその日の行、未指定なら weather.csv の最新行。"""
+    if date is None:
+        base, source = predict_model.load_weather(), predict_model.WEATHER_CSV
+    else:
+        row = load_history_view(HISTORY_CSV).row_for(date)
+        if row is None:
+            raise SystemExit(f"{HISTORY_CSV} に {date} の行がありません。")
+        base, source = {"date": date, **{col: float(row[col]) for col in AXES}}, HISTORY_CSV
+    # 欠けた値のままずらすと、スコア計算が湿度の範囲外などの分かりにくいエラーになる
+    missing = [col for col in AXES if not np.isfinite(float(base[col]))]
+    if missing:
+        raise SystemExit(f"{source} の {base['date']} の行に値がありません: {', '.join(missing)}")
+    return base
+
+
+def evaluate_grid(
+    base: Dict[str, object],
+    offsets: Dict[str, np.ndarray],
+    models: Optional[tuple] = None,
+    calibrator: Optional[tuple] = None,
+) -> Dict[str, np.ndarray]:
+    """基準値に offsets を足した全組み合わせを評価し、格子の形（AXES の順）の配列で返す。"""
+    if models is None or calibrator is None:
+        # 途中でバンドルが差し替えられても、モデルと校正器が同じ版になるようにする
+        bundle = predict_model.load_bundle()
+        models = models or predict_model.load_models(bundle)
+        calibrator = calibrator or predict_model.load_calibrator(bundle)
+    axes = [np.asarray(offsets.get(col, [0.0]), dtype=float) for col in AXES]
+    shape = tuple(len(axis) for axis in axes)
+    total = int(np.prod(shape))
+
+    # 前日特徴量は基準日のものを全シナリオで共有する（temp_prev_diff だけ temp に合わせて計算し直す）
+    base_features = predict_model.build_feature_frame(base).iloc[0]
+    results = {col: np.empty(total, dtype=np.float32) for col in RESULT_COLUMNS}
+    results["event"] = np.empty(total, dtype=np.int8)
+
+    for start in range(0, total, CHUNK_ROWS):
+        index = np.unravel_index(np.arange(start, min(start + CHUNK_ROWS, total)), shape)
+        weather = {}
+        for col, axis, positions in zip(AXES, axes, index):
+            low, high = LIMITS[col]
+            weather[col] = np.clip(float(base[col]) + axis[positions], low, high)
+        scores = score_fog.score_weather_batch(weather)
+
+        features = pd.DataFrame({col: np.full(len(index[0]), base_features[col]) for col in predict_model.FEATURE_COLUMNS})
+        for col in AXES:
+            features[col] = weather[col]
+        features["temp_prev_diff"] = features["prev_temp"] - features["temp"]
+        fog_probs, castle_probs = predict_model.predict_probabilities_batch(features, models)
+        event_probs = predict_model.compute_event_probabilities(fog_probs, castle_probs, calibrator)
+
+        chunk = slice(start, start + len(index[0]))
+        results["fog_score"][chunk] = scores["fog_score"]
+        results["castle_score"][chunk] = scores["castle_score"]
+        results["fog_probability"][chunk] = fog_probs
+        results["castle_probability"][chunk] = castle_probs
+        results["castle_event_probability"][chunk] = event_probs
+        results["event"][chunk] = event_codes(fog_probs, event_probs)
+
+    return {name: values.reshape(shape) for name, values in results.items()}
+
+
+def zero_index(axis: np.ndarray) -> int:
+    """ずらし幅が 0 に最も近い位置（基準のシナリオ）。"""
+    return int(np.argmin(np.abs(axis)))
+
+
+def nearest_flips(offsets: Dict[str, np.ndarray], events: np.ndarray) -> List[str]:
+    """基準と判定が変わるシナリオのうち、変数ごと（他は基準のまま）と全体で最も近いものを文章で返す。"""
+    axes = [np.asarray(offsets.get(col, [0.0]), dtype=float) for col in AXES]
+    origin = tuple(zero_index(axis) for axis in axes)
+    base_event = int(events[origin])
+    lines = [f"base event: {EVENT_LABELS[base_event]}"]
+
+    for dim, (col, axis) in enumerate(zip(AXES, axes)):
+        if len(axis) == 1:
+            continue
+        line = list(origin)
+        line[dim] = slice(None)
+        changed = np.flatnonzero(events[tuple(line)] != base_event)
+        if not len(changed):
+            lines.append(f"  {col}: no flip within {axis[0]:+g}..{axis[-1]:+g}")
+            continue
+        best = changed[np.argmin(np.abs(axis[changed]))]
+        lines.append(f"  {col}: {axis[best]:+g} -> {EVENT_LABELS[int(events[tuple(line)][best])]}")
+
+    changed = np.argwhere(events != base_event)
+    if len(changed):
+        # 刻み数で測った距離が最小のシナリオ（刻みが無い軸は距離に効かない）
+        steps = np.array([np.diff(axis).min() if len(axis) > 1 else 1.0 for axis in axes])
+        deltas = np.stack([axis[changed[:, dim]] for dim, axis in enumerate(axes)], axis=1)
+        best = int(np.argmin(np.sqrt(((deltas / steps) ** 2).sum(axis=1))))
+        moved = ", ".join(f"{col} {delta:+g}" for col, delta in zip(AXES, deltas[best]) if delta != 0)
+        lines.append(f"  nearest: {moved} -> {EVENT_LABELS[int(events[tuple(changed[best])])]}")
+    return lines
+
+
+def save_grid(
+    path: Path,
+    base: Dict[str, object],
+    offsets: Dict[str, np.ndarray],
+    results: Dict[str, np.ndarray],
+) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    metadata = {"base": base, "axes": AXES, "event_labels": EVENT_LABELS}
+    np.savez_compressed(
+        path,
+        metadata=np.array(json.dumps(metadata, ensure_ascii=False)),
+        **{f"offset_{col}": np.asarray(offsets.get(col, [0.0]), dtype=float) for col in AXES},
+        **results,
+    )
+
+
+def save_heatmap(
+    path: Path,
+    x: str,
+    y: str,
+    offsets: Dict[str, np.ndarray],
+    results: Dict[str, np.ndarray],
+) -> None:
+    """2変数の castle_event_probability を CSV（行が y、列が x、他の変数は基準のまま）で保存する。"""
+    axes = [np.asarray(offsets.get(col, [0.0]), dtype=float) for col in AXES]
+    index = [zero_index(axis) for axis in axes]
+    index[AXES.index(x)] = slice(None)
+    index[AXES.index(y)] = slice(None)
+    values = results["castle_event_probability"][tuple(index)]
+    if AXES.index(x) < AXES.index(y):
+        values = values.T
+    frame = pd.DataFrame(values, index=axes[AXES.index(y)], columns=axes[AXES.index(x)])
+    frame.index.name = f"{y}\\{x}"
+    frame.round(3).to_csv(path)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="気象条件をずらしたシナリオの格子をまとめて評価します。")
+    parser.add_argument("--date", help="history.csv のこの日の行を基準にする（未指定なら weather.csv の最新行）。")
+    for col in AXES:
+        parser.add_argument(
+            f"--{col}",
+            default="0",
+            help=f"{col} のずらし幅（開始:終了:刻み または単一の値。負の値から始めるときは --{col}=-3:3:0.5 のように書く）。",
+        )
+    parser.add_argument("--output", type=Path, default=OUTPUT_PATH, help="保存先（.npz）。")
+    parser.add_argument(
+        "--heatmap",
+        nargs=2,
+        metavar=("X", "Y"),
+        choices=AXES,
+        help="2変数の総合出現率を CSV でも保存する（<output>_<X>_<Y>.csv）。",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    if args.heatmap and args.heatmap[0] == args.heatmap[1]:
+        raise SystemExit("--heatmap には異なる2つの変数を指定してください。")
+    try:
+        offsets = {col: parse_offsets(getattr(args, col)) for col in AXES}
+    except ValueError as exc:
+        raise SystemExit(str(exc)) from exc
+    base = load_base_weather(args.date)
+    results = evaluate_grid(base, offsets)
+
+    save_grid(args.output, base, offsets, results)
+    print(f"Saved {results['event'].size} scenarios {results['event'].shape} to {args.output}")
+    if args.heatmap:
+        x, y = args.heatmap
+        heatmap_path = args.output.with_name(f"{args.output.stem}_{x}_{y}.csv")
+        save_heatmap(heatmap_path, x, y, offsets, results)
+        print(f"Saved heatmap to {heatmap_path}")
+    print("\n".join(nearest_flips(offsets, results["event"])))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,35 @@
 #!/usr/bin/env python3
 """
 data/weather.csv を読み込み、露点温度と霧・天空の城スコアを計算して data/feed.json に出力する。
+
+  python score_fog.py                                   # weather.csv の最新行を採点
+  python score_fog.py --rescore data/history.csv        # 履歴全体のスコア列を計算し直す
+  python score_fog.py --rescore data/forecast_window.json
+
+*_batch の関数は NumPy の列をまとめて計算し、1行ずつ計算した場合と同じ値（丸め・上下限も同じ）を返す。
+湿度が範囲外の行は例外にせず、露点・スコアを NaN にして RuntimeWarning で知らせる。
+pandas / history_store は --rescore のときだけ import する。
 """
 
 from __future__ import annotations
 
+import argparse
 import csv
 import json
 import math
+import warnings
 from pathlib import Path
-from typing import Dict
+from typing import TYPE_CHECKING, Dict, List, Mapping
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 WEATHER_CSV = Path("data/weather.csv")
 FEED_JSON = Path("data/feed.json")
+WEATHER_COLUMNS = ["temp", "humidity", "wind", "cloud", "rain"]
+SCORE_COLUMNS = ["fog_score", "castle_score", "dew_point", "dew_spread"]
 
 
 def read_weather() -> Dict[str, float]:
@@ -77,6 +94,163 @@ def calc_scores(temp: float, dew_point: float, wind: float, cloud: float, rain:
     }
 
 
+def score_weather(weather: Dict[str, float]) -> Dict[str, float]:
+    """気象データ（temp/humidity/wind/cloud/rain）から露点とスコアをまとめて計算する。"""
+    dew_point = calc_dew_point(weather["temp"], weather["humidity"])
+    return calc_scores(
+        temp=weather["temp"],
+        dew_point=dew_point,
+        wind=weather["wind"],
+        cloud=weather["cloud"],
+        rain=weather["rain"],
+    )
+
+
+def round_half_even(values, ndigits: int) -> np.ndarray:
+    """配列の各値を Python の round(value, ndigits) と同じ値に丸める（predict_forecast_window も使う）。
+
+    np.round は value * 10**ndigits を丸めるため、ちょうど .5 付近では2進表現の誤差で
+    round と結果が変わることがある。その付近の要素だけ round で丸め直す。
+    """
+    values = np.asarray(values, dtype=float)
+    scaled = values * 10.0**ndigits
+    rounded = np.round(values, ndigits)
+    near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if near_tie.any():
+        rounded[near_tie] = [round(value, ndigits) for value in values[near_tie].tolist()]
+    return rounded
+
+
+def invalid_humidity(humidity) -> np.ndarray:
+    """湿度が (0, 100] の範囲外の要素（欠損の NaN は含めない）。"""
+    humidity = np.asarray(humidity, dtype=float)
+    return ~np.isnan(humidity) & ~((humidity > 0.0) & (humidity <= 100.0))
+
+
+def calc_dew_point_batch(temp_c: np.ndarray, humidity: np.ndarray) -> np.ndarray:
+    """calc_dew_point の配列版。湿度が範囲外の要素は NaN にし、その位置を RuntimeWarning で知らせる。"""
+    temp_c = np.asarray(temp_c, dtype=float)
+    humidity = np.asarray(humidity, dtype=float)
+    invalid = invalid_humidity(humidity)
+    if invalid.any():
+        positions = np.flatnonzero(invalid)
+        warnings.warn(
+            f"湿度が0より大きく100以下でない {len(positions)} 行の露点を NaN にしました"
+            f"（位置: {positions[:10].tolist()}{' ...' if len(positions) > 10 else ''}）。",
+            RuntimeWarning,
+            stacklevel=2,
+        )
+        humidity = np.where(invalid, np.nan, humidity)
+    a = 17.625
+    b = 243.04
+    alpha = np.log(humidity / 100.0) + (a * temp_c) / (b + temp_c)
+    return (b * alpha) / (a - alpha)
+
+
+def calc_scores_batch(
+    temp: np.ndarray,
+    dew_point: np.ndarray,
+    wind: np.ndarray,
+    cloud: np.ndarray,
+    rain: np.ndarray,
+) -> Dict[str, np.ndarray]:
+    """calc_scores の配列版（列名 → 値の配列）。"""
+    temp, dew_point, wind, cloud, rain = (
+        np.asarray(values, dtype=float) for values in (temp, dew_point, wind, cloud, rain)
+    )
+    dew_spread = temp - dew_point
+
+    fog_score = 100.0 - np.clip(dew_spread * 12.0, 0, 60)
+    fog_score -= np.clip(np.maximum(wind - 1.5, 0) * 10.0, 0, 25)
+    fog_score -= np.clip(rain * 5.0, 0, 10)
+    fog_score = np.clip(fog_score, 0, 100)
+
+    cloud_penalty = np.where(cloud < 40, (40 - cloud) * 0.6, np.where(cloud > 90, (cloud - 90) * 0.8, 0.0))
+    castle_score = fog_score - cloud_penalty
+    castle_score -= np.clip(np.maximum(dew_spread - 2.0, 0) * 8.0, 0, 20)
+    castle_score = np.clip(castle_score, 0, 100)
+
+    return {
+        "fog_score": round_half_even(fog_score, 1),
+        "castle_score": round_half_even(castle_score, 1),
+        "dew_point": round_half_even(dew_point, 2),
+        "dew_spread": round_half_even(dew_spread, 2),
+    }
+
+
+def score_weather_batch(weather: Mapping[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """score_weather の配列版。weather は temp/humidity/wind/cloud/rain の列（DataFrame でもよい）。"""
+    dew_point = calc_dew_point_batch(weather["temp"], weather["humidity"])
+    return calc_scores_batch(
+        temp=weather["temp"],
+        dew_point=dew_point,
+        wind=weather["wind"],
+        cloud=weather["cloud"],
+        rain=weather["rain"],
+    )
+
+
+def score_rows(rows: List[Mapping[str, float]]) -> List[Dict[str, float]]:
+    """複数行の気象データを一度に採点し、score_weather と同じ形の辞書のリストで返す。"""
+    if not rows:
+        return []
+    scores = score_weather_batch({col: np.array([row[col] for row in rows], dtype=float) for col in WEATHER_COLUMNS})
+    columns = {col: values.tolist() for col, values in scores.items()}
+    return [{col: columns[col][i] for col in SCORE_COLUMNS} for i in range(len(rows))]
+
+
+def scorable_mask(df: pd.DataFrame) -> np.ndarray:
+    """気象の列がすべて揃っている行（欠損のある行は採点しない）。"""
+    return df[WEATHER_COLUMNS].notna().all(axis=1).to_numpy()
+
+
+def report_invalid_humidity(path: Path, dates: List[str]) -> None:
+    if dates:
+        shown = ", ".join(dates[:10]) + (" ..." if len(dates) > 10 else "")
+        print(f"Skipped {len(dates)} rows in {path} with humidity outside (0, 100]: {shown}")
+
+
+def rescore_history(path: Path) -> int:
+    """履歴（history.csv 形式のファイルとその履歴ストア）全体のスコア列を計算し直し、HistoryStore 経由で更新する。"""
+    from history_store import HistoryStore, read_history_frame
+
+    df = read_history_frame(csv_path=path)
+    df = df[scorable_mask(df) & df["date"].notna().to_numpy()]
+    dates = df["date"].dt.strftime("%Y-%m-%d")
+    invalid = invalid_humidity(df["humidity"])
+    report_invalid_humidity(path, dates[invalid].tolist())
+    df, dates = df[~invalid], dates[~invalid]
+    if df.empty:
+        return 0
+    scores = score_weather_batch({col: df[col].to_numpy(dtype=float) for col in WEATHER_COLUMNS})
+    columns = {col: values.tolist() for col, values in scores.items()}
+    records = [
+        {"date": date, **{col: columns[col][i] for col in SCORE_COLUMNS}}
+        for i, date in enumerate(dates.tolist())
+    ]
+    HistoryStore(path).upsert_many(records)
+    return len(records)
+
+
+def rescore_forecast(path: Path) -> int:
+    """予報ウィンドウ（エントリのリスト）または予測結果（predictions を持つ JSON）にスコアを付け直す。"""
+    import pandas as pd
+
+    with path.open("r", encoding="utf-8") as f:
+        payload = json.load(f)
+    entries = payload["predictions"] if isinstance(payload, dict) else payload
+    df = pd.DataFrame(entries, columns=WEATHER_COLUMNS)
+    mask = scorable_mask(df)
+    invalid = mask & invalid_humidity(pd.to_numeric(df["humidity"], errors="coerce"))
+    report_invalid_humidity(path, [str(entry.get("date")) for entry, bad in zip(entries, invalid) if bad])
+    targets = [entry for entry, ok in zip(entries, mask & ~invalid) if ok]
+    for entry, scores in zip(targets, score_rows(targets)):
+        entry.update(scores)
+    with path.open("w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    return len(targets)
+
+
 def write_feed(date: str, scores: Dict[str, float]) -> None:
     """data/feed.json に結果を保存する。"""
     FEED_JSON.parent.mkdir(parents=True, exist_ok=True)
@@ -89,16 +263,30 @@ def write_feed(date: str, scores: Dict[str, float]) -> None:
     print(f"Saved scores to {FEED_JSON}")
 
 
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="露点温度と霧・天空の城スコアを計算します。")
+    parser.add_argument(
+        "--rescore",
+        type=Path,
+        nargs="+",
+        metavar="PATH",
+        help="history.csv 形式の CSV、または予報の JSON のスコアをまとめて計算し直す。",
+    )
+    return parser.parse_args()
+
+
 def main() -> None:
+    args = parse_args()
+    if args.rescore:
+        for path in args.rescore:
+            if not path.exists():
+                raise SystemExit(f"{path} が見つかりません。")
+            count = rescore_history(path) if path.suffix == ".csv" else rescore_forecast(path)
+            print(f"Rescored {count} rows in {path}")
+        return
+
     weather = read_weather()
-    dew_point = calc_dew_point(weather["temp"], weather["humidity"])
-    scores = calc_scores(
-        temp=weather["temp"],
-        dew_point=dew_point,
-        wind=weather["wind"],
-        cloud=weather["cloud"],
-        rain=weather["rain"],
-    )
+    scores = score_weather(weather)
     write_feed(weather["date"], scores)
 
 
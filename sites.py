@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+雲海・天空の城の観測地点（サイト）の定義と、複数地点の一括取得。
+
+  - 地点の一覧は data/sites.json（id / name / latitude / longitude）で管理する
+  - Open-Meteo は latitude / longitude にカンマ区切りで複数の座標を渡すと、地点ごとの応答を
+    リストで返す。MAX_LOCATIONS_PER_REQUEST 地点ずつ1リクエストにまとめ、
+    残りのまとまりは http_client.map_bounded で並列に取得する
+  - 地点ごとの出力は data/sites/<id>/ に保存する
+"""
+
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Mapping, Optional
+
+import http_client
+
+SITES_JSON = Path("data/sites.json")
+SITES_OUTPUT_DIR = Path("data/sites")
+DEFAULT_SITE = "echizen-ono"
+# 1リクエストにまとめる地点数の上限（SKYCASTLE_MAX_LOCATIONS で変更可）
+MAX_LOCATIONS_PER_REQUEST = max(http_client.env_int("SKYCASTLE_MAX_LOCATIONS", 50), 1)
+
+
+@dataclass(frozen=True)
+class Site:
+    id: str
+    name: str
+    latitude: float
+    longitude: float
+
+    @property
+    def output_dir(self) -> Path:
+        return SITES_OUTPUT_DIR / self.id
+
+
+ECHIZEN_ONO = Site(DEFAULT_SITE, "越前大野城", 35.98, 136.49)
+
+
+def load_sites(path: Path = SITES_JSON) -> List[Site]:
+    """地点の一覧を読み込む（ファイルが無ければ越前大野のみ）。"""
+    if not path.exists():
+        return [ECHIZEN_ONO]
+    with path.open("r", encoding="utf-8") as f:
+        records = json.load(f)
+    sites = [
+        Site(
+            id=str(record["id"]),
+            name=str(record.get("name", record["id"])),
+            latitude=float(record["latitude"]),
+            longitude=float(record["longitude"]),
+        )
+        for record in records
+    ]
+    ids = [site.id for site in sites]
+    duplicates = sorted({site_id for site_id in ids if ids.count(site_id) > 1})
+    if duplicates:
+        raise ValueError(f"{path} に重複した id があります: {', '.join(duplicates)}")
+    return sites
+
+
+def select_sites(spec: Optional[str], path: Path = SITES_JSON) -> List[Site]:
+    """--sites の指定（"all" またはカンマ区切りの id）から地点を選ぶ。"""
+    available = load_sites(path)
+    if spec is None or spec.strip().lower() == "all":
+        return available
+    by_id = {site.id: site for site in available}
+    wanted = [item.strip() for item in spec.split(",") if item.strip()]
+    missing = [site_id for site_id in wanted if site_id not in by_id]
+    if missing:
+        raise SystemExit(f"未登録の地点です: {', '.join(missing)}（{path} を確認してください）")
+    return [by_id[site_id] for site_id in wanted]
+
+
+def coordinate_params(sites: Iterable[Site]) -> Dict[str, str]:
+    sites = list(sites)
+    return {
+        "latitude": ",".join(str(site.latitude) for site in sites),
+        "longitude": ",".join(str(site.longitude) for site in sites),
+    }
+
+
+def chunk_sites(sites: List[Site], size: int = MAX_LOCATIONS_PER_REQUEST) -> List[List[Site]]:
+    return [sites[start : start + size] for start in range(0, len(sites), size)]
+
+
+def fetch_for_sites(
+    fetch_chunk: Callable[[Dict[str, object]], object],
+    params: Mapping[str, object],
+    sites: Iterable[Site],
+    chunk_size: int = MAX_LOCATIONS_PER_REQUEST,
+) -> Dict[str, dict]:
+    """複数地点の応答を {地点 id: 応答} で返す。
+
+    fetch_chunk には params に座標をまとめて入れたパラメータが渡され、Open-Meteo の応答
+    （1地点なら dict、複数地点ならリスト）を返す。応答は座標と同じ順に並んでいる。
+    """
+    chunks = chunk_sites(list(sites), chunk_size)
+
+    def fetch(chunk: List[Site]) -> Dict[str, dict]:
+        payload = fetch_chunk({**params, **coordinate_params(chunk)})
+        payloads = payload if isinstance(payload, list) else [payload]
+        if len(payloads) != len(chunk):
+            raise ValueError(f"地点数 {len(chunk)} に対して {len(payloads)} 件の応答が返りました。")
+        return {site.id: site_payload for site, site_payload in zip(chunk, payloads)}
+
+    results: Dict[str, dict] = {}
+    for chunk_result in http_client.map_bounded(fetch, chunks):
+        results.update(chunk_result)
+    return results
+
@@ -2,40 +2,81 @@
 """
 history.csv を使って霧発生モデルと天空の城成立モデルの2本を学習し、
 それぞれ model/skycastle_fog.pkl、model/skycastle_castle.pkl に保存する。
+model/skycastle_params.json（tune_model.py の探索結果）があれば、その設定で学習する。
+
+  python train_model.py                 # 全履歴で作り直す（full）
+  python train_model.py --incremental   # 前回から増えた・変わった行だけで追加学習する
+
+--incremental では、前回の学習時に記録した行（model/skycastle_training.json）と比べて
+新しく増えた・ラベルが変わった行を探し、それに直近 INCREMENTAL_WINDOW_ROWS 行を加えた
+小さなデータで既存のブースターに INCREMENTAL_TREES 本の木を追加する（校正器は据え置き）。
+直近の行にラベルが1種類しかない時期（霧の出ない季節など）は、2種類そろうまで直近の範囲を広げる。
+次の場合は full に切り替える:
+  - 前回の full から FULL_RETRAIN_DAYS 日以上経った、または追加学習が MAX_INCREMENTAL_UPDATES 回続いた
+  - 変わった行に対する既存モデルの対数損失が DRIFT_LOG_LOSS を超えた（ドリフト）
+  - 行が削除された、探索済みの設定が変わった、モデルや記録が無い
+どちらの方法で作ったかは model/skycastle_training.json にモデルごとに記録する。
+最後に、推論用のモデルバンドル（model/skycastle_bundle.cols）をその記録ごと書き出す。
 """
 
 from __future__ import annotations
 
+import argparse
+import datetime as dt
+import functools
+import hashlib
+import json
+import math
 import sys
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional, Set, Tuple
 
 import joblib
 import lightgbm as lgb
+import numpy as np
 import pandas as pd
+from zoneinfo import ZoneInfo
+
+import features
+import prediction_cache
+from features import BASE_FEATURE_COLUMNS, FEATURE_COLUMNS, LAG_FEATURE_COLUMNS
+from history_store import HistoryStore, read_history_frame
+from predict_model import BUNDLE_PATH, export_inference_artifacts
 
 HISTORY_CSV = Path("data/history.csv")
 MODEL_DIR = Path("model")
 FOG_MODEL_PATH = MODEL_DIR / "skycastle_fog.pkl"
 CASTLE_MODEL_PATH = MODEL_DIR / "skycastle_castle.pkl"
 EVENT_CALIBRATOR_PATH = MODEL_DIR / "skycastle_event_calibrator.pkl"
-BASE_FEATURE_COLUMNS: List[str] = ["temp", "humidity", "wind", "cloud", "rain"]
-LAG_FEATURE_COLUMNS: List[str] = [
-    "prev_temp",
-    "prev_humidity",
-    "prev_wind",
-    "prev_cloud",
-    "prev_rain",
-    "temp_prev_diff",
-]
-FEATURE_COLUMNS: List[str] = BASE_FEATURE_COLUMNS + LAG_FEATURE_COLUMNS
+# tune_model.py で探索した設定（あれば MODEL_PARAMS より優先する）
+TUNED_PARAMS_PATH = MODEL_DIR / "skycastle_params.json"
+# 学習の方法（full / incremental）と学習に使った行の記録
+TRAINING_STATE_PATH = MODEL_DIR / "skycastle_training.json"
+INCREMENTAL_WINDOW_ROWS = 120
+INCREMENTAL_TREES = 20
+FULL_RETRAIN_DAYS = 7
+MAX_INCREMENTAL_UPDATES = 14
+DRIFT_MIN_ROWS = 5
+# 変わった行に対する対数損失がこれ（確率 0.5 と答え続けた場合の値）を超えたらドリフトとみなす
+DRIFT_LOG_LOSS = math.log(2)
+TZ = ZoneInfo("Asia/Tokyo")
+CALIBRATOR_FEATURE_COLUMNS: List[str] = ["fog_probability", "castle_probability", "fog_castle_product"]
+MODEL_PARAMS = {
+    "objective": "binary",
+    "n_estimators": 200,
+    "num_leaves": 31,
+    "learning_rate": 0.05,
+    "subsample": 0.9,
+    "colsample_bytree": 0.9,
+    "random_state": 42,
+}
 
 
 def load_history() -> pd.DataFrame:
     if not HISTORY_CSV.exists():
         raise FileNotFoundError(f"{HISTORY_CSV} が存在しません。観測データを追加してください。")
 
-    df = pd.read_csv(HISTORY_CSV)
+    df = read_history_frame(["date", *BASE_FEATURE_COLUMNS, "fog_observed", "castle_visible"], HISTORY_CSV)
     if df.empty:
         raise ValueError(f"{HISTORY_CSV} にデータ行がありません。")
 
@@ -43,17 +84,16 @@ def load_history() -> pd.DataFrame:
     if missing_cols:
         raise ValueError(f"{HISTORY_CSV} に必要な列が足りません: {missing_cols}")
 
+    # 前日特徴量は推論と同じく、ラベルの無い日も含めた履歴全体から作る
+    df["date"] = pd.to_datetime(df["date"])
+    df = df.sort_values("date", kind="stable").drop_duplicates(subset=["date"], keep="last")
+    df = df.dropna(subset=BASE_FEATURE_COLUMNS, how="all")
+    df[FEATURE_COLUMNS] = features.build_features(df["date"], df[BASE_FEATURE_COLUMNS].astype("float64"))
+
     df = df.dropna(subset=BASE_FEATURE_COLUMNS + ["fog_observed", "castle_visible"])
     if df.empty:
         raise ValueError("必要な列に欠損値があり、学習可能な行がありません。")
 
-    df["date"] = pd.to_datetime(df["date"])
-    df = df.sort_values("date")
-
-    for col in BASE_FEATURE_COLUMNS:
-        df[f"prev_{col}"] = df[col].shift(1)
-    df["temp_prev_diff"] = df["prev_temp"] - df["temp"]
-
     df = df.dropna(subset=LAG_FEATURE_COLUMNS)
     if df.empty:
         raise ValueError("前日分の特徴量が作成できず、学習データが残りませんでした。")
@@ -64,20 +104,37 @@ def load_history() -> pd.DataFrame:
     return df
 
 
-def train_model(features: pd.DataFrame, target: pd.Series, model_path: Path):
+def load_tuned_params(name: str, path: Path = TUNED_PARAMS_PATH) -> dict:
+    """tune_model.py が保存したモデル name（"fog" / "castle"）の設定。無ければ空（MODEL_PARAMS のまま）。"""
+    if not path.exists():
+        return {}
+    with path.open("r", encoding="utf-8") as f:
+        tuned = json.load(f)
+    return dict(tuned.get(name, {}).get("params", {}))
+
+
+def fit_classifier(
+    features: pd.DataFrame,
+    target: pd.Series,
+    name: str,
+    fit_params: Optional[dict] = None,
+    **params,
+):
+    """LightGBM の二値分類モデルを学習して返す（保存はしない）。
+
+    params で MODEL_PARAMS を上書きでき、fit_params は fit にそのまま渡す（eval_set など）。
+    """
     if target.nunique() < 2:
-        raise ValueError(f"ラベルに2種類以上の値が必要です（{model_path.name}）。データを追加してください。")
-
-    model = lgb.LGBMClassifier(
-        objective="binary",
-        n_estimators=200,
-        num_leaves=31,
-        learning_rate=0.05,
-        subsample=0.9,
-        colsample_bytree=0.9,
-        random_state=42,
-    )
-    model.fit(features, target)
+        raise ValueError(f"ラベルに2種類以上の値が必要です（{name}）。データを追加してください。")
+
+    settings = {**MODEL_PARAMS, **params}
+    model = lgb.LGBMClassifier(**settings)
+    model.fit(features, target, **(fit_params or {}))
+    return model
+
+
+def train_model(features: pd.DataFrame, target: pd.Series, model_path: Path, params: Optional[dict] = None):
+    model = fit_classifier(features, target, model_path.name, **(params or {}))
     model_path.parent.mkdir(parents=True, exist_ok=True)
     joblib.dump(model, model_path)
     print(f"Saved model to {model_path}")
@@ -95,45 +152,94 @@ def build_calibrator_features(fog_prob: pd.Series, castle_prob: pd.Series) -> pd
     return features
 
 
+def castle_training_rows(df: pd.DataFrame) -> Tuple[pd.DataFrame, bool]:
+    """城モデルの学習に使う行（霧が発生した日）と、データ不足で全データに切り替えたかどうか。"""
+    castle_df = df[df["fog_observed"] == 1]
+    if len(castle_df) >= 2 and castle_df["castle_visible"].nunique() >= 2:
+        return castle_df, False
+    return df, True
+
+
+def fit_event_calibrator(df: pd.DataFrame, fog_model, castle_model):
+    """霧・城モデルの確率から総合出現（霧かつ城）を予測する校正器を学習して返す。
+
+    正例・負例の両方が無い場合は None。
+    """
+    from sklearn.linear_model import LogisticRegression
+
+    event_target = ((df["fog_observed"] == 1) & (df["castle_visible"] == 1)).astype(int)
+    if event_target.nunique() < 2:
+        return None
+
+    fog_prob = pd.Series(fog_model.predict_proba(df[FEATURE_COLUMNS])[:, 1], index=df.index)
+    castle_prob = pd.Series(castle_model.predict_proba(df[FEATURE_COLUMNS])[:, 1], index=df.index)
+    calibrator = LogisticRegression(max_iter=1000)
+    calibrator.fit(build_calibrator_features(fog_prob, castle_prob), event_target)
+    return calibrator
+
+
 def train_event_calibrator(
     df: pd.DataFrame,
     fog_model,
     castle_model,
 ) -> None:
-    from sklearn.linear_model import LogisticRegression
-
-    event_target = ((df["fog_observed"] == 1) & (df["castle_visible"] == 1)).astype(int)
-    if event_target.nunique() < 2:
+    calibrator = fit_event_calibrator(df, fog_model, castle_model)
+    if calibrator is None:
         if EVENT_CALIBRATOR_PATH.exists():
             EVENT_CALIBRATOR_PATH.unlink()
             print("Removed existing event calibrator because of insufficient positive samples.")
         print("Skipping event calibrator training: need both positive and negative samples.")
         return
 
-    fog_prob = pd.Series(fog_model.predict_proba(df[FEATURE_COLUMNS])[:, 1], index=df.index)
-    castle_prob = pd.Series(castle_model.predict_proba(df[FEATURE_COLUMNS])[:, 1], index=df.index)
-    calibrator_features = build_calibrator_features(fog_prob, castle_prob)
-
-    calibrator = LogisticRegression(max_iter=1000)
-    calibrator.fit(calibrator_features, event_target)
     payload = {
         "model": calibrator,
-        "feature_names": list(calibrator_features.columns),
+        "feature_names": CALIBRATOR_FEATURE_COLUMNS,
     }
     EVENT_CALIBRATOR_PATH.parent.mkdir(parents=True, exist_ok=True)
     joblib.dump(payload, EVENT_CALIBRATOR_PATH)
     print(f"Saved event calibrator to {EVENT_CALIBRATOR_PATH}")
 
 
-def update_history_event_probability(
-    fog_model,
-    castle_model,
-) -> None:
+def write_event_probability(dates: pd.Series, event_series: pd.Series) -> None:
+    """castle_event_probability 列だけを履歴ストアへ反映する（他の列の同時更新は保持される）。"""
+    records = [
+        {"date": date, "castle_event_probability": value}
+        for date, value in zip(dates, event_series)
+        if isinstance(date, str) and date
+    ]
+    HistoryStore(HISTORY_CSV).upsert_many(records)
+
+
+def predict_history_probabilities(fog_model, castle_model, matrix: np.ndarray) -> np.ndarray:
+    """特徴量行列の各行の (霧確率, 城確率, 総合出現確率)（prediction_cache.PROBABILITY_COLUMNS の順）。"""
+    feature_df = pd.DataFrame(matrix, columns=FEATURE_COLUMNS)
+    fog_prob = pd.Series(fog_model.predict_proba(feature_df)[:, 1])
+    castle_prob = pd.Series(castle_model.predict_proba(feature_df)[:, 1])
+
+    if EVENT_CALIBRATOR_PATH.exists():
+        payload = joblib.load(EVENT_CALIBRATOR_PATH)
+        calibrator = payload["model"]
+        feature_names = payload["feature_names"]
+        calibrator_features = build_calibrator_features(fog_prob, castle_prob)[feature_names]
+        event_prob = calibrator.predict_proba(calibrator_features)[:, 1]
+    else:
+        event_prob = (fog_prob * castle_prob).to_numpy()
+    return np.column_stack([fog_prob.to_numpy(), castle_prob.to_numpy(), event_prob])
+
+
+def update_history_event_probability(fog_model, castle_model) -> None:
+    """history.csv の全行の castle_event_probability を付け直す。
+
+    fog_model / castle_model は保存済みの pkl と同じもの。予測は prediction_cache で特徴量の行ごとに
+    使い回し（モデルが変わっていなければ新しい・変わった行だけを推論する）、保存されている値から
+    変わった行だけを書き込む。追加学習でもモデルは変わるので、変わった日付だけでなく全行を付け直す
+    （キャッシュには全行の結果が残る）。
+    """
     if not HISTORY_CSV.exists():
         return
 
     try:
-        history_raw = pd.read_csv(HISTORY_CSV)
+        history_raw = read_history_frame(["date", *BASE_FEATURE_COLUMNS, "castle_event_probability"], HISTORY_CSV)
     except Exception as exc:  # pragma: no cover - defensive
         print(f"Skip history backfill: failed to read history.csv ({exc})")
         return
@@ -141,62 +247,235 @@ def update_history_event_probability(
     if history_raw.empty:
         return
 
-    sortable = history_raw.copy()
-    sortable["date"] = pd.to_datetime(sortable["date"], errors="coerce")
-    sortable = sortable.sort_values("date")
-
-    for col in BASE_FEATURE_COLUMNS:
-        sortable[f"prev_{col}"] = sortable[col].shift(1)
-    sortable["temp_prev_diff"] = sortable["prev_temp"] - sortable["temp"]
-
-    feature_mask = sortable[FEATURE_COLUMNS].notna().all(axis=1)
-    if not feature_mask.any():
-        history_raw["castle_event_probability"] = pd.NA
-        history_raw.to_csv(HISTORY_CSV, index=False)
+    matrix = features.build_features(history_raw["date"], history_raw[BASE_FEATURE_COLUMNS].astype("float64"))
+    dates = history_raw["date"].dt.strftime("%Y-%m-%d").to_numpy()
+    feature_mask = ~np.isnan(matrix).any(axis=1)
+
+    event_prob = np.full(len(dates), np.nan)
+    predicted = 0
+    if feature_mask.any():
+        fingerprint = prediction_cache.model_fingerprint([FOG_MODEL_PATH, CASTLE_MODEL_PATH, EVENT_CALIBRATOR_PATH])
+        probabilities, predicted = prediction_cache.predict_cached(
+            matrix[feature_mask],
+            functools.partial(predict_history_probabilities, fog_model, castle_model),
+            fingerprint,
+        )
+        event_prob[feature_mask] = probabilities[:, 2]
+
+    stored = history_raw["castle_event_probability"].to_numpy(dtype=np.float64, na_value=np.nan)
+    unchanged = np.isclose(event_prob, stored, rtol=1e-12, atol=0.0) | (np.isnan(event_prob) & np.isnan(stored))
+    changed = ~unchanged
+    if not changed.any():
+        print(f"history.csv castle_event_probability is up to date ({predicted} rows predicted)")
         return
+    write_event_probability(pd.Series(dates[changed]), pd.Series(event_prob[changed], dtype="Float64"))
+    print(f"Updated history.csv with castle_event_probability ({changed.sum()} rows, {predicted} rows predicted)")
+
+
+def row_fingerprints(df: pd.DataFrame) -> Dict[str, str]:
+    """学習に使う行ごとの、特徴量の元になる値とラベルのハッシュ（日付 → ハッシュ）。"""
+    columns = BASE_FEATURE_COLUMNS + ["fog_observed", "castle_visible"]
+    dates = df["date"].dt.strftime("%Y-%m-%d")
+    values = df[columns].to_numpy(dtype=np.float64)
+    return {date: hashlib.sha1(row.tobytes()).hexdigest()[:16] for date, row in zip(dates, values)}
+
+
+def params_fingerprint() -> str:
+    tuned = {name: load_tuned_params(name) for name in ("fog", "castle")}
+    return hashlib.sha1(json.dumps([MODEL_PARAMS, tuned], sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def load_training_state(path: Path = TRAINING_STATE_PATH) -> Optional[dict]:
+    if not path.exists():
+        return None
+    with path.open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_training_state(state: dict, path: Path = TRAINING_STATE_PATH) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+
+
+def plan_update(df: pd.DataFrame, state: Optional[dict], now: dt.datetime) -> Tuple[str, str, Set[str]]:
+    """("full" / "incremental" / "skip", 理由, 新しく増えた・変わった行の日付) を決める。"""
+    if state is None or not FOG_MODEL_PATH.exists() or not CASTLE_MODEL_PATH.exists():
+        return "full", "no previous model or training record", set()
+    if state.get("params") != params_fingerprint():
+        return "full", "model parameters changed", set()
+    full_trained_at = dt.datetime.fromisoformat(state["full_trained_at"])
+    if now - full_trained_at >= dt.timedelta(days=FULL_RETRAIN_DAYS):
+        return "full", f"last full retrain is {FULL_RETRAIN_DAYS}+ days old", set()
+    if state.get("incremental_updates", 0) >= MAX_INCREMENTAL_UPDATES:
+        return "full", f"{MAX_INCREMENTAL_UPDATES} incremental updates since the last full retrain", set()
+
+    previous = state.get("rows", {})
+    current = row_fingerprints(df)
+    if set(previous) - set(current):
+        return "full", "rows were removed from history", set()
+    changed = {date for date, digest in current.items() if previous.get(date) != digest}
+    if not changed:
+        return "skip", "no new or relabeled rows", changed
+    return "incremental", f"{len(changed)} new or relabeled rows", changed
+
+
+def drift_detected(df: pd.DataFrame, fog_model, castle_model) -> Optional[str]:
+    """変わった行 df に対する既存モデルの対数損失が DRIFT_LOG_LOSS を超えていれば、その説明を返す。"""
+    if len(df) < DRIFT_MIN_ROWS:
+        return None
+    checks = [("fog", fog_model, df, "fog_observed")]
+    castle_rows = df[df["fog_observed"] == 1]
+    if len(castle_rows) >= DRIFT_MIN_ROWS:
+        checks.append(("castle", castle_model, castle_rows, "castle_visible"))
+    for name, model, rows, target in checks:
+        probs = np.clip(model.predict_proba(rows[FEATURE_COLUMNS])[:, 1], 1e-15, 1 - 1e-15)
+        labels = rows[target].to_numpy(dtype=float)
+        loss = float(-np.mean(labels * np.log(probs) + (1 - labels) * np.log(1 - probs)))
+        if loss > DRIFT_LOG_LOSS:
+            return f"{name} log loss {loss:.3f} on {len(rows)} changed rows exceeds {DRIFT_LOG_LOSS:.3f}"
+    return None
+
+
+def continue_training(model, features: pd.DataFrame, target: pd.Series, model_path: Path, params: dict):
+    """既存モデルのブースターに INCREMENTAL_TREES 本の木を追加学習して保存する。"""
+    updated = fit_classifier(
+        features,
+        target,
+        model_path.name,
+        {"init_model": model.booster_},
+        **{**params, "n_estimators": INCREMENTAL_TREES},
+    )
+    joblib.dump(updated, model_path)
+    print(f"Saved model to {model_path} ({updated.booster_.num_trees()} trees)")
+    return updated
+
+
+def incremental_batch(df: pd.DataFrame, changed: Set[str], target: str) -> pd.DataFrame:
+    """変わった行と直近 INCREMENTAL_WINDOW_ROWS 行。target が1種類しかなければ、2種類になるまで直近の範囲を倍に広げる。"""
+    changed_mask = df["date"].dt.strftime("%Y-%m-%d").isin(changed).to_numpy()
+    positions = np.arange(len(df))
+    window = INCREMENTAL_WINDOW_ROWS
+    while True:
+        batch = df[changed_mask | (positions >= len(df) - window)]
+        if batch[target].nunique() >= 2 or window >= len(df):
+            return batch
+        window *= 2
+
+
+def train_incremental(df: pd.DataFrame, changed: Set[str]) -> Optional[str]:
+    """変わった行と直近の行で追加学習する。full に切り替えるべき場合はその理由を返す（何も保存しない）。"""
+    fog_model = joblib.load(FOG_MODEL_PATH)
+    castle_model = joblib.load(CASTLE_MODEL_PATH)
+    dates = df["date"].dt.strftime("%Y-%m-%d")
+    changed_rows = df[dates.isin(changed)]
+    drift = drift_detected(changed_rows, fog_model, castle_model)
+    if drift is not None:
+        return f"drift detected ({drift})"
+
+    fog_batch = incremental_batch(df, changed, "fog_observed")
+    castle_rows, _ = castle_training_rows(df)
+    castle_batch = incremental_batch(castle_rows, changed, "castle_visible")
+    if fog_batch["fog_observed"].nunique() < 2 or castle_batch["castle_visible"].nunique() < 2:
+        return "training rows contain only one label"
+
+    fog_model = continue_training(
+        fog_model, fog_batch[FEATURE_COLUMNS], fog_batch["fog_observed"], FOG_MODEL_PATH, load_tuned_params("fog")
+    )
+    castle_model = continue_training(
+        castle_model,
+        castle_batch[FEATURE_COLUMNS],
+        castle_batch["castle_visible"],
+        CASTLE_MODEL_PATH,
+        load_tuned_params("castle"),
+    )
+    update_history_event_probability(fog_model, castle_model)
+    return None
 
-    feature_df = sortable.loc[feature_mask, FEATURE_COLUMNS].astype(float)
-    fog_prob = pd.Series(fog_model.predict_proba(feature_df)[:, 1], index=feature_df.index)
-    castle_prob = pd.Series(castle_model.predict_proba(feature_df)[:, 1], index=feature_df.index)
 
-    if EVENT_CALIBRATOR_PATH.exists():
-        payload = joblib.load(EVENT_CALIBRATOR_PATH)
-        calibrator = payload["model"]
-        feature_names = payload["feature_names"]
-        calibrator_features = build_calibrator_features(fog_prob, castle_prob)[feature_names]
-        event_prob = calibrator.predict_proba(calibrator_features)[:, 1]
-    else:
-        event_prob = (fog_prob * castle_prob).to_numpy()
-
-    history_raw["castle_event_probability"] = pd.Series(pd.NA, index=history_raw.index, dtype="Float64")
-    history_raw.loc[feature_mask, "castle_event_probability"] = event_prob
-    history_raw.to_csv(HISTORY_CSV, index=False)
-    print("Updated history.csv with castle_event_probability")
+def artifact_record(mode: str, rows: int, now: dt.datetime) -> dict:
+    return {"mode": mode, "trained_at": now.isoformat(), "rows": rows}
 
 
-def main() -> None:
-    df = load_history()
+def train_full(df: pd.DataFrame) -> None:
     X = df[FEATURE_COLUMNS]
 
     # 霧発生モデル
-    fog_model = train_model(X, df["fog_observed"], FOG_MODEL_PATH)
+    fog_model = train_model(X, df["fog_observed"], FOG_MODEL_PATH, load_tuned_params("fog"))
 
     # 天空の城モデル（霧が発生したデータを優先）
-    castle_df = df[df["fog_observed"] == 1]
-    if len(castle_df) >= 2 and castle_df["castle_visible"].nunique() >= 2:
-        castle_model = train_model(castle_df[FEATURE_COLUMNS], castle_df["castle_visible"], CASTLE_MODEL_PATH)
-    else:
+    castle_df, fallback = castle_training_rows(df)
+    if fallback:
         # 霧データが十分でなければ全データで学習
         print("霧発生時のデータが不足しているため、全データで城モデルを学習します。")
-        castle_model = train_model(X, df["castle_visible"], CASTLE_MODEL_PATH)
+    castle_model = train_model(
+        castle_df[FEATURE_COLUMNS], castle_df["castle_visible"], CASTLE_MODEL_PATH, load_tuned_params("castle")
+    )
 
     train_event_calibrator(df, fog_model, castle_model)
     update_history_event_probability(fog_model, castle_model)
 
 
+def main(incremental: bool = False) -> None:
+    df = load_history()
+    now = dt.datetime.now(TZ)
+    state = load_training_state()
+    mode, reason, changed = plan_update(df, state, now) if incremental else ("full", "requested", set())
+
+    if mode == "skip":
+        print(f"Skipping training: {reason}")
+        return
+    if mode == "incremental":
+        print(f"Incremental update: {reason}")
+        fallback = train_incremental(df, changed)
+        if fallback is not None:
+            mode, reason = "full", fallback
+
+    if mode == "full":
+        print(f"Full retrain: {reason}")
+        train_full(df)
+        state = {
+            "full_trained_at": now.isoformat(),
+            "incremental_updates": 0,
+            "calibrator": artifact_record("full", len(df), now),
+        }
+    else:
+        state = {
+            **state,
+            "incremental_updates": state.get("incremental_updates", 0) + 1,
+            "calibrator": {**state.get("calibrator", {}), "mode": "kept"},
+        }
+
+    rows = len(df) if mode == "full" else len(changed)
+    state.update(
+        {
+            "params": params_fingerprint(),
+            "reason": reason,
+            "fog": artifact_record(mode, rows, now),
+            "castle": artifact_record(mode, rows, now),
+            "rows": row_fingerprints(df),
+        }
+    )
+    save_training_state(state)
+    # 学習の記録ごとバンドルに入れるため、状態を保存してから書き出す
+    export_inference_artifacts()
+    print(f"Exported model bundle to {BUNDLE_PATH}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="霧発生モデルと天空の城成立モデルを学習します。")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="前回から増えた・変わった行だけで追加学習する（必要なら自動で全体を学習し直す）。",
+    )
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
+    args = parse_args()
     try:
-        main()
+        main(incremental=args.incremental)
     except Exception as exc:
         print(f"[Error] {exc}", file=sys.stderr)
         sys.exit(1)
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+LightGBM のテキスト形式モデル（booster.save_model の出力）を NumPy だけで評価する。
+
+lightgbm / scikit-learn を import せずに推論できるよう、木ごとの分岐配列
+（split_feature / threshold / decision_type / left_child / right_child / leaf_value）を
+そのまま読み込み、1つの特徴量ベクトルを各木でたどって合計する。
+二値分類（objective=binary）のモデルのみ対応する。
+
+FlatEnsemble は全木の分岐を葉のビットマスクの表に並べ直したもので、行列（複数行）をまとめて評価する。
+(特徴量, 欠損の扱い) ごとに行列全体を1回ずつ二分探索し、FLAT_CHUNK_ROWS 行ずつ表引きして AND で残った葉から
+各木の出口を求める（ループは特徴量の数だけで、木の数や深さによらない）。
+保存は model_bundle が行う（to_arrays / from_arrays）。
+"""
+
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# LightGBM の decision_type のビット構成
+_DEFAULT_LEFT_MASK = 2
+_MISSING_TYPE_SHIFT = 2
+_MISSING_NONE = 0
+_MISSING_ZERO = 1
+_MISSING_NAN = 2
+_ZERO_THRESHOLD = 1e-35
+# FlatEnsemble で一度に評価する行数（作業用の (行数, 木の数) の配列が CPU キャッシュに収まる程度）
+FLAT_CHUNK_ROWS = 256
+# 1本の木の葉の数の上限（葉を 64bit の語のビットに割り当てる）
+MAX_LEAVES = 64
+_ALL_LEAVES = np.uint64(0xFFFFFFFFFFFFFFFF)
+# 最下位ビットだけが立った語に掛けて上位 6bit を取ると、ビットの位置ごとに異なる値（de Bruijn 列）になる
+_DEBRUIJN = np.uint64(0x03F79D71B4CB0A89)
+_DEBRUIJN_SLOT = [((1 << bit) * 0x03F79D71B4CB0A89 % (1 << 64)) >> 58 for bit in range(64)]
+
+
+@dataclass
+class Tree:
+    split_feature: np.ndarray
+    threshold: np.ndarray
+    decision_type: np.ndarray
+    left_child: np.ndarray
+    right_child: np.ndarray
+    leaf_value: np.ndarray
+
+
+@dataclass
+class TreeEnsemble:
+    feature_names: List[str]
+    trees: List[Tree]
+    sigmoid: float = 1.0
+
+    def raw_score(self, features: np.ndarray) -> float:
+        """1行分の特徴量（feature_names の順）に対する生スコア（木の出力の合計）。"""
+        values = [float(value) for value in features]
+        total = 0.0
+        for tree in self.trees:
+            if not len(tree.split_feature):
+                total += float(tree.leaf_value[0])
+                continue
+            node = 0
+            while node >= 0:
+                value = values[tree.split_feature[node]]
+                decision = int(tree.decision_type[node])
+                missing_type = (decision >> _MISSING_TYPE_SHIFT) & 3
+                if math.isnan(value) and missing_type != _MISSING_NAN:
+                    value = 0.0
+                if (missing_type == _MISSING_ZERO and abs(value) <= _ZERO_THRESHOLD) or (
+                    missing_type == _MISSING_NAN and math.isnan(value)
+                ):
+                    go_left = bool(decision & _DEFAULT_LEFT_MASK)
+                else:
+                    go_left = value <= tree.threshold[node]
+                node = int(tree.left_child[node] if go_left else tree.right_child[node])
+            total += float(tree.leaf_value[~node])
+        return total
+
+    def predict_proba(self, features: np.ndarray) -> float:
+        """1行分の特徴量に対する陽性クラスの確率（LGBMClassifier.predict_proba[:, 1] と同じ値）。"""
+        return 1.0 / (1.0 + math.exp(-self.sigmoid * self.raw_score(features)))
+
+    def flatten(self) -> "FlatEnsemble":
+        """全木を、葉のビットマスクで評価する FlatEnsemble に変換する（葉が MAX_LEAVES を超える木があれば ValueError）。"""
+        # 各木の葉を左から順に並べ、葉の数のビット幅で 64bit の語に詰める（語をまたがない）
+        tree_word, tree_mask, slots, clears = [], [], [], []
+        word, bit = 0, 0
+        for tree in self.trees:
+            ranks, left_leaves = _leaf_layout(tree)
+            leaves = len(ranks)
+            if leaves > MAX_LEAVES:
+                raise ValueError(f"葉が {MAX_LEAVES} を超える木には対応していません（{leaves} 枚）。")
+            if bit + leaves > MAX_LEAVES:
+                word, bit = word + 1, 0
+            tree_word.append(word)
+            tree_mask.append(((1 << leaves) - 1) << bit)
+            slots.extend(
+                (word * MAX_LEAVES + _DEBRUIJN_SLOT[bit + rank], float(value))
+                for rank, value in zip(ranks, tree.leaf_value)
+            )
+            for node, mask in enumerate(left_leaves):
+                decision = int(tree.decision_type[node])
+                clears.append(
+                    (
+                        int(tree.split_feature[node]),
+                        (decision >> _MISSING_TYPE_SHIFT) & 3,
+                        float(tree.threshold[node]),
+                        not decision & _DEFAULT_LEFT_MASK,
+                        word,
+                        mask << bit,
+                    )
+                )
+            bit += leaves
+        words = word + 1 if self.trees else 0
+        slot_value = np.zeros(words * MAX_LEAVES)
+        word_lowest = np.zeros(words, dtype=np.uint64)
+        for word, mask in zip(tree_word, tree_mask):
+            word_lowest[word] |= np.uint64(mask & -mask)
+        for slot, value in slots:
+            slot_value[slot] = value
+
+        # (特徴量, 欠損の扱い) ごとに、閾値の小さい順に「右へ進む分岐の左側の葉」を消したマスクを累積する
+        groups = sorted({(feature, missing) for feature, missing, *_ in clears})
+        group_offset = [0]
+        thresholds, tables = [], []
+        for feature, missing in groups:
+            nodes = [clear for clear in clears if clear[:2] == (feature, missing)]
+            values = np.unique([threshold for _, _, threshold, *_ in nodes])
+            table = np.full((len(values) + 2, words), _ALL_LEAVES, dtype=np.uint64)
+            for _, _, threshold, default_right, node_word, mask in nodes:
+                index = int(np.searchsorted(values, threshold))
+                table[index + 1, node_word] &= np.uint64(~mask & int(_ALL_LEAVES))
+                if default_right:
+                    table[-1, node_word] &= np.uint64(~mask & int(_ALL_LEAVES))
+            table[: len(values) + 1] = np.bitwise_and.accumulate(table[: len(values) + 1], axis=0)
+            thresholds.append(values)
+            tables.append(table)
+            group_offset.append(group_offset[-1] + len(values))
+
+        return FlatEnsemble(
+            feature_names=list(self.feature_names),
+            masks=np.concatenate(tables) if tables else np.empty((0, words), dtype=np.uint64),
+            thresholds=np.concatenate(thresholds) if thresholds else np.empty(0),
+            group_feature=np.array([feature for feature, _ in groups], dtype=np.int32),
+            group_missing=np.array([missing for _, missing in groups], dtype=np.int8),
+            group_offset=np.array(group_offset, dtype=np.int64),
+            tree_word=np.array(tree_word, dtype=np.int64),
+            tree_mask=np.array(tree_mask, dtype=np.uint64),
+            word_lowest=word_lowest,
+            slot_value=slot_value,
+            sigmoid=self.sigmoid,
+        )
+
+
+def _leaf_layout(tree: Tree) -> Tuple[np.ndarray, List[int]]:
+    """(葉番号 → 左からの順位, 内部ノードごとの左の部分木の葉のビットマスク（順位のビット）)。"""
+    if not len(tree.split_feature):
+        return np.zeros(1, dtype=np.int64), []
+    order: List[int] = []
+    masks = [0] * len(tree.split_feature)
+
+    def walk(child: int) -> int:
+        if child < 0:
+            order.append(~child)
+            return 1 << (len(order) - 1)
+        left = walk(int(tree.left_child[child]))
+        masks[child] = left
+        return left | walk(int(tree.right_child[child]))
+
+    walk(0)
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[order] = np.arange(len(order))
+    return ranks, masks
+
+
+@dataclass
+class FlatEnsemble:
+    """全木をまとめて評価するための、葉のビットマスクの表（QuickScorer と同じ考え方）。
+
+    各木の葉を左から順に並べて 64bit の語のビットに割り当てる（tree_word の語の tree_mask のビット）。
+    分岐が右へ進むと、その分岐の左の部分木の葉は出口になりえない。(特徴量, 欠損の扱い) のグループごとに
+    閾値を昇順に並べ（thresholds[group_offset[g]:group_offset[g + 1]]）、masks の行には「値より小さい
+    閾値の分岐の左の葉をすべて消したマスク」を並べる（各グループの末尾の2行は、どの閾値より大きい値の行の
+    次に、欠損を既定の向きに送ったときのマスク）。全グループのマスクの AND で残った最も左の葉が各木の出口になる。
+    各木の最も右の葉はどの分岐でも消えないので、語から word_lowest（語の中の各木の最下位ビット）を引くと
+    木をまたぐ繰り下がりは起きず、x & ~(x - word_lowest) で語の中の全木の出口のビットが一度に残る。
+    葉の値は slot_value[語 * MAX_LEAVES + 出口のビットの de Bruijn 値] に置く（ビットの位置から直接引ける）。
+    どの配列も保存した形のまま（mmap した配列のまま）評価に使う。欠損値の扱いは TreeEnsemble.raw_score と同じ。
+    """
+
+    ARRAYS = {
+        "masks": np.uint64,
+        "thresholds": np.float64,
+        "group_feature": np.int32,
+        "group_missing": np.int8,
+        "group_offset": np.int64,
+        "tree_word": np.int64,
+        "tree_mask": np.uint64,
+        "word_lowest": np.uint64,
+        "slot_value": np.float64,
+    }
+
+    feature_names: List[str]
+    masks: np.ndarray
+    thresholds: np.ndarray
+    group_feature: np.ndarray
+    group_missing: np.ndarray
+    group_offset: np.ndarray
+    tree_word: np.ndarray
+    tree_mask: np.ndarray
+    word_lowest: np.ndarray
+    slot_value: np.ndarray
+    sigmoid: float = 1.0
+
+    def _column_indices(self, values: np.ndarray) -> np.ndarray:
+        """(行数, グループ数) の、各行・各グループで使う masks の行番号。"""
+        index = np.empty((len(values), len(self.group_feature)), dtype=np.intp)
+        for group in range(len(self.group_feature)):
+            start, stop = int(self.group_offset[group]), int(self.group_offset[group + 1])
+            column = values[:, self.group_feature[group]]
+            missing_type = self.group_missing[group]
+            if missing_type == _MISSING_NONE:
+                # NaN を欠損扱いしない分岐では 0 として閾値と比べる
+                index[:, group] = np.searchsorted(self.thresholds[start:stop], np.nan_to_num(column, nan=0.0))
+            else:
+                index[:, group] = np.searchsorted(self.thresholds[start:stop], column)
+                missing = np.isnan(column)
+                if missing_type == _MISSING_ZERO:
+                    missing |= np.abs(column) <= _ZERO_THRESHOLD
+                index[missing, group] = stop - start + 1
+        index += self.group_offset[:-1] + 2 * np.arange(len(self.group_feature))
+        return index
+
+    def _chunk_scores(self, index: np.ndarray) -> np.ndarray:
+        """_column_indices の行（FLAT_CHUNK_ROWS 行まで）の生スコア。"""
+        # （作業用の配列は大きいので、確保し直さずにその場で計算する）
+        alive = np.full((len(index), self.masks.shape[1]), _ALL_LEAVES, dtype=np.uint64)
+        for group in range(index.shape[1]):
+            alive &= self.masks[index[:, group]]
+        exits = alive - self.word_lowest
+        np.invert(exits, out=exits)
+        exits &= alive
+        # (木, 行) ごとにその木の出口のビットを取り出し、de Bruijn 値から葉の値を引く
+        slots = exits.T[self.tree_word]
+        slots &= self.tree_mask[:, np.newaxis]
+        slots *= _DEBRUIJN
+        slots >>= np.uint64(58)
+        slots = slots.view(np.int64)
+        slots += self.tree_word[:, np.newaxis] * MAX_LEAVES
+        # LightGBM と同じく木の順に足す
+        return np.take(self.slot_value, slots).sum(axis=0)
+
+    def raw_scores(self, features: np.ndarray) -> np.ndarray:
+        """特徴量の行列（feature_names の順。1次元なら1行）の各行の生スコア。"""
+        index = self._column_indices(np.atleast_2d(np.asarray(features, dtype=np.float64)))
+        scores = np.empty(len(index))
+        for start in range(0, len(index), FLAT_CHUNK_ROWS):
+            scores[start : start + FLAT_CHUNK_ROWS] = self._chunk_scores(index[start : start + FLAT_CHUNK_ROWS])
+        return scores
+
+    def predict_proba(self, features: np.ndarray) -> np.ndarray:
+        """各行の陽性クラスの確率（LGBMClassifier.predict_proba[:, 1] と同じ値）。"""
+        return 1.0 / (1.0 + np.exp(-self.sigmoid * self.raw_scores(features)))
+
+    def to_arrays(self, prefix: str = "") -> Dict[str, np.ndarray]:
+        """保存用の配列（名前の先頭に prefix を付ける）。feature_names / sigmoid は別に保存する。"""
+        return {f"{prefix}{name}": getattr(self, name) for name in self.ARRAYS}
+
+    @classmethod
+    def from_arrays(
+        cls,
+        arrays: Dict[str, np.ndarray],
+        feature_names: List[str],
+        sigmoid: float,
+        prefix: str = "",
+    ) -> "FlatEnsemble":
+        """to_arrays で保存した配列（mmap した配列のままでよい。コピーや評価用の表は作らない）から作る。"""
+        fields = {name: arrays[f"{prefix}{name}"] for name in cls.ARRAYS}
+        return cls(feature_names=list(feature_names), sigmoid=float(sigmoid), **fields)
+
+
+def _parse_array(value: str, dtype) -> np.ndarray:
+    if not value:
+        return np.empty(0, dtype=dtype)
+    return np.array(value.split(" "), dtype=dtype)
+
+
+def parse_model_text(text: str) -> TreeEnsemble:
+    """LightGBM のテキスト形式モデルを TreeEnsemble に変換する。"""
+    header: Dict[str, str] = {}
+    blocks: List[Dict[str, str]] = []
+    current = header
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("Tree="):
+            current = {}
+            blocks.append(current)
+            continue
+        if line == "end of trees":
+            break
+        if "=" in line:
+            key, value = line.split("=", 1)
+            current[key] = value
+
+    objective = header.get("objective", "")
+    if not objective.startswith("binary") or header.get("num_tree_per_iteration", "1") != "1":
+        raise ValueError(f"二値分類以外のモデルには対応していません（objective={objective}）。")
+    sigmoid = 1.0
+    for token in objective.split(" ")[1:]:
+        if token.startswith("sigmoid:"):
+            sigmoid = float(token.split(":", 1)[1])
+
+    trees = []
+    for block in blocks:
+        if int(block.get("num_cat", "0")) > 0:
+            raise ValueError("カテゴリ分岐を含むモデルには対応していません。")
+        trees.append(
+            Tree(
+                split_feature=_parse_array(block.get("split_feature", ""), np.int32),
+                threshold=_parse_array(block.get("threshold", ""), np.float64),
+                decision_type=_parse_array(block.get("decision_type", ""), np.int8),
+                left_child=_parse_array(block.get("left_child", ""), np.int32),
+                right_child=_parse_array(block.get("right_child", ""), np.int32),
+                leaf_value=_parse_array(block["leaf_value"], np.float64),
+            )
+        )
+    return TreeEnsemble(feature_names=header.get("feature_names", "").split(" "), trees=trees, sigmoid=sigmoid)
+
+
+def load_model_text(path: Path) -> TreeEnsemble:
+    return parse_model_text(Path(path).read_text(encoding="utf-8"))
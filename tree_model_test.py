@@ -0,0 +1,105 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import model_bundle
+from tree_model import parse_model_text
+
+lightgbm = pytest.importorskip("lightgbm")
+
+
+def synthetic_data(rows: int = 600, seed: int = 0):
+    """NaN と 0 をちょうど含む特徴量と、それに依存するラベル。"""
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(rows, 4))
+    X[rng.random(rows) < 0.2, 0] = np.nan
+    X[rng.random(rows) < 0.2, 1] = 0.0
+    X[rng.random(rows) < 0.1, 2] = np.nan
+    X[rng.random(rows) < 0.1, 2] = 0.0
+    signal = np.nan_to_num(X[:, 0], nan=1.5) + (X[:, 1] == 0) * 1.0 - X[:, 2] ** 2 + 0.5 * X[:, 3]
+    y = (signal + rng.normal(scale=0.5, size=rows) > 0).astype(int)
+    return X, y
+
+
+def probe_inputs():
+    rng = np.random.default_rng(1)
+    X = rng.normal(size=(300, 4))
+    X[::3, 0] = np.nan
+    X[::4, 1] = 0.0
+    X[::5, 2] = np.nan
+    X[::7, 2] = 0.0
+    X[::11, 3] = -0.0
+    X[0] = np.nan
+    X[1] = 0.0
+    return X
+
+
+@pytest.mark.parametrize("params", [{}, {"zero_as_missing": True}, {"use_missing": False}])
+def test_flat_ensemble_matches_lightgbm(params):
+    X, y = synthetic_data()
+    model = lightgbm.LGBMClassifier(n_estimators=30, num_leaves=8, min_child_samples=5, verbose=-1, **params)
+    model.fit(X, y)
+    ensemble = parse_model_text(model.booster_.model_to_string())
+    flat = ensemble.flatten()
+
+    inputs = probe_inputs()
+    expected = model.predict_proba(inputs)[:, 1]
+    np.testing.assert_allclose(flat.predict_proba(inputs), expected, rtol=0, atol=1e-12)
+    np.testing.assert_allclose([ensemble.predict_proba(row) for row in inputs], expected, rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize("num_leaves", [2, 33, 63])
+def test_flat_ensemble_packs_trees_into_words(num_leaves):
+    # 2枚なら1語に32本、33枚以上なら1語に1本ずつ（語をまたいで詰めない）
+    X, y = synthetic_data(rows=3000)
+    model = lightgbm.LGBMClassifier(
+        n_estimators=40, num_leaves=num_leaves, min_child_samples=2, verbose=-1, use_missing=False
+    ).fit(X, y)
+    flat = parse_model_text(model.booster_.model_to_string()).flatten()
+
+    inputs = np.vstack([probe_inputs(), synthetic_data(rows=2000, seed=2)[0]])
+    np.testing.assert_allclose(flat.predict_proba(inputs), model.predict_proba(inputs)[:, 1], rtol=0, atol=1e-12)
+
+
+def test_flatten_rejects_trees_with_too_many_leaves():
+    X, y = synthetic_data(rows=3000)
+    model = lightgbm.LGBMClassifier(n_estimators=2, num_leaves=80, min_child_samples=2, verbose=-1).fit(X, y)
+    ensemble = parse_model_text(model.booster_.model_to_string())
+    if max(len(tree.leaf_value) for tree in ensemble.trees) <= 64:
+        pytest.skip("葉が 64 枚を超える木ができなかった")
+    with pytest.raises(ValueError):
+        ensemble.flatten()
+
+
+def test_bundle_round_trip(tmp_path):
+    X, y = synthetic_data()
+    model = lightgbm.LGBMClassifier(n_estimators=10, num_leaves=8, verbose=-1).fit(X, y)
+    flat = parse_model_text(model.booster_.model_to_string()).flatten()
+    bundle = model_bundle.ModelBundle(
+        fog=flat,
+        castle=flat,
+        calibrator=None,
+        feature_columns=flat.feature_names,
+    )
+    path = tmp_path / "bundle.cols"
+    model_bundle.write_bundle(bundle, path)
+
+    loaded = model_bundle.read_bundle(path)
+    assert loaded.fog.feature_names == flat.feature_names
+    inputs = probe_inputs()
+    np.testing.assert_allclose(loaded.fog.predict_proba(inputs), model.predict_proba(inputs)[:, 1], atol=1e-12)
+
+    # バンドルの読み込みと推論では lightgbm を import しない
+    script = (
+        "import sys, numpy as np, model_bundle\n"
+        f"bundle = model_bundle.read_bundle({str(path)!r})\n"
+        "model_bundle.BundleClassifier(bundle.fog).predict_proba(np.zeros((20000, 4)))\n"
+        "print('lightgbm' in sys.modules)\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script], cwd=Path(__file__).parent, capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == "False"
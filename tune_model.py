@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+霧モデル・城モデルの LightGBM の設定を successive halving で探索し、
+model/skycastle_params.json に保存する（train_model.py が次回の学習から使う）。
+
+  python tune_model.py --candidates 27 --budget 600
+
+  - 候補は現在の設定（train_model.MODEL_PARAMS）と、探索空間から無作為に選んだ設定
+  - 検証は backtest と同じ時系列の fold（学習は常に評価期間より過去）。最初は直近の
+    MIN_FOLDS 個の fold だけで全候補を評価し、対数損失の良い上位 1/ETA を残して fold を増やす
+  - 各 fold の学習では、学習期間の末尾 VALIDATION_FRACTION を検証用に取り分けて early stopping を行い、
+    最終的な木の数は生き残った候補の best_iteration の中央値にする
+  - (候補, fold) の組をプロセスプールで並列に評価する。各プロセスの LightGBM のスレッド数は
+    CPU 数をプロセス数で割った値にする
+  - --budget（秒）を過ぎたら新しい評価を打ち切り、それまでに最も多くの fold で評価できた候補から選ぶ
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from zoneinfo import ZoneInfo
+
+import backtest
+import columnar
+import train_model
+
+MODELS = ["fog", "castle"]
+DEFAULT_CANDIDATES = 27
+DEFAULT_BUDGET = 600.0
+ETA = 3
+MIN_FOLDS = 2
+MAX_ESTIMATORS = 1000
+EARLY_STOPPING_ROUNDS = 30
+VALIDATION_FRACTION = 0.2
+MIN_VALIDATION_ROWS = 10
+TZ = ZoneInfo("Asia/Tokyo")
+
+
+def sample_params(rng: np.random.Generator) -> dict:
+    """探索空間から設定を1つ選ぶ。"""
+    return {
+        "objective": "binary",
+        "num_leaves": int(rng.integers(4, 64)),
+        "learning_rate": float(10 ** rng.uniform(-2.0, -0.7)),
+        "min_child_samples": int(rng.integers(5, 41)),
+        "subsample": float(rng.uniform(0.6, 1.0)),
+        "subsample_freq": 1,
+        "colsample_bytree": float(rng.uniform(0.6, 1.0)),
+        "reg_lambda": float(10 ** rng.uniform(-3.0, 1.0)),
+        "random_state": train_model.MODEL_PARAMS["random_state"],
+    }
+
+
+def fold_frames(path: Path, fold: int, model: str) -> Tuple[pd.DataFrame, pd.DataFrame, str]:
+    """fold の (学習行, 評価行, 目的変数の列名)。城モデルは霧が発生した日で学習・評価する。"""
+    metadata, arrays = columnar.read_arrays(path)
+    test_start, test_end = metadata["folds"][fold]
+    frame = pd.DataFrame(arrays["features"], columns=metadata["feature_columns"])
+    frame["fog_observed"] = arrays["fog_observed"].astype(int)
+    frame["castle_visible"] = arrays["castle_visible"].astype(int)
+    train, test = frame.iloc[:test_start], frame.iloc[test_start:test_end]
+    if model == "fog":
+        return train, test, "fog_observed"
+    train, _ = train_model.castle_training_rows(train)
+    return train, test[test["fog_observed"] == 1], "castle_visible"
+
+
+def evaluate(path: Path, fold: int, model: str, params: dict, n_jobs: int) -> Optional[Tuple[float, int]]:
+    """1つの (候補, fold) を学習・評価し、(評価期間の対数損失, best_iteration) を返す。
+
+    学習できない（ラベルが1種類しかない）・評価する行が無い fold は None。
+    """
+    train, test, target = fold_frames(path, fold, model)
+    if test.empty:
+        return None
+    columns = train_model.FEATURE_COLUMNS
+    settings = {**params, "n_estimators": MAX_ESTIMATORS, "n_jobs": n_jobs, "verbose": -1}
+    validation_rows = int(len(train) * VALIDATION_FRACTION)
+    fit_params = None
+    if validation_rows >= MIN_VALIDATION_ROWS:
+        import lightgbm as lgb
+
+        train, validation = train.iloc[:-validation_rows], train.iloc[-validation_rows:]
+        fit_params = {
+            "eval_set": [(validation[columns], validation[target])],
+            "callbacks": [lgb.early_stopping(EARLY_STOPPING_ROUNDS, verbose=False)],
+        }
+    else:
+        settings["n_estimators"] = params.get("n_estimators", train_model.MODEL_PARAMS["n_estimators"])
+    try:
+        classifier = train_model.fit_classifier(train[columns], train[target], model, fit_params, **settings)
+    except ValueError:
+        return None
+    probs = classifier.predict_proba(test[columns])[:, 1]
+    best_iteration = int(classifier.best_iteration_ or settings["n_estimators"])
+    return backtest.log_loss(probs, test[target].to_numpy(dtype=float)), best_iteration
+
+
+class Search:
+    """1つのモデルについて、候補ごとの fold の評価結果を持つ。"""
+
+    def __init__(self, model: str, candidates: List[dict]) -> None:
+        self.model = model
+        self.candidates = candidates
+        self.alive = list(range(len(candidates)))
+        self.results: Dict[int, Dict[int, Optional[Tuple[float, int]]]] = {i: {} for i in self.alive}
+
+    def score(self, index: int) -> float:
+        losses = [result[0] for result in self.results[index].values() if result is not None]
+        return float(np.mean(losses)) if losses else float("inf")
+
+    def promote(self, keep: int) -> None:
+        self.alive = sorted(self.alive, key=self.score)[:keep]
+
+    def best(self) -> Tuple[int, int]:
+        """最も多くの fold で評価できた候補のうち、対数損失が最小のもの（候補番号, fold 数）。"""
+        depth = max(len(self.results[i]) for i in range(len(self.candidates)))
+        finished = [i for i in range(len(self.candidates)) if len(self.results[i]) == depth]
+        return min(finished, key=self.score), depth
+
+    def best_config(self) -> Optional[dict]:
+        """保存する設定。どの fold でも評価できなかった場合は None（MODEL_PARAMS のまま学習する）。"""
+        index, depth = self.best()
+        if not np.isfinite(self.score(index)):
+            return None
+        baseline = self.score(0)
+        iterations = [result[1] for result in self.results[index].values() if result is not None]
+        params = dict(self.candidates[index])
+        if iterations:
+            params["n_estimators"] = int(np.median(iterations))
+        return {
+            "params": params,
+            "log_loss": self.score(index),
+            "baseline_log_loss": baseline if len(self.results[0]) == depth and np.isfinite(baseline) else None,
+            "folds_evaluated": depth,
+        }
+
+
+def rung_folds(total: int) -> List[int]:
+    """各段階で評価に使う fold 数（MIN_FOLDS から ETA 倍ずつ、最後は全 fold）。"""
+    counts = []
+    count = min(MIN_FOLDS, total)
+    while count < total:
+        counts.append(count)
+        count *= ETA
+    counts.append(total)
+    return counts
+
+
+def run_search(
+    folds: int,
+    candidates: int,
+    budget: float,
+    workers: int,
+    seed: int = 0,
+) -> Dict[str, Search]:
+    path = backtest.prepare_folds(folds)
+    deadline = time.monotonic() + budget
+    rng = np.random.default_rng(seed)
+    baseline = dict(train_model.MODEL_PARAMS)
+    searches = {
+        model: Search(model, [baseline] + [sample_params(rng) for _ in range(max(candidates - 1, 0))])
+        for model in MODELS
+    }
+    workers = max(1, workers)
+    n_jobs = max(1, (os.cpu_count() or 1) // workers)
+
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        for rung, count in enumerate(rung_folds(folds)):
+            # 直近の count 個の fold のうち、まだ評価していないものだけを投げる
+            wanted = list(range(folds - count, folds))
+            pending = {}
+            for search in searches.values():
+                for index in search.alive:
+                    for fold in wanted:
+                        if fold not in search.results[index]:
+                            params = search.candidates[index]
+                            future = executor.submit(evaluate, path, fold, search.model, params, n_jobs)
+                            pending[future] = (search, index, fold)
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    print(f"Budget of {budget:.0f}s exhausted during rung {rung}; stopping early.")
+                    return searches
+                done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    search, index, fold = pending.pop(future)
+                    search.results[index][fold] = future.result()
+            for search in searches.values():
+                search.promote(max(1, len(search.alive) // ETA))
+                index = search.alive[0]
+                print(
+                    f"rung {rung}: {search.model} folds={count} best log_loss={search.score(index):.4f} "
+                    f"(candidate {index}, {len(search.alive)} kept)"
+                )
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return searches
+
+
+def save_params(searches: Dict[str, Search], path: Path, folds: int, budget: float) -> dict:
+    payload = {
+        "searched_at": dt.datetime.now(TZ).isoformat(),
+        "folds": folds,
+        "budget_seconds": budget,
+    }
+    for model, search in searches.items():
+        config = search.best_config()
+        if config is not None:
+            payload[model] = config
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    return payload
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="霧・城モデルの LightGBM の設定を探索します。")
+    parser.add_argument("--folds", type=int, default=backtest.DEFAULT_FOLDS, help="時系列 fold の数。")
+    parser.add_argument("--candidates", type=int, default=DEFAULT_CANDIDATES, help="最初に評価する候補数。")
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET, help="探索に使う秒数の上限。")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="並列に評価するプロセス数（既定は CPU 数）。",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, default=train_model.TUNED_PARAMS_PATH, help="設定の保存先。")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    if args.folds < 1 or args.candidates < 1:
+        raise SystemExit("--folds と --candidates は 1 以上を指定してください。")
+    started = time.perf_counter()
+    searches = run_search(args.folds, args.candidates, args.budget, args.workers, args.seed)
+    payload = save_params(searches, args.output, args.folds, args.budget)
+    for model in MODELS:
+        config = payload.get(model)
+        if config is None:
+            print(f"{model}: no fold could be evaluated; keeping the default parameters")
+            continue
+        baseline = config["baseline_log_loss"]
+        baseline_text = f"{baseline:.4f}" if baseline is not None else "n/a"
+        print(
+            f"{model}: log_loss={config['log_loss']:.4f} (baseline {baseline_text}) "
+            f"over {config['folds_evaluated']} folds, n_estimators={config['params'].get('n_estimators')}"
+        )
+    print(f"Saved tuned parameters to {args.output} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()